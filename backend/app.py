@@ -4,7 +4,7 @@
 基于Flask + Redis + MySQL架构
 """
 
-from flask import Flask, request, jsonify, session, send_file
+from flask import Flask, request, jsonify, session, send_file, Response, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_session import Session
@@ -14,6 +14,7 @@ import os
 import sys
 from pathlib import Path
 import json
+import time
 from datetime import datetime, timedelta
 import hashlib
 import jwt
@@ -21,7 +22,7 @@ from functools import wraps
 import pymysql
 pymysql.install_as_MySQLdb()
 from sqlalchemy import text
-from config import Config
+from config import Config, MODEL_CONFIGS
 
 sys.path.append(str(Path(__file__).parent.parent))
 
@@ -29,11 +30,12 @@ sys.path.append(str(Path(__file__).parent.parent))
 try:
     from services.medical_qa_service import MedicalQAService
     from services.heart_disease_service import HeartDiseaseService
-    from services.tumor_service import TumorService
+    from services.tumor_service import TumorService, AGGREGATION_STRATEGIES, DocumentTooLongError
     from services.diabetes_service import DiabetesService
-    from services.chest_xray_service import ChestXrayService
+    from services.chest_xray_service import ChestXrayService, HEATMAP_MODES
     from services.report_export_service import ReportExportService
     from utils.redis_manager import get_redis_manager
+    from utils.job_manager import JobManager, FINISHED_STATES, JOB_SUCCEEDED
 except ImportError as e:
     print(f"导入AI服务失败: {e}")
     sys.exit(1)
@@ -127,6 +129,16 @@ except Exception as e:
     logger.error(f"❌ AI服务初始化失败: {e}")
     sys.exit(1)
 
+# 胸部X光异步任务（有界线程池，避免耗时的CAM计算占用请求线程）
+chest_xray_job_config = MODEL_CONFIGS['chest_xray']['jobs']
+chest_xray_jobs = JobManager(
+    name='chest_xray',
+    max_workers=chest_xray_job_config['max_workers'],
+    max_pending=chest_xray_job_config['max_pending'],
+    redis_manager=redis_manager,
+    result_ttl=chest_xray_job_config['result_ttl']
+)
+
 # 认证装饰器
 def login_required(f):
     @wraps(f)
@@ -151,6 +163,35 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def parse_bool(value) -> bool:
+    """
+    解析布尔参数，只接受JSON布尔值和明确的字符串/数字取值
+    
+    Raises:
+        ValueError: 无法识别的取值
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered in ('true', '1', 'yes', 'on'):
+            return True
+        if lowered in ('false', '0', 'no', 'off', ''):
+            return False
+    raise ValueError(f"无效的布尔值: {value!r}")
+
+def format_sse(event: str, data) -> str:
+    """格式化Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(events) -> Response:
+    """构建Server-Sent Events流式响应"""
+    response = Response(stream_with_context(events), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 禁止反向代理缓冲
+    return response
 
 # 健康检查
 @app.route('/health', methods=['GET'])
@@ -176,6 +217,7 @@ def health_check():
             'status': 'healthy',
             'timestamp': datetime.utcnow().isoformat(),
             'services': services_status,
+            'chest_xray_startup': getattr(chest_xray_service, 'startup_stats', None),
             'database': 'connected',
             'redis': 'connected' if redis_status else 'disconnected'
         })
@@ -249,35 +291,31 @@ def clear_cache():
 @app.route('/api/cache/keys', methods=['GET'])
 @login_required
 def get_cache_keys():
-    """获取缓存键列表"""
+    """按游标分页获取缓存键列表"""
     try:
         if not redis_manager:
             return jsonify({'error': 'Redis未配置'}), 503
         
         pattern = request.args.get('pattern', '*')
-        limit = min(int(request.args.get('limit', 100)), 1000)  # 限制最大返回数量
-        
-        # 获取匹配的键
-        keys = redis_manager.redis_client.keys(pattern)[:limit]
-        
-        # 获取键的详细信息
-        key_info = []
-        for key in keys:
-            try:
-                ttl = redis_manager.redis_client.ttl(key)
-                key_info.append({
-                    'key': key.decode('utf-8') if isinstance(key, bytes) else key,
-                    'ttl': ttl if ttl > 0 else -1,  # -1表示永不过期
-                    'type': redis_manager.redis_client.type(key).decode('utf-8')
-                })
-            except Exception as e:
-                logger.warning(f"获取键信息失败: {key}, 错误: {e}")
+        cursor = request.args.get('cursor', '0')
+        # 兼容旧参数limit
+        count = request.args.get('count', request.args.get('limit', '100'))
+        if not cursor.isdigit():
+            return jsonify({'error': '无效的游标'}), 400
+        # 单页数量限制为1-1000
+        if not count.isdigit() or not 1 <= int(count) <= 1000:
+            return jsonify({'error': 'count必须是1到1000之间的整数'}), 400
+        count = int(count)
+        
+        page = redis_manager.list_keys(pattern, cursor=cursor, count=count)
         
         return jsonify({
             'success': True,
             'data': {
-                'keys': key_info,
-                'total': len(key_info),
+                'keys': page['keys'],
+                'total': len(page['keys']),
+                'cursor': page['cursor'],
+                'has_more': page['cursor'] != '0',
                 'pattern': pattern
             },
             'timestamp': datetime.utcnow().isoformat()
@@ -398,9 +436,15 @@ def medical_qa():
         if not question:
             return jsonify({'error': '问题不能为空'}), 400
         
+        # 单次请求的生成参数（可选）
+        try:
+            generation_config = medical_qa_service.resolve_generation_config(data.get('generation'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # 调用医疗问答服务（传递用户ID以支持缓存）
         user_id = str(request.current_user.id)
-        result = medical_qa_service.predict(question, user_id)
+        result = medical_qa_service.predict(question, user_id, generation_config)
         
         # 保存预测记录
         record = PredictionRecord(
@@ -423,6 +467,64 @@ def medical_qa():
         db.session.rollback()
         return jsonify({'error': '预测失败', 'detail': str(e)}), 500
 
+@app.route('/api/medical_qa/stream', methods=['POST'])
+@login_required
+def medical_qa_stream():
+    """医疗问答流式接口（Server-Sent Events）"""
+    data = request.get_json() or {}
+    question = data.get('question', '').strip()
+    
+    if not question:
+        return jsonify({'error': '问题不能为空'}), 400
+    
+    try:
+        generation_config = medical_qa_service.resolve_generation_config(data.get('generation'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    current_user_id = request.current_user.id
+    
+    def generate_events():
+        events = medical_qa_service.stream_predict(question, str(current_user_id), generation_config)
+        try:
+            for event in events:
+                if event['event'] == 'done':
+                    # 生成结束后保存预测记录
+                    result = event['data']
+                    try:
+                        record = PredictionRecord(
+                            user_id=current_user_id,
+                            model_type='medical_qa',
+                            input_data=json.dumps({'question': question}),
+                            prediction_result=json.dumps(result),
+                            confidence_score=result.get('confidence', 0.0)
+                        )
+                        db.session.add(record)
+                        db.session.commit()
+                    except Exception as e:
+                        logger.error(f"保存医疗问答记录失败: {e}")
+                        db.session.rollback()
+                yield format_sse(event['event'], event['data'])
+        finally:
+            # 客户端断开时响应被关闭，显式关闭内层生成器以停止后台生成
+            events.close()
+    
+    return sse_response(generate_events())
+
+@app.route('/api/medical_qa/stats', methods=['GET'])
+@login_required
+def medical_qa_stats():
+    """医疗问答模型运行统计（量化模式、内存占用、生成速度）"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': medical_qa_service.get_model_stats(),
+            'timestamp': datetime.utcnow().isoformat()
+        })
+    except Exception as e:
+        logger.error(f"获取医疗问答统计失败: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/heart_disease', methods=['POST'])
 @login_required
 def heart_disease():
@@ -467,18 +569,28 @@ def tumor():
     try:
         data = request.get_json()
         text = data.get('text')
+        aggregation = data.get('aggregation')
         
         if not text:
             return jsonify({'error': '文本不能为空'}), 400
+        try:
+            long_document = parse_bool(data.get('long_document', False))
+        except ValueError:
+            return jsonify({'error': 'long_document必须是布尔值'}), 400
+        if aggregation is not None and aggregation not in AGGREGATION_STRATEGIES:
+            return jsonify({'error': f"aggregation必须是{'/'.join(AGGREGATION_STRATEGIES)}之一"}), 400
         
         # 调用AI服务
-        result = tumor_service.predict(text)
+        try:
+            result = tumor_service.predict(text, long_document=long_document, aggregation=aggregation)
+        except DocumentTooLongError as e:
+            return jsonify({'error': str(e)}), 400
         
         # 保存预测记录
         record = PredictionRecord(
             user_id=request.current_user.id,
             model_type='tumor',
-            input_data=json.dumps({'text': text}),
+            input_data=json.dumps({'text': text, 'long_document': long_document}),
             prediction_result=json.dumps(result),
             confidence_score=result.get('confidence', 0.0)
         )
@@ -499,6 +611,57 @@ def tumor():
             'detail': str(e)
         }), 500
 
+@app.route('/api/tumor/batch', methods=['POST'])
+@login_required
+def tumor_batch():
+    """肿瘤分类批量接口"""
+    try:
+        data = request.get_json() or {}
+        texts = data.get('texts')
+        
+        if not isinstance(texts, list) or not texts:
+            return jsonify({'error': 'texts必须是非空列表'}), 400
+        if not all(isinstance(text, str) for text in texts):
+            return jsonify({'error': 'texts中的每一项都必须是文本'}), 400
+        max_batch_texts = MODEL_CONFIGS['tumor'].get('max_batch_texts', 200)
+        if len(texts) > max_batch_texts:
+            return jsonify({'error': f'单次最多提交{max_batch_texts}条文本'}), 400
+        
+        # 调用AI服务
+        results = tumor_service.batch_predict(texts)
+        
+        # 保存预测记录
+        records = [
+            PredictionRecord(
+                user_id=request.current_user.id,
+                model_type='tumor',
+                input_data=json.dumps({'text': text}),
+                prediction_result=json.dumps(result),
+                confidence_score=result.get('confidence', 0.0)
+            )
+            for text, result in zip(texts, results)
+            if 'error' not in result
+        ]
+        db.session.add_all(records)
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'results': results,
+                'total': len(results)
+            },
+            'message': '肿瘤批量分类完成'
+        })
+    except Exception as e:
+        logger.error(f"肿瘤批量分类失败: {e}")
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': '预测失败',
+            'detail': str(e)
+        }), 500
+
 @app.route('/api/diabetes', methods=['POST'])
 @login_required
 def diabetes():
@@ -534,6 +697,45 @@ def diabetes():
             'detail': str(e)
         }), 500
 
+def parse_chest_xray_options(form):
+    """
+    解析胸部X光预测参数
+
+    Returns:
+        (参数字典, 错误信息)，参数无效时参数字典为None
+    """
+    cam_method = form.get('cam_method', 'gradcam').lower()
+    if cam_method not in ['gradcam', 'gradcam++', 'scorecam']:
+        return None, '无效的CAM方法'
+    heatmap_mode = form.get('heatmap_mode', 'top').lower()
+    if heatmap_mode not in HEATMAP_MODES:
+        return None, f"heatmap_mode必须是{'/'.join(HEATMAP_MODES)}之一"
+    try:
+        top_k = int(form.get('top_k', 3))
+    except ValueError:
+        return None, 'top_k必须是整数'
+    if not 1 <= top_k <= Config.NUM_CLASSES:
+        return None, f'top_k必须在1到{Config.NUM_CLASSES}之间'
+    return {'cam_method': cam_method, 'heatmap_mode': heatmap_mode, 'top_k': top_k}, None
+
+def build_chest_xray_record(user_id, filename, options, result):
+    """构建胸部X光预测记录"""
+    return PredictionRecord(
+        user_id=user_id,
+        model_type='chest_xray',
+        input_data=json.dumps({
+            'filename': filename,
+            'cam_method': options['cam_method'],
+            'heatmap_mode': options['heatmap_mode']
+        }),
+        prediction_result=json.dumps(result),
+        confidence_score=max([v['probability'] for v in result['predictions'].values()])
+    )
+
+def public_job(job):
+    """任务状态中返回给客户端的字段"""
+    return {key: value for key, value in job.items() if key != 'owner'}
+
 @app.route('/api/chest_xray', methods=['POST'])
 @login_required
 def chest_xray():
@@ -542,23 +744,17 @@ def chest_xray():
         if 'file' not in request.files:
             return jsonify({'error': '未上传文件'}), 400
         file = request.files['file']
-        cam_method = request.form.get('cam_method', 'gradcam').lower()
-        if cam_method not in ['gradcam', 'gradcam++', 'scorecam']:
-            return jsonify({'error': '无效的CAM方法'}), 400
+        options, error = parse_chest_xray_options(request.form)
+        if error:
+            return jsonify({'error': error}), 400
         
         # 调用AI服务（传递用户ID以支持缓存）
         user_id = str(request.current_user.id)
-        result = chest_xray_service.predict(file, cam_method, user_id)
+        result = chest_xray_service.predict(file, options['cam_method'], user_id,
+                                            heatmap_mode=options['heatmap_mode'], top_k=options['top_k'])
         
         # 保存预测记录
-        record = PredictionRecord(
-            user_id=request.current_user.id,
-            model_type='chest_xray',
-            input_data=json.dumps({'filename': file.filename, 'cam_method': cam_method}),
-            prediction_result=json.dumps(result),
-            confidence_score=max([v['probability'] for v in result['predictions'].values()])
-        )
-        db.session.add(record)
+        db.session.add(build_chest_xray_record(request.current_user.id, file.filename, options, result))
         db.session.commit()
         
         return jsonify({
@@ -575,6 +771,115 @@ def chest_xray():
             'detail': str(e)
         }), 500
 
+@app.route('/api/chest_xray/jobs', methods=['POST'])
+@login_required
+def submit_chest_xray_job():
+    """提交胸部X光异步分析任务，立即返回任务ID"""
+    try:
+        if 'file' not in request.files:
+            return jsonify({'error': '未上传文件'}), 400
+        file = request.files['file']
+        if file.filename == '' or not chest_xray_service.allowed_file(file.filename):
+            return jsonify({'error': '文件格式无效，仅支持PNG、JPG、JPEG'}), 400
+        options, error = parse_chest_xray_options(request.form)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        # 请求结束后上传流不可再读，提交前读入内存
+        image_bytes, file_hash = chest_xray_service.read_upload(file)
+        filename = file.filename
+        user_id = request.current_user.id
+        
+        def run():
+            return chest_xray_service.predict_bytes(
+                image_bytes, filename, options['cam_method'], str(user_id),
+                heatmap_mode=options['heatmap_mode'], top_k=options['top_k'], file_hash=file_hash
+            )
+        
+        def on_complete(job):
+            # 任务成功后保存预测记录
+            if job['status'] != JOB_SUCCEEDED:
+                return
+            with app.app_context():
+                try:
+                    db.session.add(build_chest_xray_record(user_id, filename, options, job['result']))
+                    db.session.commit()
+                except Exception as e:
+                    logger.error(f"保存胸部X光任务记录失败: {e}")
+                    db.session.rollback()
+        
+        try:
+            job = chest_xray_jobs.submit(run, owner=str(user_id), on_complete=on_complete)
+        except RuntimeError as e:
+            return jsonify({'success': False, 'error': str(e)}), 503
+        
+        return jsonify({
+            'success': True,
+            'data': public_job(job),
+            'message': '胸部X光分析任务已提交'
+        }), 202
+    except Exception as e:
+        logger.error(f"提交胸部X光任务失败: {e}")
+        return jsonify({
+            'success': False,
+            'error': '任务提交失败',
+            'detail': str(e)
+        }), 500
+
+@app.route('/api/chest_xray/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_chest_xray_job(job_id):
+    """查询胸部X光异步任务状态和结果"""
+    job = chest_xray_jobs.get(job_id)
+    if not job or job.get('owner') != str(request.current_user.id):
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify({
+        'success': True,
+        'data': public_job(job)
+    })
+
+@app.route('/api/chest_xray/jobs/<job_id>/events', methods=['GET'])
+@login_required
+def chest_xray_job_events(job_id):
+    """
+    订阅胸部X光异步任务状态（Server-Sent Events），任务结束后推送结果
+    
+    每个连接占用一个请求线程，最多保持 events_timeout 秒；到期时任务仍未结束则推送
+    timeout 事件并关闭连接，客户端应重新连接事件流或轮询 GET /api/chest_xray/jobs/<job_id>
+    """
+    job = chest_xray_jobs.get(job_id)
+    if not job or job.get('owner') != str(request.current_user.id):
+        return jsonify({'error': '任务不存在'}), 404
+    
+    poll_interval = chest_xray_job_config['poll_interval']
+    deadline = time.monotonic() + chest_xray_job_config['events_timeout']
+    
+    def generate_events():
+        last_status = None
+        current = job
+        while True:
+            if current is None:
+                yield format_sse('error', {'error': '任务不存在或已过期'})
+                return
+            if current['status'] != last_status:
+                last_status = current['status']
+                yield format_sse('status', {'job_id': job_id, 'status': last_status})
+            if last_status in FINISHED_STATES:
+                yield format_sse('done', public_job(current))
+                return
+            if time.monotonic() > deadline:
+                yield format_sse('timeout', {
+                    'job_id': job_id,
+                    'status': last_status,
+                    'poll_url': f'/api/chest_xray/jobs/{job_id}',
+                    'message': '任务仍在处理中，请重新连接事件流或轮询任务状态'
+                })
+                return
+            time.sleep(poll_interval)
+            current = chest_xray_jobs.get(job_id)
+    
+    return sse_response(generate_events())
+
 @app.route('/api/chest_xray/image', methods=['GET'])
 @login_required
 def get_chest_xray_image():
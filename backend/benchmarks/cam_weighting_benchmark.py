@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+CAM通道加权基准测试
+对比逐通道循环累加与einsum/tensordot一次加权求和生成CAM的耗时，
+张量形状与512x512输入下DenseNet121 denseblock4的输出一致
+
+用法（在backend目录下）:
+    python benchmarks/cam_weighting_benchmark.py [重复次数]
+"""
+
+import sys
+import time
+
+import torch
+
+NUM_CHANNELS = 1024
+FEATURE_SIZE = 16
+
+def loop_cam(weights, activations):
+    """逐通道循环累加（原实现）"""
+    cam = torch.zeros(activations.shape[2:], device=activations.device)
+    for i, w in enumerate(weights[0]):
+        cam += w * activations[0, i]
+    return cam
+
+def einsum_cam(weights, activations):
+    """einsum一次加权求和（服务当前实现）"""
+    return torch.einsum('c,chw->hw', weights[0], activations[0])
+
+def tensordot_cam(weights, activations):
+    """tensordot一次加权求和"""
+    return torch.tensordot(weights[0], activations[0], dims=1)
+
+def time_function(fn, weights, activations, repeats: int) -> float:
+    """返回单次调用的平均耗时（毫秒）"""
+    fn(weights, activations)  # 预热
+    if activations.is_cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(weights, activations)
+    if activations.is_cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) * 1000 / repeats
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    activations = torch.rand(1, NUM_CHANNELS, FEATURE_SIZE, FEATURE_SIZE, device=device)
+    weights = torch.rand(1, NUM_CHANNELS, device=device)
+
+    reference = loop_cam(weights, activations)
+    print(f"设备: {device}, 激活形状: {tuple(activations.shape)}, 重复次数: {repeats}")
+    print(f"{'实现':<12}{'耗时(ms)':>12}{'加速比':>10}{'最大误差':>14}")
+    baseline = None
+    for name, fn in [('loop', loop_cam), ('einsum', einsum_cam), ('tensordot', tensordot_cam)]:
+        elapsed = time_function(fn, weights, activations, repeats)
+        baseline = baseline or elapsed
+        error = (fn(weights, activations) - reference).abs().max().item()
+        print(f"{name:<12}{elapsed:>12.3f}{baseline / elapsed:>10.1f}{error:>14.2e}")
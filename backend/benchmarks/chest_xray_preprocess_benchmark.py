@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+胸部X光预处理基准测试
+对比原预处理（PIL解码 + 每次构建torchvision变换 + 叠加用的RGB/BGR副本）
+与OpenCV预处理（解码一次 + INTER_AREA缩放 + 预分配缓冲区归一化）的耗时
+
+用法（在backend目录下）:
+    python benchmarks/chest_xray_preprocess_benchmark.py [图片路径] [重复次数]
+不指定图片时使用随机生成的2048x2048灰度PNG
+"""
+
+import io
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torchvision.transforms as transforms
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.xray_preprocessing import XrayPreprocessor
+
+def load_image_bytes(path: str = None) -> bytes:
+    """读取测试图片，未指定时生成随机灰度图"""
+    if path:
+        return Path(path).read_bytes()
+    image = (np.random.rand(2048, 2048) * 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def torchvision_preprocess(image_bytes: bytes):
+    """原预处理流程"""
+    transform = transforms.Compose([
+        transforms.Resize((512, 512)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    ])
+    original_image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    original_np = np.array(original_image)
+    original_bgr = cv2.cvtColor(original_np, cv2.COLOR_RGB2BGR)
+    return original_bgr, transform(original_image).unsqueeze(0)
+
+def opencv_preprocess(preprocessor: XrayPreprocessor, image_bytes: bytes):
+    """OpenCV预处理流程"""
+    original_bgr = preprocessor.decode(image_bytes)
+    return original_bgr, preprocessor.to_tensor(original_bgr)
+
+def time_function(fn, repeats: int) -> float:
+    """返回单次调用的平均耗时（毫秒）"""
+    fn()  # 预热
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeats
+
+if __name__ == "__main__":
+    image_bytes = load_image_bytes(sys.argv[1] if len(sys.argv) > 1 else None)
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    preprocessor = XrayPreprocessor(input_size=(512, 512))
+
+    _, reference = torchvision_preprocess(image_bytes)
+    _, fast = opencv_preprocess(preprocessor, image_bytes)
+    difference = (reference - fast).abs()
+
+    baseline = time_function(lambda: torchvision_preprocess(image_bytes), repeats)
+    optimized = time_function(lambda: opencv_preprocess(preprocessor, image_bytes), repeats)
+    print(f"图片大小: {len(image_bytes) / 1024:.0f}KB, 重复次数: {repeats}")
+    print(f"{'实现':<14}{'耗时(ms)':>12}{'加速比':>10}")
+    print(f"{'torchvision':<14}{baseline:>12.2f}{1.0:>10.1f}")
+    print(f"{'opencv':<14}{optimized:>12.2f}{baseline / optimized:>10.1f}")
+    print(f"输入张量差异（缩放插值方式不同）: 平均 {difference.mean().item():.4f}, 最大 {difference.max().item():.4f}")
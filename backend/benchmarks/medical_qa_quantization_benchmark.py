@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+医疗问答int8量化基准测试
+分别以float32和int8动态量化模式加载模型，对比内存占用与生成速度
+
+用法（在backend目录下）:
+    python benchmarks/medical_qa_quantization_benchmark.py [max_new_tokens]
+"""
+
+import gc
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import MODEL_CONFIGS
+from services.medical_qa_service import MedicalQAService
+
+QUESTIONS = [
+    "什么是高血压？",
+    "糖尿病的早期症状有哪些？",
+    "如何预防心脏病？",
+    "感冒和流感有什么区别？"
+]
+
+def run_benchmark(quantized: bool, max_new_tokens: int) -> dict:
+    """以指定模式加载模型并逐个回答测试问题"""
+    qa_config = MODEL_CONFIGS['medical_qa']
+    qa_config['quantization']['enabled'] = quantized
+    # 逐个生成，排除批处理与缓存的影响
+    qa_config['batching']['enabled'] = False
+    qa_config['semantic_cache']['enabled'] = False
+
+    service = MedicalQAService()
+    if service.model is None:
+        raise RuntimeError("医疗问答模型未加载")
+    # 与默认参数不同的生成参数不会读写缓存
+    generation_config = service.resolve_generation_config({'max_new_tokens': max_new_tokens})
+    service.predict(QUESTIONS[0], generation_config=generation_config)  # 预热
+
+    service.model_stats['generated_tokens'] = 0
+    service.model_stats['generation_seconds'] = 0.0
+    for question in QUESTIONS:
+        service.predict(question, generation_config=generation_config)
+    stats = service.get_model_stats()
+
+    del service
+    gc.collect()
+    return stats
+
+if __name__ == "__main__":
+    max_new_tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    results = {
+        'float32': run_benchmark(False, max_new_tokens),
+        'int8_dynamic': run_benchmark(True, max_new_tokens)
+    }
+
+    print(f"{'模式':<14}{'权重内存(MB)':>14}{'RSS增量(MB)':>14}{'加载(秒)':>10}{'tokens/s':>10}")
+    for mode, stats in results.items():
+        print(f"{mode:<14}{stats['model_memory_mb']:>14}{stats['rss_delta_mb']:>14}"
+              f"{stats['load_seconds']:>10}{stats['tokens_per_second']:>10}")
@@ -16,7 +16,7 @@ LOGS_DIR = BASE_DIR / "logs"
 
 # 创建必要的目录
 for directory in [LOGS_DIR, BASE_DIR / "uploads", BASE_DIR / "results", BASE_DIR / "backend" / "models" / "chest_xray_models", BASE_DIR / "sessions"]:
-    directory.mkdir(exist_ok=True)
+    directory.mkdir(parents=True, exist_ok=True)
 
 # ==================== Flask应用配置 ====================
 class Config:
@@ -75,6 +75,20 @@ class Config:
     UPLOAD_DIR = BASE_DIR / "uploads"
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
     DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+    SCORECAM_BATCH_SIZE = int(os.environ.get('SCORECAM_BATCH_SIZE', 8))  # ScoreCAM单次前向的掩码输入数
+    PERSIST_UPLOADS = os.environ.get('CHEST_XRAY_PERSIST_UPLOADS', 'False').lower() == 'true'  # 是否将上传的X光片留档到UPLOAD_DIR
+    MODEL_VERSION = os.environ.get('CHEST_XRAY_MODEL_VERSION', '')  # 结果文件的模型版本，为空时根据权重文件生成
+    RESULT_STORE_MAX_MB = int(os.environ.get('RESULT_STORE_MAX_MB', 1024))  # 热力图结果文件总大小上限
+    RESULT_STORE_MAX_AGE_DAYS = int(os.environ.get('RESULT_STORE_MAX_AGE_DAYS', 30))  # 结果文件最长未访问天数
+    CHEST_XRAY_BATCHING = os.environ.get('CHEST_XRAY_BATCHING', 'true').lower() == 'true'  # 并发请求合并为批次前向
+    CHEST_XRAY_MAX_BATCH_SIZE = int(os.environ.get('CHEST_XRAY_MAX_BATCH_SIZE', 8))  # 单批最大图片数
+    CHEST_XRAY_MAX_WAIT_MS = float(os.environ.get('CHEST_XRAY_MAX_WAIT_MS', 5))  # 凑批最长等待时间（毫秒）
+    CHEST_XRAY_MAX_QUEUE_SIZE = 64  # 等待前向的最大请求数
+    CHEST_XRAY_BATCH_TIMEOUT = 120  # 等待批次前向结果的超时时间（秒）
+    CHEST_XRAY_PREPROCESS_BACKEND = os.environ.get('CHEST_XRAY_PREPROCESS_BACKEND', 'opencv')  # 预处理后端: opencv / torchvision
+    CHEST_XRAY_GRAYSCALE_DECODE = os.environ.get('CHEST_XRAY_GRAYSCALE_DECODE', 'true').lower() == 'true'  # 单通道图片保持灰度解码（opencv后端）
+    CHEST_XRAY_WEIGHTS_FILE = os.environ.get('CHEST_XRAY_WEIGHTS_FILE', '')  # CHECKPOINT_DIR下预转换的权重文件，为空时读取best_model.pth
+    CHEST_XRAY_META_INIT = os.environ.get('CHEST_XRAY_META_INIT', 'true').lower() == 'true'  # 在meta设备上构建模型，跳过参数初始化
 
 class DevelopmentConfig(Config):
     """开发环境配置"""
@@ -108,7 +122,44 @@ MODEL_CONFIGS = {
         "online_model": "Qwen/Qwen1.5-0.5B",
         "max_length": 512,
         "temperature": 0.7,
-        "top_p": 0.9
+        "top_p": 0.9,
+        "max_new_tokens": 200,
+        "max_new_tokens_limit": 512,  # 单次请求可申请的最大生成长度
+        "stop_sequences": [],
+        "inference_config": BACKEND_DIR / "config" / "medical_qa_configs" / "inference_config.yaml",
+        "stream_timeout": 120,  # 流式生成等待下一段文本的超时时间（秒）
+        "stream_stop_timeout": 10,  # 流式请求结束后等待后台生成线程退出的时间（秒）
+        "prefix_cache": True,  # 复用固定提示词前缀的KV缓存
+        # CPU推理时对Linear层做int8动态量化，量化后的state_dict和源权重指纹保存在模型目录旁（*_int8.pt）
+        "quantization": {
+            "enabled": os.environ.get('MEDICAL_QA_INT8', 'false').lower() == 'true',
+            "save_artifact": True
+        },
+        # 跨用户答案缓存，默认关闭；开启后只有规范化文本完全相同的问题共享答案。
+        # 向量相似度匹配还需要专用句向量模型和在留出问题对上校准的阈值，缺一项则不启用
+        # （一字之差的问题如"高血压"/"低血压"在通用语言模型隐状态上相似度可能很高）
+        "semantic_cache": {
+            "enabled": os.environ.get('MEDICAL_QA_SEMANTIC_CACHE', 'false').lower() == 'true',
+            "embedding_model": os.environ.get('MEDICAL_QA_EMBEDDING_MODEL', ''),  # 本地句向量模型目录
+            "similarity_threshold": (float(os.environ['MEDICAL_QA_SIMILARITY_THRESHOLD'])
+                                     if os.environ.get('MEDICAL_QA_SIMILARITY_THRESHOLD') else None),
+            "max_entries": 5000,
+            "ttl": 3600  # 条目有效期（秒）
+        },
+        # 相同问题的并发请求合并为一次生成（进程内 + 跨进程Redis锁）
+        "single_flight": {
+            "enabled": True,
+            "lock_ttl": 300,  # 跨进程锁过期时间（秒）
+            "wait_timeout": 300  # 等待其他请求结果的超时时间（秒）
+        },
+        # 并发请求合并批量生成
+        "batching": {
+            "enabled": os.environ.get('MEDICAL_QA_BATCHING', 'true').lower() == 'true',
+            "max_batch_size": int(os.environ.get('MEDICAL_QA_MAX_BATCH_SIZE', 8)),
+            "max_wait_ms": float(os.environ.get('MEDICAL_QA_MAX_WAIT_MS', 20)),  # 凑批最长等待时间
+            "max_queue_size": 256,
+            "result_timeout": 300  # 等待生成结果的超时时间（秒）
+        }
     },
     "heart_disease": {
         "model_paths": [
@@ -126,7 +177,16 @@ MODEL_CONFIGS = {
         ],
         "online_model": "bert-base-chinese",
         "class_names": ['良性', '恶性', '交界性', '未确定'],
-        "max_length": 512
+        "max_length": 512,
+        "batch_size": 16,  # 批量推理时单次前向的最大文本数
+        "max_batch_texts": 200,  # 批量接口单次请求的最大文本数
+        "long_document": {
+            "window_size": 512,  # 窗口token数（含特殊token）
+            "overlap": 128,  # 相邻窗口重叠的token数
+            "aggregation": "max",  # 窗口logits聚合方式: max / mean
+            "max_chars": 60000,  # 单个文本的最大字符数，超出时拒绝请求
+            "max_windows": 32  # 单个文本的最大窗口数，超出时拒绝请求
+        }
     },
     "diabetes": {
         "model_paths": [
@@ -153,7 +213,14 @@ MODEL_CONFIGS = {
         "result_dir": BASE_DIR / "results",
         "checkpoint_dir": BASE_DIR / "backend" / "models" / "chest_xray_models",
         "allowed_extensions": {'png', 'jpg', 'jpeg'},
-        "device": 'cuda' if torch.cuda.is_available() else 'cpu'
+        "device": 'cuda' if torch.cuda.is_available() else 'cpu',
+        "jobs": {
+            "max_workers": int(os.environ.get('CHEST_XRAY_JOB_WORKERS', 2)),  # 异步任务工作线程数
+            "max_pending": 32,  # 排队和执行中的最大任务数
+            "result_ttl": 3600,  # 任务结束后状态保留时间（秒）
+            "poll_interval": 0.5,  # 事件流检查任务状态的间隔（秒）
+            "events_timeout": 25  # 单次事件流最长保持时间（秒），超时后客户端重新连接或轮询任务状态
+        }
     }
 }
 
@@ -6,8 +6,13 @@ Flask API 服务，用于胸部 X 光图片的疾病预测和病灶定位热力
 
 import sys
 import os
+import io
+import json
 import uuid
+import hashlib
 import logging
+import threading
+import time
 import numpy as np
 import torch
 import torch.nn as nn
@@ -20,40 +25,165 @@ from werkzeug.utils import secure_filename
 from pathlib import Path
 import torchvision.transforms as transforms
 
+sys.path.append(str(Path(__file__).parent.parent))
+
+from utils.batch_scheduler import BatchScheduler
+from utils.result_store import ResultStore
+from utils.xray_preprocessing import XrayPreprocessor
+
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 热力图类别选择方式
+HEATMAP_MODES = ('top', 'positive', 'topk')
+
+# 读取上传流的分块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 目标层激活与梯度的钩子
+class ActivationsAndGradients:
+    """
+    在目标层上只注册一次前向钩子，每次前向覆盖保存最近一次的激活，
+    需要梯度时在激活张量上注册梯度钩子，反向后覆盖保存梯度。
+    多个CAM对象共享同一组钩子，重复创建CAM不会在层上累积钩子；
+    缓存按线程隔离，并发请求的前向不会互相覆盖。
+    """
+    def __init__(self, target_layers):
+        self.target_layers = target_layers
+        self._local = threading.local()
+        self.handles = [
+            layer.register_forward_hook(self._make_forward_hook(i))
+            for i, layer in enumerate(target_layers)
+        ]
+
+    def _buffers(self):
+        if not hasattr(self._local, 'buffers'):
+            self.reset()
+        return self._local.buffers
+
+    @property
+    def activations(self):
+        return self._buffers()['activations']
+
+    @property
+    def gradients(self):
+        return self._buffers()['gradients']
+
+    def _make_forward_hook(self, index):
+        def forward_hook(module, input, output):
+            buffers = self._buffers()
+            buffers['activations'][index] = output
+            if output.requires_grad:
+                # 反向可能在其他线程执行，梯度写回前向时所在线程的缓存
+                def save_gradient(grad):
+                    buffers['gradients'][index] = grad
+                output.register_hook(save_gradient)
+        return forward_hook
+
+    def reset(self):
+        """清空当前线程缓存的激活和梯度，释放其引用的计算图"""
+        self._local.buffers = {
+            'activations': [None] * len(self.target_layers),
+            'gradients': [None] * len(self.target_layers)
+        }
+
+    def release(self):
+        """移除目标层上的钩子"""
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+        self.reset()
+
 # CAM 基类
 class CAMBase:
-    def __init__(self, model, target_layers, use_cuda=False):
+    def __init__(self, model, target_layers, use_cuda=False, hooks=None):
         self.model = model.eval()
         self.target_layers = target_layers
         self.use_cuda = use_cuda
         self.device = torch.device("cuda" if use_cuda and torch.cuda.is_available() else "cpu")
         self.model.to(self.device)
-        self.gradients = []
-        self.activations = []
-        self._register_hooks()
+        # 未传入共享钩子时自行注册，使用完毕后需调用release移除
+        self._owns_hooks = hooks is None
+        self.hooks = hooks if hooks is not None else ActivationsAndGradients(target_layers)
 
-    def _register_hooks(self):
-        def forward_hook(module, input, output):
-            self.activations.append(output)
-        def backward_hook(module, grad_in, grad_out):
-            self.gradients.append(grad_out[0])
-        for layer in self.target_layers:
-            layer.register_forward_hook(forward_hook)
-            layer.register_backward_hook(backward_hook)
+    @property
+    def activations(self):
+        return self.hooks.activations
+
+    @property
+    def gradients(self):
+        return self.hooks.gradients
+
+    def release(self):
+        if self._owns_hooks:
+            self.hooks.release()
 
     def __call__(self, input_tensor, targets=None):
         raise NotImplementedError
 
+    def from_activations(self, input_tensor, activations, output, targets=None):
+        """
+        使用已有前向结果生成CAM，不再重复前向
+
+        Args:
+            input_tensor: 模型输入
+            activations: 目标层输出（需参与output的计算图）
+            output: 由activations计算得到的模型输出
+            targets: 目标类别，传入类别列表时为每个类别分别生成CAM
+
+        Returns:
+            形状为 (类别数, H, W) 的CAM数组，单个类别时第一维为1
+        """
+        if isinstance(targets, (list, tuple)):
+            gradients = self._batched_gradients(activations, output, targets)
+            return np.concatenate([self._compute_cam(activations.detach(), grad) for grad in gradients])
+        gradients = self._gradients_from_output(activations, output, targets)
+        return self._compute_cam(activations.detach(), gradients)
+
     def _get_activations_gradients(self, input_tensor):
-        self.gradients = []
-        self.activations = []
+        self.hooks.reset()
         output = self.model(input_tensor)
         return output
 
+    @staticmethod
+    def _gradients_from_output(activations, output, targets):
+        """目标类别得分对目标层输出的梯度"""
+        target_score = output[0, targets].sum() if targets is not None else output[0].max()
+        return torch.autograd.grad(target_score, activations)[0].detach()
+
+    @staticmethod
+    def _batched_gradients(activations, output, targets):
+        """
+        多个类别得分对目标层输出的梯度
+
+        以单位矩阵的各行作为grad_outputs做一次批量向量-雅可比积，
+        返回形状为 (类别数, *activations.shape) 的梯度
+        """
+        scores = output[0, list(targets)]
+        grad_outputs = torch.eye(len(targets), device=scores.device, dtype=scores.dtype)
+        try:
+            gradients = torch.autograd.grad(scores, activations, grad_outputs=grad_outputs,
+                                            retain_graph=True, is_grads_batched=True)[0]
+        except RuntimeError as e:
+            # 部分算子不支持批量反向时逐类别反向
+            logger.debug(f"批量反向失败，逐类别计算梯度: {e}")
+            gradients = torch.stack([
+                torch.autograd.grad(scores[i], activations, retain_graph=True)[0]
+                for i in range(len(targets))
+            ])
+        return gradients.detach()
+
+    @staticmethod
+    def _normalize_cam(cam):
+        """后处理：ReLU后归一化到[0, 1]，确保数值稳定性"""
+        cam = F.relu(cam)
+        cam_min = cam.min()
+        cam_max = cam.max()
+        if cam_max > cam_min:
+            cam = (cam - cam_min) / (cam_max - cam_min + 1e-8)
+        return cam.cpu().numpy()
+
 # GradCAM 类 - 改进版本
 class GradCAM(CAMBase):
     def __call__(self, input_tensor, targets=None):
@@ -64,28 +194,19 @@ class GradCAM(CAMBase):
             target_score = output[0, targets].sum()
             target_score.backward()
         
-        activations = self.activations[0].detach()
-        gradients = self.gradients[0].detach()
-        
+        return self._compute_cam(self.activations[0].detach(), self.gradients[0].detach())
+
+    def _compute_cam(self, activations, gradients):
         # 使用ReLU确保梯度为正值
         gradients = F.relu(gradients)
         
         # 计算权重
         weights = torch.mean(gradients, dim=(2, 3))
         
-        # 创建CAM
-        cam = torch.zeros(activations.shape[2:], device=self.device)
-        for i, w in enumerate(weights[0]):
-            cam += w * activations[0, i]
-        
-        # 后处理：确保数值稳定性
-        cam = F.relu(cam)
-        cam_min = cam.min()
-        cam_max = cam.max()
-        if cam_max > cam_min:
-            cam = (cam - cam_min) / (cam_max - cam_min + 1e-8)
+        # 创建CAM：各通道激活按权重求和
+        cam = torch.einsum('c,chw->hw', weights[0], activations[0])
         
-        return cam.cpu().numpy()[None, :]
+        return self._normalize_cam(cam)[None, :]
 
 # GradCAM++ 类 - 改进版本
 class GradCAMPlusPlus(CAMBase):
@@ -97,9 +218,9 @@ class GradCAMPlusPlus(CAMBase):
             target_score = output[0, targets].sum()
             target_score.backward()
         
-        activations = self.activations[0].detach()
-        gradients = self.gradients[0].detach()
-        
+        return self._compute_cam(self.activations[0].detach(), self.gradients[0].detach())
+
+    def _compute_cam(self, activations, gradients):
         # 计算alpha权重（GradCAM++的核心）
         alpha_num = gradients ** 2
         alpha_denom = 2 * gradients ** 2 + torch.sum(activations * gradients ** 3, dim=(2, 3), keepdim=True)
@@ -108,31 +229,35 @@ class GradCAMPlusPlus(CAMBase):
         # 计算权重
         weights = torch.sum(alpha * F.relu(gradients), dim=(2, 3))
         
-        # 创建CAM
-        cam = torch.zeros(activations.shape[2:], device=self.device)
-        for i, w in enumerate(weights[0]):
-            cam += w * activations[0, i]
-        
-        # 后处理：确保数值稳定性
-        cam = F.relu(cam)
-        cam_min = cam.min()
-        cam_max = cam.max()
-        if cam_max > cam_min:
-            cam = (cam - cam_min) / (cam_max - cam_min + 1e-8)
+        # 创建CAM：各通道激活按权重求和
+        cam = torch.einsum('c,chw->hw', weights[0], activations[0])
         
-        return cam.cpu().numpy()[None, :]
+        return self._normalize_cam(cam)[None, :]
 
 # ScoreCAM 类 - 改进版本
 class ScoreCAM(CAMBase):
+    def __init__(self, model, target_layers, use_cuda=False, hooks=None, batch_size=8):
+        super().__init__(model, target_layers, use_cuda=use_cuda, hooks=hooks)
+        # 单次前向的掩码输入数
+        self.batch_size = max(1, int(batch_size))
+
     def __call__(self, input_tensor, targets=None):
         input_tensor = input_tensor.to(self.device)
-        batch_size, _, height, width = input_tensor.size()
         
         # 获取激活图
         with torch.no_grad():
             output = self._get_activations_gradients(input_tensor)
             activations = self.activations[0].detach()
         
+        return self._compute_cam(input_tensor, activations, targets)
+
+    def from_activations(self, input_tensor, activations, output, targets=None):
+        # 多个类别共用同一批掩码前向的输出，不需要梯度
+        return self._compute_cam(input_tensor.to(self.device), activations.detach(), targets)
+
+    def _compute_cam(self, input_tensor, activations, targets):
+        batch_size, _, height, width = input_tensor.size()
+        
         # 使用ReLU确保激活图为正值，并标准化
         activations = F.relu(activations)
         
@@ -143,56 +268,45 @@ class ScoreCAM(CAMBase):
         k = min(64, activations.size(1))  # 最多选择64个通道
         _, top_k_indices = torch.topk(channel_importance, k)
         
-        # 创建CAM
-        cam = torch.zeros((height, width), device=self.device)
-        
         with torch.no_grad():
-            for i in top_k_indices:
-                # 获取单个通道的激活图
-                activation = activations[:, i:i+1, :, :]
-                
-                # 上采样到输入尺寸
-                upsampled = F.interpolate(
-                    activation,
-                    size=(height, width),
-                    mode='bilinear',
-                    align_corners=False
-                )
-                
-                # 改进的归一化：使用softmax-like归一化
-                upsampled_flat = upsampled.view(upsampled.size(0), -1)
-                upsampled_norm = F.softmax(upsampled_flat, dim=1).view_as(upsampled)
-                
-                # 创建掩码输入 - 使用更合理的掩码方式
-                masked_input = input_tensor * upsampled_norm
-                
-                # 前向传播
+            # 一次上采样所有选中通道到输入尺寸
+            upsampled = F.interpolate(
+                activations[:, top_k_indices, :, :],
+                size=(height, width),
+                mode='bilinear',
+                align_corners=False
+            )
+            
+            # 改进的归一化：每个通道在空间维度上做softmax
+            upsampled_norm = F.softmax(upsampled.view(k, -1), dim=1).view(k, 1, height, width)
+            
+            # 掩码输入分块批量前向，得分形状为 (k, 类别数)
+            target_list = list(targets) if isinstance(targets, (list, tuple)) else [targets]
+            scores = []
+            for start in range(0, k, self.batch_size):
+                masked_input = input_tensor * upsampled_norm[start:start + self.batch_size]
                 output = self.model(masked_input)
                 if targets is not None:
-                    score = output[0, targets]
+                    scores.append(output[:, target_list])
                 else:
-                    score = output[0].max()
-                
-                # 累加到CAM，使用通道重要性作为权重
-                cam += score * upsampled_norm[0, 0] * channel_importance[i]
-        
-        # 后处理：确保数值稳定性
-        cam = F.relu(cam)
-        cam_min = cam.min()
-        cam_max = cam.max()
-        if cam_max > cam_min:
-            cam = (cam - cam_min) / (cam_max - cam_min + 1e-8)
+                    scores.append(output.max(dim=1, keepdim=True).values)
+            scores = torch.cat(scores)
+            
+            # 累加到CAM，使用通道重要性作为权重
+            weights = scores * channel_importance[top_k_indices].unsqueeze(1)
+            cams = torch.einsum('kn,khw->nhw', weights, upsampled_norm[:, 0])
         
-        return cam.cpu().numpy()[None, :]
+        return np.stack([self._normalize_cam(cam) for cam in cams])
 
 # 模型类
 class DenseNet121(nn.Module):
     def __init__(self, num_classes=14, pretrained=False):
         super(DenseNet121, self).__init__()
         if pretrained:
-            self.densenet = models.densenet121(pretrained=pretrained)
+            self.densenet = models.densenet121(weights=models.DenseNet121_Weights.IMAGENET1K_V1)
         else:
-            self.densenet = models.densenet121(pretrained=False)
+            # 不下载ImageNet权重，参数随后由检查点覆盖
+            self.densenet = models.densenet121(weights=None)
         num_ftrs = self.densenet.classifier.in_features
         self.densenet.classifier = nn.Sequential(
             nn.Dropout(0.5),
@@ -205,6 +319,22 @@ class DenseNet121(nn.Module):
     def forward(self, x):
         return self.densenet(x)
 
+    def forward_features(self, x):
+        """前向到denseblock4，返回其输出（热力图使用的激活）"""
+        for name, module in self.densenet.features.named_children():
+            x = module(x)
+            if name == 'denseblock4':
+                break
+        return x
+
+    def forward_head(self, activations):
+        """由denseblock4的输出计算分类logits，与forward的剩余部分一致"""
+        out = self.densenet.features.norm5(activations)
+        out = F.relu(out)
+        out = F.adaptive_avg_pool2d(out, (1, 1))
+        out = torch.flatten(out, 1)
+        return self.densenet.classifier(out)
+
 # 预测类
 class Predictor:
     def __init__(self, model, config):
@@ -214,6 +344,10 @@ class Predictor:
         self.model.to(self.device)
         self.model.eval()
         self.optimal_thresholds = self._load_optimal_thresholds()
+        # 阈值只转换一次，判定时与整个概率矩阵一次比较
+        self.threshold_tensor = torch.as_tensor(
+            np.asarray(self.optimal_thresholds, dtype=np.float32), device=self.device
+        )
 
     def _load_optimal_thresholds(self):
         threshold_path = os.path.join(self.config.CHECKPOINT_DIR, 'optimal_thresholds.pth')
@@ -233,17 +367,63 @@ class Predictor:
             logger.warning(f"{threshold_path} not found, using default threshold 0.5")
             return [0.5] * self.config.NUM_CLASSES
 
+    def apply_thresholds(self, probabilities):
+        """
+        按各类别阈值判定阳性
+
+        Args:
+            probabilities: 形状为 (N, num_classes) 的概率张量
+
+        Returns:
+            与probabilities形状相同的0/1浮点张量
+        """
+        return (probabilities > self.threshold_tensor.to(probabilities.device)).float()
+
+    def package_predictions(self, probabilities, predictions):
+        """
+        将整批概率和判定结果转换为响应格式
+
+        Args:
+            probabilities: 形状为 (N, num_classes) 的概率数组或张量
+            predictions: 形状为 (N, num_classes) 的0/1数组或张量
+
+        Returns:
+            长度为N的列表，每项为 {疾病: {'positive': bool, 'probability': float}}
+        """
+        if isinstance(probabilities, torch.Tensor):
+            probabilities = probabilities.detach().cpu().numpy()
+        if isinstance(predictions, torch.Tensor):
+            predictions = predictions.detach().cpu().numpy()
+        labels = self.config.DISEASE_LABELS
+        # 整个矩阵一次转换为Python类型，避免逐元素float()/bool()
+        probs_rows = np.asarray(probabilities, dtype=np.float64).tolist()
+        preds_rows = np.asarray(predictions).astype(bool).tolist()
+        return [
+            {label: {'positive': pred, 'probability': prob}
+             for label, prob, pred in zip(labels, probs_row, preds_row)}
+            for probs_row, preds_row in zip(probs_rows, preds_rows)
+        ]
+
+    def predict_batch(self, images):
+        """
+        对一批已预处理的图片进行预测
+
+        Args:
+            images: 形状为 (N, 3, H, W) 的输入张量
+
+        Returns:
+            (predictions, probabilities)，形状均为 (N, num_classes) 的numpy数组
+        """
+        with torch.no_grad():
+            probabilities = torch.sigmoid(self.model(images.to(self.device)))
+            predictions = self.apply_thresholds(probabilities)
+        return predictions.cpu().numpy(), probabilities.cpu().numpy()
+
     def predict_single_image(self, image_path, transform):
         image = Image.open(image_path).convert('RGB')
         image = transform(image).unsqueeze(0)
-        image = image.to(self.device)
-        with torch.no_grad():
-            output = self.model(image)
-            probabilities = torch.sigmoid(output)
-            predictions = torch.zeros_like(probabilities)
-            for i, threshold in enumerate(self.optimal_thresholds):
-                predictions[:, i] = (probabilities[:, i] > threshold).float()
-        return predictions.cpu().numpy()[0], probabilities.cpu().numpy()[0]
+        predictions, probabilities = self.predict_batch(image)
+        return predictions[0], probabilities[0]
 
 # 主服务类
 class ChestXrayService:
@@ -258,24 +438,111 @@ class ChestXrayService:
         os.makedirs(self.UPLOAD_FOLDER, exist_ok=True)
         os.makedirs(str(self.config.RESULT_DIR), exist_ok=True)
         self.ALLOWED_EXTENSIONS = self.config.ALLOWED_EXTENSIONS
+        startup_begin = time.perf_counter()
         try:
-            self.model = DenseNet121(num_classes=self.config.NUM_CLASSES, pretrained=True)
-            checkpoint_path = os.path.join(str(self.config.CHECKPOINT_DIR), 'best_model.pth')
-            if not os.path.exists(checkpoint_path):
-                raise FileNotFoundError(f"Checkpoint not found at {checkpoint_path}")
-            
-            checkpoint = torch.load(checkpoint_path, map_location=self.config.DEVICE)
-            
-            self.model.load_state_dict(checkpoint['model_state_dict'])
-            self.model.to(self.config.DEVICE)
-            self.model.eval()
+            self.model, weights_path, self.startup_stats = self._load_model()
+            # 两个预处理后端的输入不逐像素一致，热力图产物按后端区分
+            self.preprocess_backend = getattr(self.config, 'CHEST_XRAY_PREPROCESS_BACKEND', 'opencv')
+            model_version = getattr(self.config, 'MODEL_VERSION', '') or self._checkpoint_version(weights_path)
+            self.model_version = f"{model_version}+{self.preprocess_backend}"
             logger.info("✅ Model loaded successfully")
-            logger.info(f"📋 模型配置: num_classes={self.config.NUM_CLASSES}, pretrained=True")
+            logger.info(f"📋 模型配置: num_classes={self.config.NUM_CLASSES}, weights={weights_path}")
         except Exception as e:
             logger.error(f"❌ Failed to load model: {e}")
             raise RuntimeError("Model initialization failed")
         self.predictor = Predictor(self.model, self.config)
+        self.result_store = ResultStore(
+            self.config.RESULT_DIR,
+            max_bytes=getattr(self.config, 'RESULT_STORE_MAX_MB', 1024) * 1024 * 1024,
+            max_age=getattr(self.config, 'RESULT_STORE_MAX_AGE_DAYS', 30) * 86400
+        )
         self.target_layer = self.model.densenet.features.denseblock4
+        
+        # 预处理：变换对象只构建一次
+        self.transform = self.get_transforms(is_training=False)
+        self.preprocessor = XrayPreprocessor(input_size=(512, 512))
+        self.grayscale_decode = getattr(self.config, 'CHEST_XRAY_GRAYSCALE_DECODE', True)
+        # CAM对象与目标层钩子只创建一次，所有请求共享；
+        # 独立前向生成热力图时反向传播会写入共享的参数梯度，需要串行执行
+        self.cam_hooks = ActivationsAndGradients([self.target_layer])
+        use_cuda = (self.config.DEVICE == 'cuda')
+        self.cam_engines = {
+            'gradcam': GradCAM(self.model, [self.target_layer], use_cuda=use_cuda, hooks=self.cam_hooks),
+            'gradcam++': GradCAMPlusPlus(self.model, [self.target_layer], use_cuda=use_cuda, hooks=self.cam_hooks),
+            'scorecam': ScoreCAM(self.model, [self.target_layer], use_cuda=use_cuda, hooks=self.cam_hooks,
+                                 batch_size=getattr(self.config, 'SCORECAM_BATCH_SIZE', 8))
+        }
+        self._cam_lock = threading.Lock()
+        
+        # 分类前向的微批调度：并发请求的图片合并为一个批次前向
+        self.batch_timeout = getattr(self.config, 'CHEST_XRAY_BATCH_TIMEOUT', 120)
+        self.scheduler = None
+        if getattr(self.config, 'CHEST_XRAY_BATCHING', False):
+            self.scheduler = BatchScheduler(
+                self._forward_features_batch,
+                max_batch_size=getattr(self.config, 'CHEST_XRAY_MAX_BATCH_SIZE', 8),
+                max_wait_ms=getattr(self.config, 'CHEST_XRAY_MAX_WAIT_MS', 5),
+                max_queue_size=getattr(self.config, 'CHEST_XRAY_MAX_QUEUE_SIZE', 64),
+                name="chest-xray-batch"
+            )
+            logger.info("✅ 胸部X光微批推理已启用")
+        
+        self.startup_stats['total_ms'] = round((time.perf_counter() - startup_begin) * 1000, 1)
+        logger.info(f"⏱️ 胸部X光服务启动耗时: {self.startup_stats}")
+
+    def _load_model(self):
+        """
+        构建模型结构并加载权重
+
+        结构不加载ImageNet预训练权重（会被检查点完全覆盖，且离线环境无法下载）；
+        在meta设备上构建时跳过参数初始化，加载时直接采用检查点中的张量。
+        配置了预转换的权重文件时以内存映射方式读取，只加载实际用到的参数
+
+        Returns:
+            (模型, 权重文件路径, 启动耗时统计)
+        """
+        checkpoint_dir = str(self.config.CHECKPOINT_DIR)
+        weights_file = getattr(self.config, 'CHEST_XRAY_WEIGHTS_FILE', '')
+        weights_path = os.path.join(checkpoint_dir, weights_file) if weights_file else ''
+        meta_init = getattr(self.config, 'CHEST_XRAY_META_INIT', True)
+        stats = {'meta_init': meta_init}
+
+        begin = time.perf_counter()
+        if weights_path and os.path.exists(weights_path):
+            state_dict = torch.load(weights_path, map_location='cpu', mmap=True, weights_only=True)
+            stats['weights_source'] = 'converted'
+        else:
+            if weights_path:
+                logger.warning(f"{weights_path} not found, loading full checkpoint")
+            weights_path = os.path.join(checkpoint_dir, 'best_model.pth')
+            if not os.path.exists(weights_path):
+                raise FileNotFoundError(f"Checkpoint not found at {weights_path}")
+            state_dict = load_checkpoint(weights_path)['model_state_dict']
+            stats['weights_source'] = 'checkpoint'
+        stats['load_weights_ms'] = round((time.perf_counter() - begin) * 1000, 1)
+
+        begin = time.perf_counter()
+        if meta_init:
+            with torch.device('meta'):
+                model = DenseNet121(num_classes=self.config.NUM_CLASSES, pretrained=False)
+            model.load_state_dict(state_dict, assign=True)
+            uninitialized = [name for name, tensor in
+                             list(model.named_parameters()) + list(model.named_buffers()) if tensor.is_meta]
+            if uninitialized:
+                raise RuntimeError(f"Checkpoint is missing tensors: {uninitialized[:5]}")
+        else:
+            model = DenseNet121(num_classes=self.config.NUM_CLASSES, pretrained=False)
+            model.load_state_dict(state_dict)
+        model.to(self.config.DEVICE)
+        model.eval()
+        stats['build_model_ms'] = round((time.perf_counter() - begin) * 1000, 1)
+        return model, weights_path, stats
+
+    @staticmethod
+    def _checkpoint_version(checkpoint_path):
+        """根据权重文件的大小和修改时间生成模型版本，权重更新后结果文件随之失效"""
+        stat = os.stat(checkpoint_path)
+        return hashlib.md5(f"{stat.st_size}:{int(stat.st_mtime)}".encode('utf-8')).hexdigest()[:12]
 
     def allowed_file(self, filename):
         return '.' in filename and filename.rsplit('.', 1)[1].lower() in self.ALLOWED_EXTENSIONS
@@ -287,229 +554,444 @@ class ChestXrayService:
             transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
         ])
 
-    def generate_heatmap(self, image_tensor, class_idx, cam_method):
-        cam_classes = {
-            'gradcam': GradCAM,
-            'gradcam++': GradCAMPlusPlus,
-            'scorecam': ScoreCAM
-        }
-        if cam_method not in cam_classes:
+    def preprocess(self, image_bytes):
+        """
+        解码图片并生成模型输入
+
+        opencv后端：cv2解码一次，INTER_AREA缩放后直接归一化写入输出张量；
+        torchvision后端：PIL解码后使用torchvision变换（与训练时的预处理一致）
+
+        Returns:
+            (原图数组, 模型输入张量)，原图为BGR，opencv后端下单通道图片为灰度
+        """
+        if self.preprocess_backend == 'opencv':
+            original_bgr = self.preprocessor.decode(image_bytes, grayscale=self.grayscale_decode)
+            image_tensor = self.preprocessor.to_tensor(original_bgr)
+        else:
+            try:
+                original_image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+            except Exception as e:
+                raise ValueError(f'Invalid image file: {e}')
+            original_bgr = cv2.cvtColor(np.array(original_image), cv2.COLOR_RGB2BGR)
+            image_tensor = self.transform(original_image).unsqueeze(0)
+        return original_bgr, image_tensor.to(self.config.DEVICE)
+
+    def forward_with_activations(self, image_tensor):
+        """
+        一次前向同时得到分类输出和热力图所需的denseblock4激活
+
+        主干在no_grad下前向到denseblock4，只有分类头保留计算图，
+        热力图的反向只经过分类头。启用微批时主干前向与并发请求合并执行。
+
+        Returns:
+            (denseblock4激活, 模型输出logits)
+        """
+        if self.scheduler is not None:
+            future = self.scheduler.submit(image_tensor, group_key=tuple(image_tensor.shape[1:]))
+            activations = future.result(timeout=self.batch_timeout)
+        else:
+            with torch.no_grad():
+                activations = self.model.forward_features(image_tensor)
+        activations = activations.detach().requires_grad_(True)
+        with torch.enable_grad():
+            output = self.model.forward_head(activations)
+        return activations, output
+
+    def _forward_features_batch(self, image_tensors):
+        """微批处理函数：拼接多张图片执行一次主干前向，按请求拆分denseblock4激活"""
+        try:
+            with torch.no_grad():
+                activations = self.model.forward_features(torch.cat(image_tensors))
+            return list(activations.split(1))
+        finally:
+            # 调度线程中的钩子缓存不再使用
+            self.cam_hooks.reset()
+
+    def generate_heatmap(self, image_tensor, class_idx, cam_method, activations=None, output=None):
+        """
+        生成热力图
+
+        传入forward_with_activations的结果时直接复用，否则单独执行一次前向和反向
+        """
+        if cam_method not in self.cam_engines:
             raise ValueError(f"Unsupported CAM method: {cam_method}")
-        cam = cam_classes[cam_method](self.model, [self.target_layer], use_cuda=(self.config.DEVICE == 'cuda'))
-        heatmap = cam(image_tensor, targets=class_idx)
+        cam = self.cam_engines[cam_method]
+        try:
+            if activations is not None and output is not None:
+                heatmap = cam.from_activations(image_tensor, activations, output, targets=class_idx)
+            else:
+                with self._cam_lock:
+                    heatmap = cam(image_tensor, targets=class_idx)
+        finally:
+            self.cam_hooks.reset()
         return heatmap[0]
 
-    def predict(self, file, cam_method='gradcam', user_id: str = None):
+    def generate_heatmaps(self, image_tensor, class_indices, cam_method, activations, output):
+        """
+        为多个类别生成热力图，复用forward_with_activations的结果
+
+        梯度类CAM通过一次批量向量-雅可比积得到各类别梯度，
+        ScoreCAM的各类别共用同一批掩码前向
+
+        Returns:
+            与class_indices一一对应的热力图列表
+        """
+        if cam_method not in self.cam_engines:
+            raise ValueError(f"Unsupported CAM method: {cam_method}")
+        cam = self.cam_engines[cam_method]
+        targets = [int(idx) for idx in class_indices]
+        try:
+            if len(targets) == 1:
+                heatmaps = cam.from_activations(image_tensor, activations, output, targets=targets[0])
+            else:
+                heatmaps = cam.from_activations(image_tensor, activations, output, targets=targets)
+        finally:
+            self.cam_hooks.reset()
+        return list(heatmaps)
+
+    def select_heatmap_classes(self, pred_probs, pred_labels, heatmap_mode='top', top_k=3):
+        """按热力图模式选择类别，按概率从高到低排列"""
+        order = [int(i) for i in np.argsort(-pred_probs)]
+        if heatmap_mode == 'positive':
+            positives = [i for i in order if pred_labels[i] == 1]
+            # 没有阳性类别时退回概率最高的类别
+            return positives or order[:1]
+        if heatmap_mode == 'topk':
+            return order[:max(1, min(int(top_k), len(order)))]
+        return order[:1]
+
+    def _artifact_names(self, file_hash, cam_method, class_idx):
+        """热力图与叠加图在结果存储中的文件名"""
+        return tuple(
+            ResultStore.artifact_name(kind, file_hash, cam_method, int(class_idx), self.model_version)
+            for kind in ('heatmap', 'superimposed')
+        )
+
+    def _artifacts_available(self, result):
+        """缓存结果引用的结果文件是否仍然存在（可能已被淘汰）"""
+        heatmaps = result.get('heatmaps') or {
+            'primary': {
+                'heatmap_path': result.get('heatmap_path'),
+                'superimposed_path': result.get('superimposed_path')
+            }
+        }
+        return all(
+            files.get(key) and self.result_store.exists(files[key])
+            for files in heatmaps.values()
+            for key in ('heatmap_path', 'superimposed_path')
+        )
+
+    def _save_heatmap(self, heatmap, original_bgr, original_size, heatmap_filename, superimposed_filename):
+        """将热力图缩放到原图尺寸并叠加，保存热力图与叠加图到结果存储"""
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(f"热力图形状: {heatmap.shape}, 值范围: [{heatmap.min():.4f}, {heatmap.max():.4f}]")
+        
+        # 改进的热力图resize方法
+        # 使用双线性插值而不是最近邻插值，保持热力图的平滑性
+        heatmap_resized = cv2.resize(heatmap, (original_size[0], original_size[1]), 
+                                   interpolation=cv2.INTER_LINEAR)
+        
+        # 确保热力图值在合理范围内
+        np.clip(heatmap_resized, 0, 1, out=heatmap_resized)
+        if debug:
+            logger.debug(f"裁剪后热力图形状: {heatmap_resized.shape}, "
+                         f"值范围: [{heatmap_resized.min():.4f}, {heatmap_resized.max():.4f}]")
+        
+        # 转换为8位图像用于可视化
+        heatmap_uint8 = cv2.convertScaleAbs(heatmap_resized, alpha=255)
+        heatmap_colored = cv2.applyColorMap(heatmap_uint8, cv2.COLORMAP_JET)
+        
+        # 叠加热力图到原图，全程使用uint8，灰度原图只在叠加时展开为3通道
+        if original_bgr.ndim == 2:
+            original_bgr = cv2.cvtColor(original_bgr, cv2.COLOR_GRAY2BGR)
+        superimposed_img = cv2.addWeighted(heatmap_colored, 0.3, original_bgr, 0.7, 0)
+        
+        # 保存热力图（转换为RGB格式）
+        heatmap_rgb = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
+        heatmap_path = self.result_store.save(
+            heatmap_filename, lambda path: Image.fromarray(heatmap_rgb).save(path, format='PNG'))
+        
+        # 保存叠加图（转换为RGB格式）
+        superimposed_rgb = cv2.cvtColor(superimposed_img, cv2.COLOR_BGR2RGB)
+        superimposed_path = self.result_store.save(
+            superimposed_filename, lambda path: Image.fromarray(superimposed_rgb).save(path, format='PNG'))
+        logger.debug(f"保存热力图: {heatmap_path}, 叠加图: {superimposed_path}")
+
+    def predict(self, file, cam_method='gradcam', user_id: str = None, heatmap_mode: str = 'top', top_k: int = 3):
+        """
+        预测并生成热力图
+
+        上传内容只读取一次到内存，边读边计算哈希，不经过磁盘
+
+        Args:
+            file: 上传的图片文件
+            cam_method: CAM方法
+            user_id: 用户ID
+            heatmap_mode: 热力图类别选择方式，top为概率最高的类别，
+                          positive为所有阳性类别，topk为概率最高的top_k个类别
+            top_k: heatmap_mode为topk时的类别数
+        """
         if file.filename == '' or not self.allowed_file(file.filename):
             raise ValueError('Invalid file format. Only PNG, JPG, JPEG allowed')
         
-        filename = secure_filename(f"{uuid.uuid4()}_{file.filename}")
-        file_path = os.path.join(self.UPLOAD_FOLDER, filename)
-        file.save(file_path)
-        logger.info(f"📁 临时文件已保存: {file_path}")
+        image_bytes, file_hash = self.read_upload(file)
+        return self.predict_bytes(image_bytes, file.filename, cam_method, user_id,
+                                  heatmap_mode=heatmap_mode, top_k=top_k, file_hash=file_hash)
+
+    def read_upload(self, file):
+        """
+        将上传流读入内存并增量计算MD5
+
+        Returns:
+            (文件内容, MD5十六进制摘要)
+        """
+        digest = hashlib.md5()
+        buffer = io.BytesIO()
+        stream = file.stream
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            buffer.write(chunk)
+        return buffer.getvalue(), digest.hexdigest()
+
+    def predict_bytes(self, image_bytes, original_filename, cam_method='gradcam', user_id: str = None,
+                      heatmap_mode: str = 'top', top_k: int = 3, file_hash: str = None):
+        """
+        对内存中的图片内容进行预测并生成热力图
+
+        Args:
+            image_bytes: 图片文件内容
+            original_filename: 原始文件名，用于生成结果文件名
+            file_hash: 图片内容的MD5，未提供时自动计算
+            其余参数同predict
+        """
+        if heatmap_mode not in HEATMAP_MODES:
+            raise ValueError(f"Unsupported heatmap mode: {heatmap_mode}")
+        
+        started = time.perf_counter()
+        filename = secure_filename(f"{uuid.uuid4()}_{original_filename}")
+        file_hash = file_hash or hashlib.md5(image_bytes).hexdigest()
+        # 每个请求只输出一行摘要日志
+        record = {
+            'event': 'chest_xray_predict',
+            'file_hash': file_hash,
+            'cam_method': cam_method,
+            'heatmap_mode': heatmap_mode,
+            'cache': 'miss'
+        }
+        
+        # 仅在配置要求留档时保存上传文件
+        if getattr(self.config, 'PERSIST_UPLOADS', False):
+            file_path = os.path.join(self.UPLOAD_FOLDER, filename)
+            with open(file_path, 'wb') as f:
+                f.write(image_bytes)
+            record['upload_path'] = file_path
         
         try:
             from utils.redis_manager import get_redis_manager
             redis_mgr = get_redis_manager()
             
             # 生成缓存键（基于文件内容和参数）
-            import hashlib
-            with open(file_path, 'rb') as f:
-                file_hash = hashlib.md5(f.read()).hexdigest()
-            cache_key = f"chest_xray:{file_hash}:{cam_method}"
+            cache_key = f"chest_xray:{file_hash}:{cam_method}:{self.preprocess_backend}"
+            if heatmap_mode != 'top':
+                cache_key += f":{heatmap_mode}" + (f"{top_k}" if heatmap_mode == 'topk' else "")
             
             cached_result = redis_mgr.get_cache(cache_key)
-            if cached_result:
-                logger.info(f"✅ 胸部X光预测缓存命中: {filename}")
-                # 清理临时文件
-                os.remove(file_path)
+            if cached_result and self._artifacts_available(cached_result):
+                record['cache'] = 'hit'
+                self._log_prediction(record, started)
                 return cached_result
         except Exception as e:
             logger.warning(f"缓存检查失败: {e}")
         
-        # 读取原始图片并保存尺寸信息
-        original_image = Image.open(file_path).convert('RGB')
-        original_size = original_image.size  # (width, height)
-        original_np = np.array(original_image)
-        
-        # 记录调试信息
-        logger.info(f"处理图片: {filename}")
-        logger.info(f"原始尺寸: {original_size}")
-        logger.info(f"原始数组形状: {original_np.shape}")
-        
-        # 应用变换得到模型输入
-        transform = self.get_transforms(is_training=False)
-        image_tensor = transform(original_image).unsqueeze(0).to(self.config.DEVICE)
+        # 从内存解码原始图片得到模型输入，解码结果（BGR）同时用于热力图叠加
+        stage = time.perf_counter()
+        original_bgr, image_tensor = self.preprocess(image_bytes)
+        original_size = (original_bgr.shape[1], original_bgr.shape[0])  # (width, height)
+        timings = {'preprocess': time.perf_counter() - stage}
         
-        logger.info(f"模型输入张量形状: {image_tensor.shape}")
-        
-        # 进行预测
+        # 进行预测：同一次前向的激活用于生成热力图
+        stage = time.perf_counter()
+        activations, output = self.forward_with_activations(image_tensor)
         with torch.no_grad():
-            output = self.model(image_tensor)
             probabilities = torch.sigmoid(output)
-            predictions = torch.zeros_like(probabilities)
-            for i, threshold in enumerate(self.predictor.optimal_thresholds):
-                predictions[:, i] = (probabilities[:, i] > threshold).float()
+            predictions = self.predictor.apply_thresholds(probabilities)
         
         pred_labels = predictions.cpu().numpy()[0]
         pred_probs = probabilities.cpu().numpy()[0]
+        timings['forward'] = time.perf_counter() - stage
         
-        # 详细记录预测结果
-        logger.info("=" * 60)
-        logger.info("🔍 详细预测结果分析")
-        logger.info("=" * 60)
-        logger.info(f"模型输出原始值范围: [{output.min().item():.4f}, {output.max().item():.4f}]")
-        logger.info(f"Sigmoid后概率值范围: [{pred_probs.min():.4f}, {pred_probs.max():.4f}]")
-        logger.info(f"使用的阈值: {self.predictor.optimal_thresholds}")
-        logger.info("")
-        
-        # 记录每个疾病的预测结果
-        logger.info("📊 各疾病预测详情:")
-        for i, (disease, prob, pred, threshold) in enumerate(zip(
-            self.config.DISEASE_LABELS, pred_probs, pred_labels, self.predictor.optimal_thresholds
-        )):
-            status = "✅ 阳性" if pred == 1 else "❌ 阴性"
-            logger.info(f"  {i:2d}. {disease:20s}: 概率={prob:.4f}, 阈值={threshold:.4f}, 预测={status}")
-        
-        # 选择概率最高的类别生成热力图
-        class_idx = np.argmax(pred_probs)
-        max_prob = pred_probs[class_idx]
+        # 选择生成热力图的类别，按概率从高到低排列
+        class_indices = self.select_heatmap_classes(pred_probs, pred_labels, heatmap_mode, top_k)
+        class_idx = class_indices[0]
         max_disease = self.config.DISEASE_LABELS[class_idx]
-        logger.info("")
-        logger.info(f"🎯 选择用于热力图的类别: {class_idx} ({max_disease}), 概率: {max_prob:.4f}")
-        
-        # 记录阳性预测的疾病
-        positive_diseases = [self.config.DISEASE_LABELS[i] for i, pred in enumerate(pred_labels) if pred == 1]
-        logger.info(f"🔍 最终阳性预测疾病: {positive_diseases}")
-        logger.info("=" * 60)
-        
-        # 生成热力图
-        logger.info(f"开始生成热力图，方法: {cam_method}")
-        heatmap = self.generate_heatmap(image_tensor, class_idx, cam_method)
-        logger.info(f"热力图形状: {heatmap.shape}, 值范围: [{heatmap.min():.4f}, {heatmap.max():.4f}]")
-        
-        # 改进的热力图resize方法
-        # 使用双线性插值而不是最近邻插值，保持热力图的平滑性
-        heatmap_resized = cv2.resize(heatmap, (original_size[0], original_size[1]), 
-                                   interpolation=cv2.INTER_LINEAR)
-        
-        logger.info(f"调整后热力图形状: {heatmap_resized.shape}")
-        
-        # 确保热力图值在合理范围内
-        heatmap_resized = np.clip(heatmap_resized, 0, 1)
-        logger.info(f"裁剪后热力图值范围: [{heatmap_resized.min():.4f}, {heatmap_resized.max():.4f}]")
-        
-        # 转换为8位图像用于可视化
-        heatmap_uint8 = np.uint8(255 * heatmap_resized)
-        heatmap_colored = cv2.applyColorMap(heatmap_uint8, cv2.COLORMAP_JET)
-        
-        # 确保原始图片是BGR格式用于叠加
-        if len(original_np.shape) == 3 and original_np.shape[2] == 3:
-            # 如果是RGB格式，转换为BGR
-            original_bgr = cv2.cvtColor(original_np, cv2.COLOR_RGB2BGR)
-        else:
-            original_bgr = original_np
-        
-        # 叠加热力图到原图
-        superimposed_img = heatmap_colored * 0.3 + original_bgr * 0.7
-        superimposed_img = np.clip(superimposed_img, 0, 255).astype(np.uint8)
-        
-        # 保存结果
-        heatmap_filename = f'heatmap_{cam_method}_{filename}'
-        superimposed_filename = f'superimposed_{cam_method}_{filename}'
-        heatmap_path = os.path.join(self.config.RESULT_DIR, heatmap_filename)
-        superimposed_path = os.path.join(self.config.RESULT_DIR, superimposed_filename)
-        
-        # 保存热力图（转换为RGB格式）
-        heatmap_rgb = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
-        Image.fromarray(heatmap_rgb).save(heatmap_path)
         
-        # 保存叠加图（转换为RGB格式）
-        superimposed_rgb = cv2.cvtColor(superimposed_img, cv2.COLOR_BGR2RGB)
-        Image.fromarray(superimposed_rgb).save(superimposed_path)
-        
-        logger.info(f"保存热力图: {heatmap_path}")
-        logger.info(f"保存叠加图: {superimposed_path}")
+        record.update({
+            'original_size': original_size,
+            'top_class': max_disease,
+            'top_probability': round(float(pred_probs[class_idx]), 4),
+            'positive': [self.config.DISEASE_LABELS[i] for i in np.flatnonzero(pred_labels)],
+            'heatmap_classes': [self.config.DISEASE_LABELS[i] for i in class_indices]
+        })
+        if logger.isEnabledFor(logging.DEBUG):
+            # 详细统计只在调试级别计算，避免正常请求的设备同步和格式化开销
+            logits = output.detach().cpu().numpy()[0]
+            record['debug'] = {
+                'input_shape': list(image_tensor.shape),
+                'logit_range': [round(float(logits.min()), 4), round(float(logits.max()), 4)],
+                'probabilities': {
+                    disease: [round(float(prob), 4), round(float(threshold), 4)]
+                    for disease, prob, threshold in zip(
+                        self.config.DISEASE_LABELS, pred_probs, self.predictor.optimal_thresholds)
+                }
+            }
         
-        # 清理临时文件
-        os.remove(file_path)
-        logger.info(f"🗑️ 临时文件已清理: {file_path}")
+        # 已渲染过的类别直接复用结果文件，只为缺失的类别生成热力图
+        artifact_names = {
+            idx: self._artifact_names(file_hash, cam_method, idx) for idx in class_indices
+        }
+        missing = [
+            idx for idx in class_indices
+            if not all(self.result_store.exists(name) for name in artifact_names[idx])
+        ]
+        record['heatmaps_reused'] = len(class_indices) - len(missing)
+        record['heatmaps_rendered'] = len(missing)
+        
+        if missing:
+            # 生成热力图：所有类别复用同一次前向，梯度一次批量反向得到
+            stage = time.perf_counter()
+            heatmaps = self.generate_heatmaps(image_tensor, missing, cam_method,
+                                              activations=activations, output=output)
+            timings['heatmap'] = time.perf_counter() - stage
+            stage = time.perf_counter()
+            for idx, heatmap in zip(missing, heatmaps):
+                self._save_heatmap(heatmap, original_bgr, original_size, *artifact_names[idx])
+            timings['save'] = time.perf_counter() - stage
+        
+        heatmap_files = {}
+        for idx in class_indices:
+            heatmap_filename, superimposed_filename = artifact_names[idx]
+            heatmap_files[self.config.DISEASE_LABELS[idx]] = {
+                'class_index': int(idx),
+                'probability': float(pred_probs[idx]),
+                'heatmap_path': heatmap_filename,
+                'superimposed_path': superimposed_filename
+            }
+        heatmap_filename = heatmap_files[max_disease]['heatmap_path']
+        superimposed_filename = heatmap_files[max_disease]['superimposed_path']
         
         # 返回结果
-        predictions = {}
-        for i in range(self.config.NUM_CLASSES):
-            predictions[self.config.DISEASE_LABELS[i]] = {
-                'positive': bool(pred_labels[i]),
-                'probability': float(pred_probs[i])
-            }
+        predictions = self.predictor.package_predictions(pred_probs[None], pred_labels[None])[0]
         
         results = {
             'predictions': predictions,
             'heatmap_path': heatmap_filename,
             'superimposed_path': superimposed_filename,
+            'heatmaps': heatmap_files,
+            'heatmap_mode': heatmap_mode,
             'cam_method': cam_method,
             'original_size': original_size,
             'model_input_size': (512, 512)  # 与chestxrays保持一致
         }
         
-        # 添加改进的CAM方法说明
-        logger.info("🎯 使用的改进CAM方法:")
-        if cam_method == 'gradcam':
-            logger.info("  - GradCAM: 使用ReLU确保梯度为正值，改进数值稳定性")
-        elif cam_method == 'gradcam++':
-            logger.info("  - GradCAM++: 使用alpha权重计算，改进定位精度")
-        elif cam_method == 'scorecam':
-            logger.info("  - ScoreCAM: 选择前64个重要通道，使用softmax归一化，提高效率")
-        
         # 缓存结果
         try:
             if 'redis_mgr' in locals():
                 redis_mgr.set_cache(cache_key, results, cache_type="prediction")
-                logger.info(f"✅ 胸部X光预测结果已缓存: {filename}")
         except Exception as e:
             logger.warning(f"缓存胸部X光预测结果失败: {e}")
         
+        record['timings_ms'] = {name: round(seconds * 1000, 1) for name, seconds in timings.items()}
+        self._log_prediction(record, started)
         return results
 
+    def _log_prediction(self, record, started):
+        """输出单行JSON格式的请求摘要"""
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        record['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
     def get_image(self, image_path):
         filename = os.path.basename(image_path)
-        full_path = os.path.join(str(self.config.RESULT_DIR), filename)
+        full_path = self.result_store.path(filename)
         
-        logger.info(f"服务获取图片 - 输入路径: {image_path}, 文件名: {filename}, 完整路径: {full_path}")
+        logger.debug(f"服务获取图片 - 输入路径: {image_path}, 文件名: {filename}, 完整路径: {full_path}")
         
-        if not os.path.exists(full_path):
+        # 存在时刷新访问时间，避免被LRU淘汰
+        if not self.result_store.exists(filename):
             logger.error(f"图片文件不存在: {full_path}")
             raise FileNotFoundError(f'Image not found: {filename}')
         
         return full_path
 
-# Flask 应用
-app = Flask(__name__)
-service = ChestXrayService()
+def load_checkpoint(checkpoint_path):
+    """
+    读取训练检查点
 
-@app.route('/predict', methods=['POST'])
-def predict():
-    try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file provided'}), 400
-        file = request.files['file']
-        cam_method = request.form.get('cam_method', 'gradcam')
-        if cam_method not in ['gradcam', 'gradcam++', 'scorecam']:
-            return jsonify({'error': 'Invalid CAM method'}), 400
-        results = service.predict(file, cam_method)
-        return jsonify(results)
-    except Exception as e:
-        logger.error(f"Error in predict: {e}")
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/get_image/<path:image_path>', methods=['GET'])
-def get_image(image_path):
+    zip格式的检查点以内存映射方式读取，旧格式回退为完整读取
+    """
     try:
-        full_path = service.get_image(image_path)
-        return send_file(full_path, mimetype='image/png')
-    except Exception as e:
-        logger.error(f"Error in get_image: {e}")
-        return jsonify({'error': str(e)}), 404
+        return torch.load(checkpoint_path, map_location='cpu', mmap=True)
+    except RuntimeError:
+        return torch.load(checkpoint_path, map_location='cpu')
+
+def export_weights(checkpoint_path, output_path):
+    """
+    将训练检查点转换为只包含模型参数的权重文件
+
+    去掉优化器状态等启动时用不到的内容，转换后的文件可用
+    weights_only + mmap 方式快速加载（配置 CHEST_XRAY_WEIGHTS_FILE）
+    """
+    state_dict = load_checkpoint(checkpoint_path)['model_state_dict']
+    torch.save({name: tensor.detach().cpu().contiguous() for name, tensor in state_dict.items()}, output_path)
+    return output_path
+
+# Flask 应用
+def create_app(service=None):
+    """创建独立运行的Flask应用，导入本模块时不会加载模型"""
+    if service is None:
+        service = ChestXrayService()
+    app = Flask(__name__)
+
+    @app.route('/predict', methods=['POST'])
+    def predict():
+        try:
+            if 'file' not in request.files:
+                return jsonify({'error': 'No file provided'}), 400
+            file = request.files['file']
+            cam_method = request.form.get('cam_method', 'gradcam')
+            if cam_method not in ['gradcam', 'gradcam++', 'scorecam']:
+                return jsonify({'error': 'Invalid CAM method'}), 400
+            results = service.predict(file, cam_method)
+            return jsonify(results)
+        except Exception as e:
+            logger.error(f"Error in predict: {e}")
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/get_image/<path:image_path>', methods=['GET'])
+    def get_image(image_path):
+        try:
+            full_path = service.get_image(image_path)
+            return send_file(full_path, mimetype='image/png')
+        except Exception as e:
+            logger.error(f"Error in get_image: {e}")
+            return jsonify({'error': str(e)}), 404
+
+    return app
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description='胸部X光预测服务')
+    parser.add_argument('--export-weights', metavar='OUTPUT',
+                        help='将 best_model.pth 转换为只含模型参数的权重文件后退出')
+    args = parser.parse_args()
+    if args.export_weights:
+        from config import Config
+        export_weights(os.path.join(str(Config.CHECKPOINT_DIR), 'best_model.pth'), args.export_weights)
+        logger.info(f"✅ 权重文件已导出: {args.export_weights}")
+    else:
+        create_app().run(host='0.0.0.0', port=5000, debug=True)
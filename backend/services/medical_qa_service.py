@@ -5,19 +5,114 @@
 """
 
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import (AutoConfig, AutoTokenizer, AutoModel, AutoModelForCausalLM, DynamicCache, StoppingCriteria,
+                          StoppingCriteriaList, TextIteratorStreamer)
+from transformers.integrations.accelerate import init_empty_weights
 import logging
 import os
 import sys
 from pathlib import Path
 import json
 import numpy as np
-from typing import Dict, Any
+import time
+import psutil
+from threading import Event, Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
+import yaml
 
 sys.path.append(str(Path(__file__).parent.parent.parent))
 
+from config import MODEL_CONFIGS
+from utils.batch_scheduler import BatchScheduler
+from utils.semantic_cache import SemanticAnswerCache, normalize_question
+from utils.single_flight import SingleFlight
+
 logger = logging.getLogger(__name__)
 
+# 医疗问答提示词模板
+QA_PROMPT_TEMPLATE = """请回答以下医疗问题，请用专业但易懂的语言回答：
+
+问题：{question}
+
+回答："""
+
+# 模板中问题之前的固定前缀
+QA_PROMPT_PREFIX = QA_PROMPT_TEMPLATE.split('{question}')[0]
+
+# 建立前缀KV缓存时用于校验分词边界的问题：BPE可能跨前缀与问题的边界合并，
+# 只有这些问题拼接后的完整提示词仍以前缀的token开头时才复用前缀
+PREFIX_PROBE_QUESTIONS = ('高血压的症状有哪些？', '“阿司匹林”能长期服用吗', 'What is HbA1c?', '38.5度发烧怎么办', '？')
+
+# int8量化产物的格式版本，格式变化时旧产物失效
+QUANTIZED_ARTIFACT_FORMAT = 3
+
+# 参与量化产物指纹计算的源权重文件
+SOURCE_WEIGHT_SUFFIXES = ('.safetensors', '.bin', '.pt', '.pth')
+
+# 传递给 model.generate 的生成参数
+GENERATION_PARAM_KEYS = ('max_new_tokens', 'do_sample', 'temperature', 'top_k', 'top_p', 'repetition_penalty')
+
+# 单次请求可覆盖的生成参数：(类型, 最小值, 最大值)
+GENERATION_OVERRIDE_RANGES = {
+    'temperature': (float, 0.0, 2.0),
+    'top_p': (float, 0.0, 1.0),
+    'top_k': (int, 0, 200),
+    'repetition_penalty': (float, 1.0, 2.0)
+}
+
+def load_generation_config(config_path: str = None) -> Dict[str, Any]:
+    """
+    加载生成参数
+    
+    以 MODEL_CONFIGS['medical_qa'] 为默认值，inference_config.yaml 中
+    model.generation_config 的同名参数覆盖之，max_new_tokens 不超过服务端上限。
+    
+    Args:
+        config_path: YAML配置文件路径，None使用 MODEL_CONFIGS 中的 inference_config
+        
+    Returns:
+        生成参数字典
+    """
+    model_config = MODEL_CONFIGS['medical_qa']
+    generation_config = {
+        'max_new_tokens': model_config.get('max_new_tokens', 200),
+        'do_sample': True,
+        'temperature': model_config.get('temperature', 0.7),
+        'top_p': model_config.get('top_p', 0.9),
+        'stop': list(model_config.get('stop_sequences', []))
+    }
+    
+    config_path = Path(config_path or model_config.get('inference_config', ''))
+    if config_path.is_file():
+        try:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                yaml_config = yaml.safe_load(f) or {}
+            yaml_generation = (yaml_config.get('model') or {}).get('generation_config') or {}
+            generation_config.update({
+                name: value for name, value in yaml_generation.items() if name in GENERATION_PARAM_KEYS
+            })
+            if 'stop_sequences' in yaml_generation:
+                generation_config['stop'] = list(yaml_generation['stop_sequences'] or [])
+            logger.info(f"加载生成参数: {config_path}")
+        except Exception as e:
+            logger.warning(f"读取生成参数配置失败，使用默认值: {e}")
+    else:
+        logger.warning(f"未找到生成参数配置 {config_path}，使用默认值")
+    
+    max_new_tokens_limit = model_config.get('max_new_tokens_limit', 512)
+    generation_config['max_new_tokens'] = min(int(generation_config['max_new_tokens']), max_new_tokens_limit)
+    return generation_config
+
+class StopOnEvent(StoppingCriteria):
+    """事件被设置后结束生成，用于流式请求的客户端断开连接时"""
+    
+    def __init__(self, event: Event):
+        self.event = event
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
 class MedicalQAService:
     """医疗问答服务"""
     
@@ -26,12 +121,85 @@ class MedicalQAService:
         self.model = None
         self.tokenizer = None
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        # 流式生成时等待下一段文本的超时时间（秒）
+        self.stream_timeout = MODEL_CONFIGS['medical_qa'].get('stream_timeout', 120)
+        # 流式请求结束（含客户端断开）后等待后台生成线程退出的时间（秒）
+        self.stream_stop_timeout = MODEL_CONFIGS['medical_qa'].get('stream_stop_timeout', 10)
+        self.batching_config = MODEL_CONFIGS['medical_qa'].get('batching', {})
+        # 生成参数
+        self.max_new_tokens_limit = MODEL_CONFIGS['medical_qa'].get('max_new_tokens_limit', 512)
+        self.generation_config = load_generation_config()
+        self.scheduler = None
+        # 模型运行统计
+        self._stats_lock = Lock()
+        self.model_stats = {
+            'quantization': 'none',
+            'generated_tokens': 0,
+            'generation_seconds': 0.0
+        }
+        # 固定提示词前缀的token和各层KV（(key, value)元组列表）
+        self._prefix_ids = None
+        self._prefix_kv = None
+        # 跨用户答案缓存：默认只做规范化问题的精确匹配，
+        # 配置了句向量模型和校准阈值时才启用向量相似度匹配
+        semantic_config = MODEL_CONFIGS['medical_qa'].get('semantic_cache', {})
+        self.shared_cache_enabled = semantic_config.get('enabled', False)
+        self.semantic_cache = None
+        self.embedding_model = None
+        self.embedding_tokenizer = None
+        if self.shared_cache_enabled:
+            self._init_semantic_cache(semantic_config)
+        
+        # 相同问题的并发请求合并为一次生成
+        single_flight_config = MODEL_CONFIGS['medical_qa'].get('single_flight', {})
+        self.single_flight = None
+        if single_flight_config.get('enabled', False):
+            from utils.redis_manager import get_redis_manager
+            self.single_flight = SingleFlight(
+                get_redis_manager(),
+                namespace='medical_qa:flight',
+                lock_ttl=single_flight_config.get('lock_ttl', 300),
+                wait_timeout=single_flight_config.get('wait_timeout', 300)
+            )
         
         try:
             self._load_model()
             logger.info("✅ 医疗问答模型加载成功")
         except Exception as e:
             logger.error(f"❌ 医疗问答模型加载失败: {e}")
+        
+        if self.model is not None and self.batching_config.get('enabled', False):
+            self.scheduler = BatchScheduler(
+                self._generate_batch,
+                max_batch_size=self.batching_config.get('max_batch_size', 8),
+                max_wait_ms=self.batching_config.get('max_wait_ms', 20),
+                max_queue_size=self.batching_config.get('max_queue_size', 0),
+                name='medical-qa-scheduler'
+            )
+            logger.info(f"✅ 医疗问答批处理调度已启用: {self.batching_config}")
+    
+    def _init_semantic_cache(self, semantic_config: Dict[str, Any]):
+        """加载专用句向量模型并创建向量缓存，未配置模型或阈值时只使用精确匹配"""
+        embedding_model = semantic_config.get('embedding_model')
+        threshold = semantic_config.get('similarity_threshold')
+        if not embedding_model or threshold is None:
+            logger.info("语义缓存仅使用规范化问题精确匹配（未配置句向量模型或校准阈值）")
+            return
+        try:
+            self.embedding_tokenizer = AutoTokenizer.from_pretrained(embedding_model, local_files_only=True)
+            self.embedding_model = AutoModel.from_pretrained(embedding_model, local_files_only=True).to(self.device)
+            self.embedding_model.eval()
+        except Exception as e:
+            logger.warning(f"加载句向量模型失败，仅使用精确匹配: {e}")
+            self.embedding_model = None
+            self.embedding_tokenizer = None
+            return
+        self.semantic_cache = SemanticAnswerCache(
+            similarity_threshold=threshold,
+            max_entries=semantic_config.get('max_entries', 5000),
+            ttl=semantic_config.get('ttl', 3600)
+        )
+        logger.info(f"✅ 语义缓存已启用: {embedding_model}, 阈值 {threshold}")
     
     def _load_model(self):
         """加载模型（只允许本地）"""
@@ -51,107 +219,648 @@ class MedicalQAService:
         )
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
-        self.model = AutoModelForCausalLM.from_pretrained(
+        
+        start_time = time.time()
+        rss_before = psutil.Process().memory_info().rss
+        quantization_config = MODEL_CONFIGS['medical_qa'].get('quantization', {})
+        if quantization_config.get('enabled', False) and self.device.type == 'cpu':
+            self.model = self._load_quantized_model(model_path, quantization_config)
+        else:
+            self.model = AutoModelForCausalLM.from_pretrained(
+                model_path,
+                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+                device_map="auto" if torch.cuda.is_available() else None,
+                trust_remote_code=True
+            )
+            if not torch.cuda.is_available():
+                self.model = self.model.to(self.device)
+        self.model.eval()
+        
+        self.model_stats.update({
+            'load_seconds': round(time.time() - start_time, 2),
+            'model_memory_mb': round(self._model_memory_bytes(self.model) / 1024 ** 2, 1),
+            'rss_delta_mb': round((psutil.Process().memory_info().rss - rss_before) / 1024 ** 2, 1)
+        })
+        logger.info(f"医疗问答模型资源占用: {self.model_stats}")
+        
+        if MODEL_CONFIGS['medical_qa'].get('prefix_cache', True):
+            self._build_prefix_cache()
+    
+    def _load_quantized_model(self, model_path: str, quantization_config: Dict[str, Any]):
+        """
+        加载int8动态量化模型（仅CPU）
+        
+        模型目录旁的量化产物保存量化后的state_dict和源权重指纹，以 weights_only 方式读取。
+        指纹一致时按配置构建不含float32权重的模型骨架，Linear层替换为int8动态量化层后直接
+        载入产物，不读取源权重；不一致或不存在时加载float32模型原地量化并重新保存产物。
+        """
+        artifact_path = Path(model_path).parent / f"{Path(model_path).name}_int8.pt"
+        fingerprint = self._source_fingerprint(model_path)
+        self.model_stats['quantization'] = 'int8_dynamic'
+        
+        if artifact_path.exists():
+            try:
+                artifact = torch.load(artifact_path, map_location='cpu', weights_only=True)
+                if artifact.get('fingerprint') == fingerprint:
+                    model = self._quantized_skeleton(model_path)
+                    model.load_state_dict(artifact['state_dict'], assign=True)
+                    model.eval()
+                    logger.info(f"✅ 加载int8量化模型: {artifact_path}")
+                    return model
+                logger.info(f"源权重已变化，重新生成int8量化模型: {artifact_path}")
+            except Exception as e:
+                logger.warning(f"加载int8量化模型失败，重新量化: {e}")
+        
+        model = AutoModelForCausalLM.from_pretrained(
             model_path,
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-            device_map="auto" if torch.cuda.is_available() else None,
+            torch_dtype=torch.float32,
             trust_remote_code=True
         )
-        if not torch.cuda.is_available():
-            self.model = self.model.to(self.device)
-        self.model.eval()
+        model.eval()
+        # 原地替换Linear层，不复制整个float32模型
+        torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        logger.info("✅ 医疗问答模型已完成int8动态量化")
+        
+        if quantization_config.get('save_artifact', True):
+            tmp_path = artifact_path.with_name(f"{artifact_path.name}.tmp")
+            try:
+                torch.save({'fingerprint': fingerprint, 'state_dict': model.state_dict()}, tmp_path)
+                os.replace(tmp_path, artifact_path)
+                logger.info(f"✅ int8量化模型已保存: {artifact_path}")
+            except Exception as e:
+                logger.warning(f"保存int8量化模型失败: {e}")
+                if tmp_path.exists():
+                    tmp_path.unlink()
+        return model
+    
+    @staticmethod
+    def _quantized_skeleton(model_path: str):
+        """
+        按配置构建int8动态量化模型的结构
+        
+        参数创建在meta设备上不占内存（非持久化缓冲区如旋转位置编码仍正常计算），
+        再把与 quantize_dynamic 相同范围的Linear层替换为int8动态量化层，
+        权重由 load_state_dict(assign=True) 直接使用产物中的张量。
+        """
+        config = AutoConfig.from_pretrained(model_path, trust_remote_code=True)
+        with init_empty_weights():
+            model = AutoModelForCausalLM.from_config(config, torch_dtype=torch.float32, trust_remote_code=True)
+        for name, module in list(model.named_modules()):
+            # quantize_dynamic 只替换类型恰好为 nn.Linear 的层
+            if type(module) is torch.nn.Linear:
+                model.set_submodule(name, torch.ao.nn.quantized.dynamic.Linear(
+                    module.in_features, module.out_features, bias_=module.bias is not None, dtype=torch.qint8
+                ))
+        return model
     
-    def predict(self, question: str, user_id: str = None) -> Dict[str, Any]:
-        """预测医疗问题答案"""
+    @staticmethod
+    def _source_fingerprint(model_path: str) -> Dict[str, Any]:
+        """
+        源权重指纹：权重和配置文件的名称、大小、修改时间，以及量化产物格式和torch版本，
+        任一项变化时量化产物失效（只读取文件元数据，不计算内容哈希）
+        """
+        files = []
+        for path in sorted(Path(model_path).iterdir()):
+            if not path.is_file() or not (path.suffix in SOURCE_WEIGHT_SUFFIXES or path.name == 'config.json'):
+                continue
+            stat = path.stat()
+            files.append({'name': path.name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+        return {'format': QUANTIZED_ARTIFACT_FORMAT, 'torch': str(torch.__version__), 'files': files}
+    
+    @staticmethod
+    def _model_memory_bytes(model) -> int:
+        """统计模型权重占用的内存（包含量化Linear层的打包权重）"""
+        def tensor_bytes(value) -> int:
+            if isinstance(value, torch.Tensor):
+                return value.element_size() * value.nelement()
+            if isinstance(value, (tuple, list)):
+                return sum(tensor_bytes(item) for item in value)
+            return 0
+        return sum(tensor_bytes(value) for value in model.state_dict().values())
+    
+    def get_model_stats(self) -> Dict[str, Any]:
+        """获取模型运行统计：量化模式、内存占用与生成速度"""
+        with self._stats_lock:
+            stats = dict(self.model_stats)
+        seconds = stats.pop('generation_seconds')
+        stats['tokens_per_second'] = round(stats['generated_tokens'] / seconds, 2) if seconds > 0 else 0.0
+        if self.scheduler is not None:
+            stats['batching'] = self.scheduler.get_stats()
+        if self.semantic_cache is not None:
+            stats['semantic_cache'] = self.semantic_cache.get_stats()
+        return stats
+    
+    def _record_generation(self, generated_tokens: int, seconds: float):
+        """累计生成token数与耗时"""
+        with self._stats_lock:
+            self.model_stats['generated_tokens'] += generated_tokens
+            self.model_stats['generation_seconds'] += seconds
+    
+    def _build_prefix_cache(self):
+        """
+        预先计算固定提示词前缀的KV，生成时只需预填充问题部分
+        
+        前缀在分词边界上截断：依次尝试完整前缀和各换行处的更短前缀，取第一个对所有
+        探测问题都满足 tokenize(前缀) + tokenize(其余部分) == tokenize(完整提示词) 的前缀；
+        都不满足时不启用前缀复用。
+        """
+        self._prefix_ids = None
+        self._prefix_kv = None
         try:
+            prefix_ids = self._verified_prefix_ids()
+            if prefix_ids is None:
+                logger.warning("提示词前缀与问题的分词边界不稳定，不启用前缀KV缓存")
+                return
+            prefix_ids = torch.tensor([prefix_ids], device=self.device)
+            with torch.no_grad():
+                outputs = self.model(input_ids=prefix_ids, use_cache=True)
+            self._prefix_kv = self._legacy_kv(outputs.past_key_values)
+            self._prefix_ids = prefix_ids
+            logger.info(f"✅ 提示词前缀KV缓存已建立: {prefix_ids.shape[1]} tokens")
+        except Exception as e:
+            logger.warning(f"提示词前缀KV缓存建立失败，使用完整预填充: {e}")
+    
+    def _verified_prefix_ids(self) -> Optional[List[int]]:
+        """返回通过分词边界校验的最长前缀的token，没有时返回None"""
+        probe_ids = [self._prompt_ids(question) for question in PREFIX_PROBE_QUESTIONS]
+        candidates = [QA_PROMPT_PREFIX] + [
+            QA_PROMPT_PREFIX[:index + 1]
+            for index in range(len(QA_PROMPT_PREFIX) - 2, -1, -1)
+            if QA_PROMPT_PREFIX[index] == '\n'
+        ]
+        for candidate in candidates:
+            candidate_ids = self.tokenizer(candidate)['input_ids']
+            if candidate_ids and all(ids[:len(candidate_ids)] == candidate_ids for ids in probe_ids):
+                return candidate_ids
+        return None
+    
+    @staticmethod
+    def _legacy_kv(past_key_values) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+        """将模型返回的缓存转换为各层 (key, value) 列表"""
+        if isinstance(past_key_values, (tuple, list)):
+            return [(layer[0], layer[1]) for layer in past_key_values]
+        if hasattr(past_key_values, 'to_legacy_cache'):
+            return [(key, value) for key, value in past_key_values.to_legacy_cache()]
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    
+    def _prefix_past_key_values(self, batch_size: int) -> DynamicCache:
+        """
+        为一次生成构建前缀缓存
+        
+        generate 会向缓存追加新token的KV（拼接出新张量，不修改已有张量），
+        各层直接使用前缀KV沿批维度expand的视图，不需要复制前缀。
+        """
+        cache = DynamicCache()
+        for layer_idx, (key, value) in enumerate(self._prefix_kv):
+            cache.update(key.expand(batch_size, -1, -1, -1), value.expand(batch_size, -1, -1, -1), layer_idx)
+        return cache
+    
+    def predict(self, question: str, user_id: str = None, generation_config: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        预测医疗问题答案
+        
+        Args:
+            question: 问题
+            user_id: 用户ID（可选）
+            generation_config: 由 resolve_generation_config 得到的生成参数，None使用服务默认值；
+                与默认值不同时不读写缓存
+        """
+        try:
+            generation_config = generation_config or self.generation_config
+            use_cache = generation_config == self.generation_config
+            
             # 尝试从缓存获取结果
-            from utils.redis_manager import get_redis_manager
-            redis_mgr = get_redis_manager()
-            cached_answer = redis_mgr.get_medical_qa_cache(question, user_id)
-            if cached_answer:
-                logger.info(f"✅ 医疗问答缓存命中: {question[:50]}...")
-                return {
-                    'answer': cached_answer,
-                    'confidence': 0.9,
-                    'cached': True
-                }
+            cached_result = self._get_cached_result(question, user_id) if use_cache else None
+            if cached_result:
+                return cached_result
             
             if not self.model or not self.tokenizer:
-                return {
-                    'answer': '模型未加载，请检查模型文件',
-                    'confidence': 0.0,
-                    'error': 'Model not loaded'
-                }
+                return self._model_not_loaded_result()
             
-            # 构建提示词
-            prompt = f"""请回答以下医疗问题，请用专业但易懂的语言回答：
-
-问题：{question}
-
-回答："""
+            # 尝试从语义缓存获取结果
+            semantic_result, embedding = self._lookup_semantic_cache(question, user_id) if use_cache else (None, None)
+            if semantic_result:
+                return semantic_result
             
-            # 编码输入
-            inputs = self.tokenizer(
-                prompt,
-                return_tensors="pt",
-                padding=True,
-                truncation=True,
-                max_length=512
-            ).to(self.device)
+            # 生成回答（相同问题的并发请求共享一次生成）
+            answer, shared = self._generate_answer_once(question, generation_config)
             
-            # 生成回答
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=512,
-                    temperature=0.7,
-                    top_p=0.9,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.eos_token_id
-                )
+            # 缓存结果，共享结果的请求只需写入自己的缓存
+            if use_cache and shared:
+                self._cache_user_answer(question, answer, user_id)
+            elif use_cache:
+                self._cache_answer(question, answer, user_id, embedding)
+            
+            return self._build_result(question, answer, generation_config)
+            
+        except Exception as e:
+            logger.error(f"医疗问答预测失败: {e}")
+            return {
+                'answer': f'抱歉，处理您的问题时出现错误：{str(e)}',
+                'confidence': 0.0,
+                'error': str(e)
+            }
+    
+    def stream_predict(self, question: str, user_id: str = None,
+                       generation_config: Dict[str, Any] = None) -> Iterator[Dict[str, Any]]:
+        """
+        流式预测医疗问题答案
+        
+        逐段产出解码后的文本，生成结束后写入缓存并产出完整结果。
+        生成器被提前关闭（客户端断开连接）时通过停止条件结束后台生成，不再占用模型。
+        
+        Yields:
+            事件字典：{'event': 'token', 'data': {'text': ...}}，
+            结束时为 {'event': 'done', 'data': result}，出错时为 {'event': 'error', 'data': {...}}
+        """
+        try:
+            generation_config = generation_config or self.generation_config
+            use_cache = generation_config == self.generation_config
+            
+            cached_result = self._get_cached_result(question, user_id) if use_cache else None
+            if cached_result:
+                yield {'event': 'token', 'data': {'text': cached_result['answer']}}
+                yield {'event': 'done', 'data': cached_result}
+                return
             
-            # 解码输出
-            generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+            if not self.model or not self.tokenizer:
+                yield {'event': 'error', 'data': self._model_not_loaded_result()}
+                return
             
-            # 提取回答部分
-            answer = generated_text[len(prompt):].strip()
+            semantic_result, embedding = self._lookup_semantic_cache(question, user_id) if use_cache else (None, None)
+            if semantic_result:
+                yield {'event': 'token', 'data': {'text': semantic_result['answer']}}
+                yield {'event': 'done', 'data': semantic_result}
+                return
             
-            # 计算置信度（基于生成文本的长度和质量）
-            confidence = min(0.9, len(answer) / 100.0 + 0.1)
+            inputs = self._build_generation_inputs([question])
+            
+            streamer = TextIteratorStreamer(
+                self.tokenizer,
+                skip_prompt=True,
+                skip_special_tokens=True,
+                timeout=self.stream_timeout
+            )
+            errors = []
+            stop_event = Event()
+            worker = Thread(
+                target=self._generate_in_background,
+                args=(streamer, errors),
+                kwargs={
+                    **inputs,
+                    **self._generation_kwargs(generation_config),
+                    'stopping_criteria': StoppingCriteriaList([StopOnEvent(stop_event)])
+                },
+                daemon=True
+            )
+            worker.start()
             
-            # 缓存结果
+            pieces = []
             try:
-                redis_mgr.cache_medical_qa(question, answer, user_id)
-                logger.info(f"✅ 医疗问答结果已缓存: {question[:50]}...")
-            except Exception as e:
-                logger.warning(f"缓存医疗问答结果失败: {e}")
+                for text in streamer:
+                    if not text:
+                        continue
+                    pieces.append(text)
+                    yield {'event': 'token', 'data': {'text': text}}
+            finally:
+                # 正常结束时生成已完成；提前关闭或出错时通知后台线程在下一个token后停止
+                stop_event.set()
+                worker.join(timeout=self.stream_stop_timeout)
+                if worker.is_alive():
+                    logger.warning("流式生成线程未在超时时间内结束")
             
-            return {
-                'answer': answer,
-                'confidence': confidence,
-                'question': question,
-                'cached': False,
-                'model_info': {
-                    'model_name': 'Qwen Medical QA',
-                    'device': str(self.device)
+            if errors:
+                raise errors[0]
+            
+            # 已推送的文本可能包含停止序列，最终结果以截断后的答案为准
+            answer = self._trim_stop_sequences(''.join(pieces), generation_config)
+            if use_cache:
+                self._cache_answer(question, answer, user_id, embedding)
+            yield {'event': 'done', 'data': self._build_result(question, answer, generation_config)}
+            
+        except Exception as e:
+            logger.error(f"医疗问答流式预测失败: {e}")
+            yield {
+                'event': 'error',
+                'data': {
+                    'answer': f'抱歉，处理您的问题时出现错误：{str(e)}',
+                    'confidence': 0.0,
+                    'error': str(e)
                 }
             }
+    
+    def resolve_generation_config(self, overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        合并单次请求的生成参数
+        
+        Args:
+            overrides: 请求中的生成参数，支持 max_new_tokens、temperature、top_p、top_k、
+                repetition_penalty 和 stop（停止序列列表）
+            
+        Returns:
+            生成参数，max_new_tokens 不超过服务端上限；无覆盖时返回服务默认参数
             
+        Raises:
+            ValueError: 参数类型或取值无效
+        """
+        if not overrides:
+            return self.generation_config
+        if not isinstance(overrides, dict):
+            raise ValueError('generation 必须是对象')
+        
+        unknown = set(overrides) - set(GENERATION_OVERRIDE_RANGES) - {'max_new_tokens', 'stop'}
+        if unknown:
+            raise ValueError(f"不支持的生成参数: {', '.join(sorted(unknown))}")
+        
+        config = dict(self.generation_config)
+        if 'max_new_tokens' in overrides:
+            try:
+                max_new_tokens = int(overrides['max_new_tokens'])
+            except (TypeError, ValueError):
+                raise ValueError('max_new_tokens 必须是整数')
+            if max_new_tokens < 1:
+                raise ValueError('max_new_tokens 必须大于0')
+            config['max_new_tokens'] = min(max_new_tokens, self.max_new_tokens_limit)
+        
+        for name, (cast, low, high) in GENERATION_OVERRIDE_RANGES.items():
+            if name not in overrides:
+                continue
+            try:
+                value = cast(overrides[name])
+            except (TypeError, ValueError):
+                raise ValueError(f'{name} 类型无效')
+            if not low <= value <= high or (name in ('temperature', 'top_p') and value == 0):
+                raise ValueError(f'{name} 必须在 ({low}, {high}] 范围内' if name in ('temperature', 'top_p')
+                                 else f'{name} 必须在 [{low}, {high}] 范围内')
+            config[name] = value
+        
+        if 'stop' in overrides:
+            stop = overrides['stop']
+            if isinstance(stop, str):
+                stop = [stop]
+            if (not isinstance(stop, list) or len(stop) > 4
+                    or not all(isinstance(item, str) and 0 < len(item) <= 32 for item in stop)):
+                raise ValueError('stop 必须是最多4个、每个不超过32字符的字符串列表')
+            config['stop'] = stop
+        
+        return config
+    
+    def _generate_answer_once(self, question: str, generation_config: Dict[str, Any]) -> Tuple[str, bool]:
+        """
+        合并相同问题的并发生成
+        
+        Returns:
+            (答案, 是否共享了其他请求的生成结果)
+        """
+        if self.single_flight is None:
+            return self._generate_answer(question, generation_config), False
+        # 合并键使用原始问题：规范化可能把不同剂量、数值的问题合并为同一个键
+        key = f"{question}|{json.dumps(generation_config, sort_keys=True, ensure_ascii=False)}"
+        answer, shared = self.single_flight.do(key, lambda: self._generate_answer(question, generation_config))
+        if shared:
+            logger.info(f"✅ 医疗问答合并请求: {question[:50]}...")
+        return answer, shared
+    
+    def _generate_answer(self, question: str, generation_config: Dict[str, Any]) -> str:
+        """生成回答，启用批处理调度时与生成参数相同的并发请求合并生成"""
+        if self.scheduler is None:
+            return self._generate_batch([(question, generation_config)])[0]
+        group_key = json.dumps(generation_config, sort_keys=True, ensure_ascii=False)
+        future = self.scheduler.submit((question, generation_config), group_key=group_key)
+        return future.result(timeout=self.batching_config.get('result_timeout', 300))
+    
+    def _generate_batch(self, items: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
+        """
+        批量生成回答
+        
+        批内请求的生成参数相同；分词器使用左侧填充，批内各问题的新生成token从同一位置开始。
+        """
+        questions = [question for question, _ in items]
+        generation_config = items[0][1]
+        inputs = self._build_generation_inputs(questions)
+        start_time = time.time()
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **inputs,
+                **self._generation_kwargs(generation_config)
+            )
+        
+        # 只解码新生成的部分
+        prompt_length = inputs['input_ids'].shape[1]
+        new_tokens = outputs[:, prompt_length:]
+        self._record_generation(int((new_tokens != self.tokenizer.pad_token_id).sum()), time.time() - start_time)
+        answers = self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+        return [self._trim_stop_sequences(answer, generation_config) for answer in answers]
+    
+    def _trim_stop_sequences(self, answer: str, generation_config: Dict[str, Any]) -> str:
+        """在第一个停止序列处截断答案（不包含停止序列本身）"""
+        for stop in generation_config.get('stop') or []:
+            index = answer.find(stop)
+            if index != -1:
+                answer = answer[:index]
+        return answer.strip()
+    
+    def _generate_in_background(self, streamer: TextIteratorStreamer, errors: list, **generate_kwargs):
+        """在后台线程中生成，异常时结束流以唤醒消费者"""
+        try:
+            start_time = time.time()
+            with torch.no_grad():
+                outputs = self.model.generate(streamer=streamer, **generate_kwargs)
+            new_tokens = outputs[:, generate_kwargs['input_ids'].shape[1]:]
+            self._record_generation(int((new_tokens != self.tokenizer.pad_token_id).sum()), time.time() - start_time)
         except Exception as e:
-            logger.error(f"医疗问答预测失败: {e}")
+            logger.error(f"后台生成失败: {e}")
+            errors.append(e)
+            streamer.end()
+    
+    def _build_prompt(self, question: str) -> str:
+        """构建提示词"""
+        return QA_PROMPT_TEMPLATE.format(question=question)
+    
+    def _build_generation_inputs(self, questions: List[str]) -> Dict[str, Any]:
+        """
+        构建生成输入
+        
+        有前缀KV缓存时，输入为 [前缀][填充][问题+后缀]：前缀部分直接复用缓存，
+        填充位于前缀之后并被attention_mask屏蔽，位置编码由mask累加得到，与未填充时一致。
+        每个提示词整体分词后按前缀token切分，某个问题与前缀的分词边界不一致时整批改为完整预填充。
+        """
+        prompts = [self._build_prompt(question) for question in questions]
+        if self._prefix_kv is None:
+            return self._encode_prompt(prompts)
+        
+        prefix = self._prefix_ids[0].tolist()
+        prompt_ids = [self._prompt_ids(question) for question in questions]
+        if not all(ids[:len(prefix)] == prefix and len(ids) > len(prefix) for ids in prompt_ids):
+            logger.info("问题与提示词前缀的分词边界不一致，本批使用完整预填充")
+            return self._encode_prompt(prompts)
+        
+        suffixes = [ids[len(prefix):] for ids in prompt_ids]
+        suffix_length = max(len(ids) for ids in suffixes)
+        pad_token_id = self.tokenizer.pad_token_id
+        if pad_token_id is None:
+            pad_token_id = self.tokenizer.eos_token_id
+        input_ids = [prefix + [pad_token_id] * (suffix_length - len(ids)) + ids for ids in suffixes]
+        attention_mask = [[1] * len(prefix) + [0] * (suffix_length - len(ids)) + [1] * len(ids) for ids in suffixes]
+        
+        return {
+            'input_ids': torch.tensor(input_ids, device=self.device),
+            'attention_mask': torch.tensor(attention_mask, device=self.device),
+            'past_key_values': self._prefix_past_key_values(len(questions))
+        }
+    
+    def _prompt_ids(self, question: str) -> List[int]:
+        """单个完整提示词的token，分词设置与 _encode_prompt 一致"""
+        return self.tokenizer(self._build_prompt(question), truncation=True, max_length=512)['input_ids']
+    
+    def _encode_prompt(self, prompt: Union[str, List[str]]) -> Dict[str, torch.Tensor]:
+        """编码输入"""
+        return self.tokenizer(
+            prompt,
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=512
+        ).to(self.device)
+    
+    def _generation_kwargs(self, generation_config: Dict[str, Any]) -> Dict[str, Any]:
+        """转换为 model.generate 的参数"""
+        kwargs = {
+            name: generation_config[name]
+            for name in GENERATION_PARAM_KEYS
+            if generation_config.get(name) is not None
+        }
+        kwargs['pad_token_id'] = self.tokenizer.eos_token_id
+        if generation_config.get('stop'):
+            # 生成出停止序列后提前结束
+            kwargs['stop_strings'] = generation_config['stop']
+            kwargs['tokenizer'] = self.tokenizer
+        return kwargs
+    
+    def _get_cached_result(self, question: str, user_id: str = None) -> Optional[Dict[str, Any]]:
+        """从缓存获取结果：先查当前用户的精确缓存，再查规范化问题的共享缓存"""
+        from utils.redis_manager import get_redis_manager
+        redis_mgr = get_redis_manager()
+        cached_answer = redis_mgr.get_medical_qa_cache(question, user_id)
+        cache_type = 'exact'
+        if not cached_answer and self.shared_cache_enabled:
+            cached_answer = redis_mgr.get_shared_medical_qa_cache(normalize_question(question))
+            cache_type = 'shared'
+        if cached_answer:
+            logger.info(f"✅ 医疗问答缓存命中({cache_type}): {question[:50]}...")
             return {
-                'answer': f'抱歉，处理您的问题时出现错误：{str(e)}',
-                'confidence': 0.0,
-                'error': str(e)
+                'answer': cached_answer,
+                'confidence': 0.9,
+                'cached': True,
+                'cache_type': cache_type
             }
+        return None
+    
+    def _lookup_semantic_cache(self, question: str, user_id: str = None):
+        """
+        从语义缓存获取结果
+        
+        Returns:
+            (命中结果或None, 问题向量或None)，未命中时向量用于生成后写入缓存
+        """
+        if self.semantic_cache is None:
+            return None, None
+        try:
+            embedding = self._embed_question(normalize_question(question))
+        except Exception as e:
+            logger.warning(f"计算问题向量失败: {e}")
+            return None, None
+        
+        match = self.semantic_cache.lookup(embedding)
+        if not match:
+            return None, embedding
+        
+        logger.info(f"✅ 医疗问答语义缓存命中: {question[:50]}... ≈ {match['question'][:50]} "
+                    f"(相似度 {match['similarity']:.4f})")
+        # 写入当前用户的精确缓存，后续相同问题无需再计算向量
+        self._cache_user_answer(question, match['answer'], user_id)
+        return {
+            'answer': match['answer'],
+            'confidence': 0.9,
+            'cached': True,
+            'cache_type': 'semantic',
+            'similarity': match['similarity'],
+            'matched_question': match['question']
+        }, embedding
+    
+    def _embed_question(self, normalized_question: str) -> np.ndarray:
+        """计算问题向量：句向量模型最后一层隐状态按attention_mask做均值池化"""
+        inputs = self.embedding_tokenizer(
+            normalized_question,
+            return_tensors="pt",
+            truncation=True,
+            max_length=128
+        ).to(self.device)
+        with torch.no_grad():
+            hidden_states = self.embedding_model(
+                input_ids=inputs['input_ids'],
+                attention_mask=inputs['attention_mask']
+            ).last_hidden_state
+        mask = inputs['attention_mask'].unsqueeze(-1).to(hidden_states.dtype)
+        pooled = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        return pooled[0].float().cpu().numpy()
+    
+    def _cache_answer(self, question: str, answer: str, user_id: str = None, embedding: np.ndarray = None):
+        """缓存结果"""
+        self._cache_user_answer(question, answer, user_id)
+        if not self.shared_cache_enabled or not answer:
+            return
+        normalized = normalize_question(question)
+        try:
+            from utils.redis_manager import get_redis_manager
+            get_redis_manager().cache_shared_medical_qa(normalized, answer)
+        except Exception as e:
+            logger.warning(f"缓存共享医疗问答结果失败: {e}")
+        if self.semantic_cache is not None and embedding is not None:
+            self.semantic_cache.add(normalized, embedding, answer)
+    
+    def _cache_user_answer(self, question: str, answer: str, user_id: str = None):
+        """缓存当前用户的结果"""
+        try:
+            from utils.redis_manager import get_redis_manager
+            get_redis_manager().cache_medical_qa(question, answer, user_id)
+            logger.info(f"✅ 医疗问答结果已缓存: {question[:50]}...")
+        except Exception as e:
+            logger.warning(f"缓存医疗问答结果失败: {e}")
+    
+    def _build_result(self, question: str, answer: str, generation_config: Dict[str, Any]) -> Dict[str, Any]:
+        """构建返回结果"""
+        # 计算置信度（基于生成文本的长度和质量）
+        confidence = min(0.9, len(answer) / 100.0 + 0.1)
+        
+        return {
+            'answer': answer,
+            'confidence': confidence,
+            'question': question,
+            'cached': False,
+            'model_info': {
+                'model_name': 'Qwen Medical QA',
+                'device': str(self.device),
+                'quantization': self.model_stats['quantization'],
+                'max_new_tokens': generation_config['max_new_tokens']
+            }
+        }
+    
+    def _model_not_loaded_result(self) -> Dict[str, Any]:
+        """模型未加载时的返回结果"""
+        return {
+            'answer': '模型未加载，请检查模型文件',
+            'confidence': 0.0,
+            'error': 'Model not loaded'
+        }
     
     def batch_predict(self, questions: list) -> list:
         """批量预测"""
-        results = []
-        for question in questions:
-            result = self.predict(question)
-            results.append(result)
-        return results
+        if self.scheduler is None or len(questions) <= 1:
+            return [self.predict(question) for question in questions]
+        # 并发提交，由调度器合并为批次生成
+        with ThreadPoolExecutor(max_workers=min(len(questions), self.scheduler.max_batch_size)) as executor:
+            return list(executor.map(self.predict, questions))
 
 if __name__ == "__main__":
     # 测试服务
@@ -6,19 +6,29 @@
 
 import torch
 import torch.nn.functional as F
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 from transformers import AutoTokenizer, AutoModel
 import numpy as np
 import logging
 import os
 import sys
+import time
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 import joblib
 
 sys.path.append(str(Path(__file__).parent.parent.parent))
 
+from config import MODEL_CONFIGS
+
 logger = logging.getLogger(__name__)
 
+# 长文本模式支持的窗口结果聚合方式
+AGGREGATION_STRATEGIES = ('max', 'mean')
+
+class DocumentTooLongError(ValueError):
+    """长文本模式下文本超过配置的字符数或窗口数上限"""
+
 class TumorLSTMClassifier(torch.nn.Module):
     """肿瘤分类模型"""
     
@@ -37,8 +47,17 @@ class TumorLSTMClassifier(torch.nn.Module):
     def forward(self, input_ids, attention_mask):
         outputs = self.bert(input_ids=input_ids, attention_mask=attention_mask)
         sequence_output = outputs.last_hidden_state
-        lstm_out, _ = self.lstm(sequence_output)
-        pooled = lstm_out[:, -1, :]
+        lengths = attention_mask.sum(dim=1)
+        if bool((lengths == input_ids.size(1)).all()):
+            lstm_out, _ = self.lstm(sequence_output)
+            pooled = lstm_out[:, -1, :]
+        else:
+            # 批内存在填充时按实际长度打包，反向LSTM从每条文本的最后一个有效token开始，
+            # 取最后一个有效位置的输出，结果与逐条推理一致
+            packed = pack_padded_sequence(sequence_output, lengths.cpu(), batch_first=True, enforce_sorted=False)
+            lstm_out, _ = self.lstm(packed)
+            lstm_out, _ = pad_packed_sequence(lstm_out, batch_first=True)
+            pooled = lstm_out[torch.arange(lstm_out.size(0), device=lstm_out.device), lengths - 1]
         logits = self.classifier(pooled)
         return logits
 
@@ -51,6 +70,10 @@ class TumorService:
         self.tokenizer = None
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.class_names = ['良性', '恶性', '交界性']
+        # 批量推理时每次前向的最大文本数
+        self.batch_size = MODEL_CONFIGS['tumor'].get('batch_size', 16)
+        self.max_length = MODEL_CONFIGS['tumor'].get('max_length', 512)
+        self.long_document_config = MODEL_CONFIGS['tumor'].get('long_document', {})
         
         try:
             self._load_model()
@@ -79,8 +102,16 @@ class TumorService:
         self.model = self.model.to(self.device)
         self.model.eval()
     
-    def predict(self, text: str) -> Dict[str, Any]:
-        """预测肿瘤分类"""
+    def predict(self, text: str, long_document: bool = False,
+                aggregation: Optional[str] = None) -> Dict[str, Any]:
+        """
+        预测肿瘤分类
+        
+        Args:
+            text: 病理文本
+            long_document: 是否启用长文本模式，按重叠窗口切分后整体分类，避免截断丢失结论
+            aggregation: 长文本模式下窗口logits的聚合方式（max/mean），默认取配置值
+        """
         try:
             if not self.model or not self.tokenizer:
                 return {
@@ -99,12 +130,15 @@ class TumorService:
                     'error': 'Empty text'
                 }
             
+            if long_document:
+                return self._predict_long_document(text, aggregation)
+            
             # 编码输入
             inputs = self.tokenizer(
                 text,
                 truncation=True,
                 padding=True,
-                max_length=512,
+                max_length=self.max_length,
                 return_tensors="pt"
             ).to(self.device)
             model_inputs = {
@@ -115,26 +149,12 @@ class TumorService:
             with torch.no_grad():
                 outputs = self.model(input_ids=model_inputs['input_ids'], attention_mask=model_inputs['attention_mask'])
                 probabilities = F.softmax(outputs, dim=1)
-                predicted_class = torch.argmax(probabilities, dim=1).item()
-                confidence = probabilities[0][predicted_class].item()
             
-            # 获取分类结果
-            class_name = self.class_names[predicted_class]
-            
-            # 生成分析报告和健康建议
-            analysis = self._generate_analysis(text, class_name, confidence)
-            
-            return {
-                'prediction': class_name,
-                'class': class_name,
-                'confidence': confidence,
-                'probabilities': {
-                    name: float(prob) for name, prob in zip(self.class_names, probabilities[0])
-                },
-                'input_text': text,
-                'recommendations': analysis['recommendations']
-            }
+            return self._build_result(text, probabilities[0])
             
+        except DocumentTooLongError:
+            # 由调用方作为请求参数错误处理
+            raise
         except Exception as e:
             logger.error(f"肿瘤分类预测失败: {e}")
             return {
@@ -144,6 +164,141 @@ class TumorService:
                 'error': str(e)
             }
     
+    def _build_result(self, text: str, probabilities: torch.Tensor) -> Dict[str, Any]:
+        """根据单条文本的类别概率构建返回结果"""
+        predicted_class = torch.argmax(probabilities).item()
+        confidence = probabilities[predicted_class].item()
+        
+        # 获取分类结果
+        class_name = self.class_names[predicted_class]
+        
+        # 生成分析报告和健康建议
+        analysis = self._generate_analysis(text, class_name, confidence)
+        
+        return {
+            'prediction': class_name,
+            'class': class_name,
+            'confidence': confidence,
+            'probabilities': {
+                name: float(prob) for name, prob in zip(self.class_names, probabilities)
+            },
+            'input_text': text,
+            'recommendations': analysis['recommendations']
+        }
+    
+    def _predict_long_document(self, text: str, aggregation: Optional[str] = None) -> Dict[str, Any]:
+        """
+        长文本模式预测
+        
+        将文本按token切分为有重叠的窗口，按推理批大小分批前向，
+        再按聚合方式合并各窗口的logits。
+        
+        Raises:
+            DocumentTooLongError: 文本字符数或窗口数超过配置上限
+        """
+        aggregation = aggregation or self.long_document_config.get('aggregation', 'max')
+        if aggregation not in AGGREGATION_STRATEGIES:
+            raise ValueError(f"不支持的聚合方式: {aggregation}")
+        max_chars = self.long_document_config.get('max_chars', 60000)
+        if len(text) > max_chars:
+            raise DocumentTooLongError(f"文本过长：{len(text)}个字符，长文本模式最多{max_chars}个字符")
+        
+        start_time = time.perf_counter()
+        token_ids = self.tokenizer(text, add_special_tokens=False)['input_ids']
+        spans = self._window_spans(len(token_ids))
+        max_windows = self.long_document_config.get('max_windows', 32)
+        if len(spans) > max_windows:
+            raise DocumentTooLongError(f"文本过长：需要{len(spans)}个窗口，长文本模式最多{max_windows}个窗口")
+        windows = [
+            self.tokenizer.build_inputs_with_special_tokens(token_ids[start:end])
+            for start, end in spans
+        ]
+        tokenize_time = time.perf_counter()
+        
+        logits = self._forward_batches(windows)
+        forward_time = time.perf_counter()
+        
+        if aggregation == 'max':
+            aggregated = logits.max(dim=0).values
+        else:
+            aggregated = logits.mean(dim=0)
+        probabilities = F.softmax(aggregated, dim=0)
+        window_probabilities = F.softmax(logits, dim=1)
+        
+        result = self._build_result(text, probabilities)
+        result['long_document'] = {
+            'aggregation': aggregation,
+            'num_tokens': len(token_ids),
+            'num_windows': len(windows),
+            'windows': [
+                {
+                    'token_start': start,
+                    'token_end': end,
+                    'class': self.class_names[int(torch.argmax(row))],
+                    'confidence': float(row.max())
+                }
+                for (start, end), row in zip(spans, window_probabilities)
+            ],
+            'timing_ms': {
+                'tokenize': round((tokenize_time - start_time) * 1000, 2),
+                'forward': round((forward_time - tokenize_time) * 1000, 2),
+                'per_window': round((forward_time - tokenize_time) * 1000 / len(windows), 2),
+                'total': round((time.perf_counter() - start_time) * 1000, 2)
+            }
+        }
+        return result
+    
+    def _window_spans(self, num_tokens: int) -> List[tuple]:
+        """计算长文本模式下各窗口在token序列中的起止位置"""
+        window_size = self.long_document_config.get('window_size', self.max_length)
+        # 窗口长度需要为[CLS]/[SEP]等特殊token留出位置
+        body_size = min(window_size, self.max_length) - self.tokenizer.num_special_tokens_to_add(pair=False)
+        overlap = min(self.long_document_config.get('overlap', 128), body_size - 1)
+        step = body_size - overlap
+        
+        spans = [(0, min(body_size, num_tokens))]
+        while spans[-1][1] < num_tokens:
+            start = spans[-1][0] + step
+            spans.append((start, min(start + body_size, num_tokens)))
+        return spans
+    
+    def _forward_batches(self, input_ids_list: List[List[int]], batch_size: Optional[int] = None) -> torch.Tensor:
+        """
+        分批前向计算
+        
+        按token长度排序后切分批次，使同一批次内长度相近、填充最少，
+        每批动态填充到批内最长长度，结果按原始顺序返回。
+        
+        Args:
+            input_ids_list: 已编码的token id列表
+            batch_size: 单次前向的最大文本数，默认取配置值
+            
+        Returns:
+            logits，形状为 (len(input_ids_list), num_classes)
+        """
+        batch_size = batch_size or self.batch_size
+        order = sorted(range(len(input_ids_list)), key=lambda i: len(input_ids_list[i]))
+        logits = [None] * len(input_ids_list)
+        
+        with torch.no_grad():
+            for start in range(0, len(order), batch_size):
+                chunk = order[start:start + batch_size]
+                max_len = len(input_ids_list[chunk[-1]])
+                input_ids = torch.full((len(chunk), max_len), self.tokenizer.pad_token_id, dtype=torch.long)
+                attention_mask = torch.zeros((len(chunk), max_len), dtype=torch.long)
+                for row, index in enumerate(chunk):
+                    ids = input_ids_list[index]
+                    input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+                    attention_mask[row, :len(ids)] = 1
+                outputs = self.model(
+                    input_ids=input_ids.to(self.device),
+                    attention_mask=attention_mask.to(self.device)
+                )
+                for index, row in zip(chunk, outputs):
+                    logits[index] = row
+        
+        return torch.stack(logits)
+    
     def _generate_analysis(self, text: str, class_name: str, confidence: float) -> Dict[str, Any]:
         """生成分析报告"""
         analysis = {
@@ -195,11 +350,40 @@ class TumorService:
         return analysis
     
     def batch_predict(self, texts: list) -> list:
-        """批量预测"""
-        results = []
-        for text in texts:
-            result = self.predict(text)
-            results.append(result)
+        """
+        批量预测
+        
+        所有文本一次性编码，按长度分桶后分批前向，结果与输入顺序一致。
+        """
+        if not self.model or not self.tokenizer:
+            return [self.predict(text) for text in texts]
+        
+        results = [None] * len(texts)
+        valid_indices = []
+        for i, text in enumerate(texts):
+            if text.strip():
+                valid_indices.append(i)
+            else:
+                # 空文本直接返回错误结果，不参与前向
+                results[i] = self.predict(text)
+        if not valid_indices:
+            return results
+        
+        try:
+            valid_texts = [texts[i] for i in valid_indices]
+            encodings = self.tokenizer(valid_texts, truncation=True, max_length=self.max_length)
+            probabilities = F.softmax(self._forward_batches(encodings['input_ids']), dim=1)
+            for i, text, row in zip(valid_indices, valid_texts, probabilities):
+                results[i] = self._build_result(text, row)
+        except Exception as e:
+            logger.error(f"肿瘤分类批量预测失败: {e}")
+            for i in valid_indices:
+                results[i] = {
+                    'prediction': f'预测失败: {str(e)}',
+                    'class': 'unknown',
+                    'confidence': 0.0,
+                    'error': str(e)
+                }
         return results
 
 if __name__ == "__main__":
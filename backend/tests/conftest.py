@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+测试公共配置
+测试不依赖真实Redis：指向不可连接的地址，RedisManager 以纯本地缓存模式运行
+"""
+
+import os
+import sys
+from pathlib import Path
+
+os.environ['REDIS_URL'] = 'redis://127.0.0.1:1/0'
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+import pytest
+
+# 训练微型分词器的语料：覆盖提示词模板和测试问题
+TINY_CORPUS = [
+    "请回答以下医疗问题，请用专业但易懂的语言回答：\n\n问题：{question}\n\n回答：",
+    "什么是高血压？高血压是指血压持续升高。",
+    "糖尿病的早期症状有哪些？多饮多尿多食和体重下降。",
+    "如何预防心脏病？戒烟限酒，规律运动，控制血压血糖。",
+    "What is hypertension? Blood pressure 140/90 mmHg.",
+]
+
+@pytest.fixture(scope="session")
+def tiny_qwen_dir(tmp_path_factory):
+    """随机初始化的微型Qwen2模型和BPE分词器，保存为本地模型目录，不需要下载"""
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM
+
+    model_dir = tmp_path_factory.mktemp("models") / "Qwen-tiny"
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=400, special_tokens=["<|endoftext|>"],
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tokenizer.train_from_iterator(TINY_CORPUS * 20, trainer=trainer)
+    fast_tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<|endoftext|>",
+                                             pad_token="<|endoftext|>", padding_side='left',
+                                             model_input_names=['input_ids', 'attention_mask'])
+    fast_tokenizer.save_pretrained(model_dir)
+
+    torch.manual_seed(0)
+    config = Qwen2Config(vocab_size=len(fast_tokenizer), hidden_size=32, intermediate_size=64,
+                         num_hidden_layers=2, num_attention_heads=4, num_key_value_heads=2,
+                         max_position_embeddings=1024, eos_token_id=fast_tokenizer.eos_token_id,
+                         pad_token_id=fast_tokenizer.eos_token_id)
+    Qwen2ForCausalLM(config).save_pretrained(model_dir)
+    return model_dir
+
+@pytest.fixture
+def qa_service_options():
+    """qa_service 的构建选项，测试模块可覆盖此fixture，也可对 qa_service 间接参数化"""
+    return {}
+
+@pytest.fixture
+def qa_service(request, monkeypatch, qa_service_options):
+    """
+    不加载真实语言模型的医疗问答服务，使用纯本地缓存模式的RedisManager
+
+    选项:
+        model: 为True时挂载微型Qwen2模型和分词器（CPU）
+        semantic_cache: 覆盖 MODEL_CONFIGS['medical_qa']['semantic_cache'] 中的配置项
+        single_flight: 是否启用请求合并，默认关闭
+    """
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    import utils.redis_manager as redis_manager_module
+    from config import MODEL_CONFIGS
+    from services import medical_qa_service
+    from utils.redis_manager import RedisManager
+
+    options = {**qa_service_options, **getattr(request, 'param', {})}
+    if 'semantic_cache' in options:
+        semantic_config = dict(MODEL_CONFIGS['medical_qa']['semantic_cache'], **options['semantic_cache'])
+        monkeypatch.setitem(MODEL_CONFIGS['medical_qa'], 'semantic_cache', semantic_config)
+    monkeypatch.setitem(MODEL_CONFIGS['medical_qa'], 'single_flight',
+                        {'enabled': options.get('single_flight', False)})
+    monkeypatch.setattr(redis_manager_module, 'redis_manager', RedisManager(local_cache_size=1024))
+    monkeypatch.setattr(medical_qa_service.MedicalQAService, '_load_model', lambda self: None)
+
+    service = medical_qa_service.MedicalQAService()
+    if options.get('model'):
+        model_dir = request.getfixturevalue('tiny_qwen_dir')
+        service.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        service.model = AutoModelForCausalLM.from_pretrained(model_dir).eval()
+        service.device = torch.device('cpu')
+    return service
+
+# 微型BERT分词器的词表
+TINY_BERT_VOCAB = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + list('肿瘤良性恶交界细胞核分裂象')
+
+@pytest.fixture
+def tumor_service(tmp_path, monkeypatch):
+    """使用随机初始化的微型BERT + BiLSTM分类器的肿瘤分类服务，单次前向最多2条文本"""
+    import torch
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    from services.tumor_service import TumorLSTMClassifier, TumorService
+
+    vocab_file = tmp_path / 'vocab.txt'
+    vocab_file.write_text('\n'.join(TINY_BERT_VOCAB), encoding='utf-8')
+    tokenizer = BertTokenizerFast(vocab_file=str(vocab_file))
+
+    torch.manual_seed(0)
+    bert_dir = tmp_path / 'bert'
+    BertModel(BertConfig(vocab_size=len(TINY_BERT_VOCAB), hidden_size=32, num_hidden_layers=1,
+                         num_attention_heads=2, intermediate_size=64)).save_pretrained(bert_dir)
+    model = TumorLSTMClassifier(str(bert_dir), lstm_hidden_size=8, num_classes=3).eval()
+
+    def fake_load(self):
+        self.tokenizer = tokenizer
+        self.model = model
+
+    monkeypatch.setattr(TumorService, '_load_model', fake_load)
+    service = TumorService()
+    service.batch_size = 2
+    return service
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+微批调度器测试
+按分组键合并批次、等待窗口到期后提交不满的批次、批处理失败时传递异常
+"""
+
+import threading
+
+import pytest
+
+from utils.batch_scheduler import BatchScheduler
+
+class RecordingBatch:
+    """记录每个批次的批处理函数，首个批次可被阻塞以积压后续请求"""
+
+    def __init__(self, block_first: bool = False):
+        self.batches = []
+        self.first_started = threading.Event()
+        self.release = threading.Event()
+        if not block_first:
+            self.release.set()
+
+    def __call__(self, items):
+        if not self.batches:
+            self.first_started.set()
+            self.release.wait(5)
+        self.batches.append(list(items))
+        return [f"{item}!" for item in items]
+
+def test_groups_only_requests_with_same_key():
+    process = RecordingBatch(block_first=True)
+    scheduler = BatchScheduler(process, max_batch_size=8, max_wait_ms=50)
+    try:
+        blocker = scheduler.submit('warmup', group_key='x')
+        assert process.first_started.wait(5)
+        # 调度线程被占用期间提交的请求在积压中按分组合并
+        futures = [scheduler.submit(item, group_key=key)
+                   for item, key in [('a1', 'a'), ('b1', 'b'), ('a2', 'a'), ('b2', 'b'), ('a3', 'a')]]
+        process.release.set()
+
+        assert blocker.result(timeout=5) == 'warmup!'
+        assert [future.result(timeout=5) for future in futures] == ['a1!', 'b1!', 'a2!', 'b2!', 'a3!']
+    finally:
+        scheduler.shutdown()
+
+    assert process.batches[1:] == [['a1', 'a2', 'a3'], ['b1', 'b2']]
+
+def test_respects_max_batch_size():
+    process = RecordingBatch(block_first=True)
+    scheduler = BatchScheduler(process, max_batch_size=2, max_wait_ms=50)
+    try:
+        scheduler.submit('warmup')
+        assert process.first_started.wait(5)
+        futures = [scheduler.submit(i) for i in range(5)]
+        process.release.set()
+        for future in futures:
+            future.result(timeout=5)
+    finally:
+        scheduler.shutdown()
+
+    assert all(len(batch) <= 2 for batch in process.batches)
+    assert sorted(item for batch in process.batches[1:] for item in batch) == list(range(5))
+
+def test_flushes_partial_batch_after_wait_window():
+    process = RecordingBatch()
+    scheduler = BatchScheduler(process, max_batch_size=8, max_wait_ms=30)
+    try:
+        # 只有一个请求时不会一直等到批次凑满
+        assert scheduler.submit('only').result(timeout=2) == 'only!'
+    finally:
+        scheduler.shutdown()
+
+    assert process.batches == [['only']]
+    assert scheduler.get_stats()['batches'] == 1
+
+def test_batch_failure_propagates_to_all_callers():
+    def fail(items):
+        raise ValueError('推理失败')
+
+    scheduler = BatchScheduler(fail, max_batch_size=4, max_wait_ms=30)
+    try:
+        futures = [scheduler.submit(i) for i in range(3)]
+        for future in futures:
+            with pytest.raises(ValueError, match='推理失败'):
+                future.result(timeout=5)
+    finally:
+        scheduler.shutdown()
+
+def test_rejects_when_queue_full():
+    process = RecordingBatch(block_first=True)
+    scheduler = BatchScheduler(process, max_batch_size=1, max_wait_ms=0, max_queue_size=1)
+    try:
+        scheduler.submit('running')
+        assert process.first_started.wait(5)
+        scheduler.submit('queued')
+        with pytest.raises(RuntimeError):
+            scheduler.submit('rejected')
+    finally:
+        process.release.set()
+        scheduler.shutdown()
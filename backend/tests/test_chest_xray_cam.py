@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+胸部X光热力图测试
+在随机初始化的小输入DenseNet121上，优化后的CAM实现与逐步计算的参考实现在容差内一致
+"""
+
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+from services import chest_xray_service
+from services.chest_xray_service import (
+    ActivationsAndGradients, CAMBase, DenseNet121, GradCAM, GradCAMPlusPlus, ScoreCAM
+)
+
+# 分块前向与逐通道前向的累加顺序不同，结果只在浮点误差内一致
+CAM_TOLERANCE = 1e-5
+
+def _split_forward(model, input_tensor):
+    """与服务一致的拆分前向：特征部分不记录计算图，只对分类头求梯度"""
+    with torch.no_grad():
+        activations = model.forward_features(input_tensor)
+    activations = activations.detach().requires_grad_(True)
+    with torch.enable_grad():
+        output = model.forward_head(activations)
+    return activations, output
+
+@pytest.fixture(scope='module')
+def model():
+    torch.manual_seed(0)
+    return DenseNet121(num_classes=14).eval()
+
+@pytest.fixture(scope='module')
+def input_tensor():
+    torch.manual_seed(1)
+    return torch.randn(1, 3, 64, 64)
+
+@pytest.fixture(scope='module')
+def gradient_input_tensor():
+    # 梯度类CAM不做掩码前向，用较大输入得到4x4的激活
+    torch.manual_seed(2)
+    return torch.randn(1, 3, 128, 128)
+
+@pytest.fixture
+def hooks(model):
+    hooks = ActivationsAndGradients([model.densenet.features.denseblock4])
+    yield hooks
+    hooks.release()
+
+def _score_cam_per_channel(model, input_tensor, activations, targets):
+    """参考实现：每个选中通道单独上采样、归一化并做一次掩码前向，返回各目标的CAM"""
+    _, _, height, width = input_tensor.size()
+    activations = F.relu(activations)
+    channel_importance = torch.mean(activations.view(activations.size(1), -1), dim=1)
+    k = min(64, activations.size(1))
+    _, top_k_indices = torch.topk(channel_importance, k)
+
+    cams = {target: torch.zeros((height, width)) for target in targets}
+    with torch.no_grad():
+        for i in top_k_indices:
+            upsampled = F.interpolate(activations[:, i:i + 1], size=(height, width),
+                                      mode='bilinear', align_corners=False)
+            upsampled_norm = F.softmax(upsampled.view(1, -1), dim=1).view_as(upsampled)
+            output = model(input_tensor * upsampled_norm)
+            for target in targets:
+                score = output[0, target] if target is not None else output[0].max()
+                cams[target] += score * upsampled_norm[0, 0] * channel_importance[i]
+    return {target: CAMBase._normalize_cam(cam) for target, cam in cams.items()}
+
+@pytest.fixture(scope='module')
+def score_cam_reference(model, input_tensor):
+    with torch.no_grad():
+        activations = model.forward_features(input_tensor)
+    return activations, _score_cam_per_channel(model, input_tensor, activations, [2, 5, 7, 11, None])
+
+@pytest.mark.parametrize('batch_size', [1, 3, 8, 64])
+def test_score_cam_chunks_match_per_channel_loop(model, input_tensor, hooks, score_cam_reference, batch_size):
+    activations, expected = score_cam_reference
+    cam = ScoreCAM(model, hooks.target_layers, hooks=hooks, batch_size=batch_size)
+
+    targets = [2, 7, 11]
+    cams = cam._compute_cam(input_tensor, activations, targets)
+    assert cams.shape == (len(targets), 64, 64)
+    for target, result in zip(targets, cams):
+        np.testing.assert_allclose(result, expected[target], atol=CAM_TOLERANCE)
+
+    for target in (5, None):
+        result = cam._compute_cam(input_tensor, activations, target)
+        assert result.shape == (1, 64, 64)
+        np.testing.assert_allclose(result[0], expected[target], atol=CAM_TOLERANCE)
+
+def test_forward_head_matches_forward(model, input_tensor):
+    with torch.no_grad():
+        expected = model(input_tensor)
+        output = model.forward_head(model.forward_features(input_tensor))
+    torch.testing.assert_close(output, expected, rtol=1e-5, atol=1e-5)
+
+@pytest.mark.parametrize('cam_class', [GradCAM, GradCAMPlusPlus])
+@pytest.mark.parametrize('target', [0, 6, 13])
+def test_from_activations_matches_standalone_backward(model, gradient_input_tensor, hooks, cam_class, target):
+    cam = cam_class(model, hooks.target_layers, hooks=hooks)
+    expected = cam(gradient_input_tensor, targets=target)
+    assert expected.max() > 0
+
+    activations, output = _split_forward(model, gradient_input_tensor)
+    result = cam.from_activations(gradient_input_tensor, activations, output, targets=target)
+
+    assert result.shape == expected.shape == (1, 4, 4)
+    np.testing.assert_allclose(result, expected, atol=CAM_TOLERANCE)
+
+@pytest.mark.parametrize('cam_class', [GradCAM, GradCAMPlusPlus])
+def test_batched_targets_match_per_class_backward(model, gradient_input_tensor, hooks, cam_class):
+    cam = cam_class(model, hooks.target_layers, hooks=hooks)
+    targets = [1, 4, 9, 12]
+
+    activations, output = _split_forward(model, gradient_input_tensor)
+    result = cam.from_activations(gradient_input_tensor, activations, output, targets=targets)
+    assert result.shape == (len(targets), 4, 4)
+
+    for target, row in zip(targets, result):
+        expected = cam(gradient_input_tensor, targets=target)[0]
+        np.testing.assert_allclose(row, expected, atol=CAM_TOLERANCE)
+
+        activations, output = _split_forward(model, gradient_input_tensor)
+        single = cam.from_activations(gradient_input_tensor, activations, output, targets=target)[0]
+        np.testing.assert_allclose(row, single, atol=CAM_TOLERANCE)
+
+def test_batched_gradients_match_per_class_grad(model, gradient_input_tensor, monkeypatch):
+    # 确认走的是批量反向而不是逐类别回退
+    def fail_fallback(message):
+        raise AssertionError(message)
+    monkeypatch.setattr(chest_xray_service.logger, 'debug', fail_fallback)
+
+    targets = [0, 3, 13]
+    activations, output = _split_forward(model, gradient_input_tensor)
+    gradients = CAMBase._batched_gradients(activations, output, targets)
+    assert gradients.shape == (len(targets), *activations.shape)
+
+    for target, gradient in zip(targets, gradients):
+        activations, output = _split_forward(model, gradient_input_tensor)
+        expected = CAMBase._gradients_from_output(activations, output, target)
+        torch.testing.assert_close(gradient, expected, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+异步任务管理器测试
+状态流转、max_pending背压、Redis键与预测缓存键隔离
+"""
+
+import threading
+import time
+
+import pytest
+
+from utils.job_manager import JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JobManager
+
+def _wait_finished(manager, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    job = manager.get(job_id)
+    while job['status'] not in (JOB_SUCCEEDED, JOB_FAILED):
+        assert time.monotonic() < deadline, job
+        time.sleep(0.01)
+        job = manager.get(job_id)
+    return job
+
+def test_state_transitions_and_result():
+    manager = JobManager(name='test', max_workers=1)
+    started = threading.Event()
+    release = threading.Event()
+    completed = []
+
+    def task():
+        started.set()
+        release.wait(5)
+        return {'value': 42}
+
+    job = manager.submit(task, owner='u1', on_complete=completed.append)
+    assert job['status'] in (JOB_QUEUED, JOB_RUNNING)
+    assert started.wait(5)
+    assert manager.get(job['job_id'])['status'] == JOB_RUNNING
+
+    release.set()
+    finished = _wait_finished(manager, job['job_id'])
+    assert finished['status'] == JOB_SUCCEEDED
+    assert finished['result'] == {'value': 42}
+    assert finished['owner'] == 'u1'
+    assert finished['started_at'] <= finished['finished_at']
+    manager.shutdown()
+    assert completed and completed[0]['status'] == JOB_SUCCEEDED
+
+def test_failed_job_records_error():
+    manager = JobManager(name='test', max_workers=1)
+
+    def task():
+        raise ValueError('坏图像')
+
+    job = manager.submit(task)
+    finished = _wait_finished(manager, job['job_id'])
+    manager.shutdown()
+    assert finished['status'] == JOB_FAILED
+    assert finished['error'] == '坏图像'
+    assert manager.get_stats()['failed'] == 1
+
+def test_rejects_when_max_pending_reached():
+    manager = JobManager(name='test', max_workers=1, max_pending=2)
+    release = threading.Event()
+
+    jobs = [manager.submit(lambda: release.wait(5)) for _ in range(2)]
+    with pytest.raises(RuntimeError):
+        manager.submit(lambda: None)
+    assert manager.get_stats()['rejected'] == 1
+
+    # 任务结束后释放名额
+    release.set()
+    for job in jobs:
+        _wait_finished(manager, job['job_id'])
+    manager.submit(lambda: None)
+    manager.shutdown()
+    assert manager.get_stats()['active'] == 0
+
+def test_job_state_survives_model_cache_clear(monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    from utils.redis_manager import RedisManager
+
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(RedisManager, '_connect', lambda self: setattr(self, 'redis_client', client))
+    redis_mgr = RedisManager(local_cache_size=0)
+
+    manager = JobManager(name='chest_xray', max_workers=1, redis_manager=redis_mgr)
+    job = manager.submit(lambda: 'ok')
+    _wait_finished(manager, job['job_id'])
+    manager.shutdown()
+
+    assert client.exists(f"job:chest_xray:{job['job_id']}")
+    redis_mgr.clear_cache_by_pattern('chest_xray:*')
+    assert client.exists(f"job:chest_xray:{job['job_id']}")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+进程内一级缓存测试
+LRU按条目数和字节数淘汰、按键的墓碑防止回填旧值、回填存活时间不超过Redis剩余TTL
+"""
+
+import time
+
+import pytest
+
+from utils.local_cache import LocalCache
+from utils.redis_manager import RedisManager
+
+def test_evicts_least_recently_used_by_entries():
+    cache = LocalCache(max_entries=2, max_bytes=1024)
+    cache.set('a', b'1')
+    cache.set('b', b'2')
+    assert cache.get('a') == b'1'  # a变为最近使用
+    cache.set('c', b'3')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1'
+    assert cache.get('c') == b'3'
+    assert cache.get_stats()['evicted'] == 1
+
+def test_evicts_by_total_bytes():
+    cache = LocalCache(max_entries=10, max_bytes=10)
+    cache.set('a', b'x' * 4)
+    cache.set('b', b'x' * 4)
+    cache.set('c', b'x' * 4)
+
+    assert cache.get('a') is None
+    assert cache.get_stats()['bytes'] == 8
+    # 超过总大小上限的值不写入
+    assert cache.set('big', b'x' * 11) is False
+    assert cache.get('b') == b'x' * 4
+
+def test_entries_expire():
+    cache = LocalCache(default_ttl=0.05)
+    cache.set('a', b'1')
+    time.sleep(0.1)
+    assert cache.get('a') is None
+    assert cache.get_stats()['expired'] == 1
+
+def test_backfill_skipped_after_concurrent_write_or_invalidation():
+    cache = LocalCache()
+    generation = cache.generation
+    cache.set('a', b'new')
+    assert cache.set('a', b'old', generation=generation) is False
+    assert cache.get('a') == b'new'
+
+    generation = cache.generation
+    cache.delete('b')
+    assert cache.set('b', b'old', generation=generation) is False
+    assert cache.get('b') is None
+
+    generation = cache.generation
+    assert cache.set('b', b'fresh', generation=generation) is True
+    assert cache.get('b') == b'fresh'
+
+def test_writes_to_other_keys_do_not_block_backfill():
+    cache = LocalCache()
+    generation = cache.generation
+    cache.set('other', b'1')
+    cache.delete('another')
+
+    assert cache.set('a', b'fresh', generation=generation) is True
+    assert cache.get('a') == b'fresh'
+
+def test_pattern_invalidation_and_clear_block_matching_backfill():
+    cache = LocalCache()
+    generation = cache.generation
+    cache.delete_pattern('chest_xray:*')
+    assert cache.set('chest_xray:1', b'old', generation=generation) is False
+    assert cache.set('medical_qa:1', b'fresh', generation=generation) is True
+
+    generation = cache.generation
+    cache.clear()
+    assert cache.set('medical_qa:2', b'old', generation=generation) is False
+
+def test_dropped_tombstones_reject_older_backfills():
+    cache = LocalCache(max_entries=1)
+    generation = cache.generation
+    # 墓碑数量超过上限后无法确认该键是否被更新，按已失效处理
+    for i in range(cache._max_tombstones + 1):
+        cache.delete(f'k{i}')
+    assert cache.set('a', b'old', generation=generation) is False
+    assert cache.set('a', b'fresh', generation=cache.generation) is True
+
+@pytest.fixture
+def manager(monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(RedisManager, '_connect', lambda self: setattr(self, 'redis_client', client))
+    manager = RedisManager(local_cache_size=16, local_cache_ttl=30)
+    yield manager
+    manager.close()
+
+def _local_ttl(manager, key):
+    expires_at, _ = manager.local_cache._entries[key]
+    return expires_at - time.monotonic()
+
+def test_backfill_ttl_capped_by_redis_ttl(manager):
+    data = manager._serialize_data('answer')
+    manager.redis_client.set('short', data, px=2000)
+    manager.redis_client.set('long', data, ex=3600)
+
+    assert manager.get_cache('short') == 'answer'
+    assert manager.get_cache('long') == 'answer'
+    assert 0 < _local_ttl(manager, 'short') <= 2
+    assert 2 < _local_ttl(manager, 'long') <= 30
+
+def test_keys_without_ttl_are_not_backfilled(manager):
+    manager.redis_client.set('persistent', manager._serialize_data('value'))
+
+    assert manager.get_cache('persistent') == 'value'
+    assert manager.local_cache.get('persistent') is None
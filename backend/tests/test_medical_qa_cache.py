@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+医疗问答跨用户缓存测试
+一字之差的医疗问题不能命中彼此的缓存答案
+"""
+
+import pytest
+
+from config import MODEL_CONFIGS
+
+# (已回答的问题, 一字之差但含义不同的问题)
+NEAR_MISS_PAIRS = [
+    ("高血压是什么", "低血压是什么"),
+    ("高血糖有哪些症状", "低血糖有哪些症状"),
+    ("甲亢怎么治疗", "甲减怎么治疗"),
+    ("阿司匹林的副作用", "对乙酰氨基酚的副作用"),
+    ("儿童发烧38度怎么办", "儿童发烧39度怎么办"),
+    ("布洛芬一次吃1.5克可以吗", "布洛芬一次吃15克可以吗"),
+    ("血压140/90算高吗", "血压14090算高吗"),
+    ("体温38.5度需要吃退烧药吗", "体温385度需要吃退烧药吗"),
+    ("糖化血红蛋白6.5%正常吗", "糖化血红蛋白65正常吗"),
+    ("血钾3-5是什么意思", "血钾35是什么意思"),
+]
+
+@pytest.fixture
+def qa_service_options():
+    """开启跨用户缓存（默认配置：无句向量模型、无校准阈值）"""
+    return {'semantic_cache': {'enabled': True, 'embedding_model': '', 'similarity_threshold': None}}
+
+def test_semantic_cache_disabled_by_default():
+    assert MODEL_CONFIGS['medical_qa']['semantic_cache']['enabled'] is False
+
+def test_vector_matching_requires_embedding_model_and_threshold(qa_service):
+    assert qa_service.shared_cache_enabled
+    assert qa_service.semantic_cache is None
+    assert qa_service._lookup_semantic_cache("低血压是什么", "user-2") == (None, None)
+
+@pytest.mark.parametrize("answered, near_miss", NEAR_MISS_PAIRS)
+def test_near_miss_questions_do_not_hit(qa_service, answered, near_miss):
+    qa_service._cache_answer(answered, f"关于{answered}的回答", "user-1")
+
+    assert qa_service._get_cached_result(near_miss, "user-2") is None
+    assert qa_service._lookup_semantic_cache(near_miss, "user-2") == (None, None)
+
+def test_normalized_exact_match_is_shared(qa_service):
+    qa_service._cache_answer("高血压是什么", "高血压的回答", "user-1")
+
+    result = qa_service._get_cached_result(" 高血压是什么？", "user-2")
+    assert result is not None
+    assert result['cache_type'] == 'shared'
+    assert result['answer'] == "高血压的回答"
+
+@pytest.mark.parametrize("question, normalized", [
+    ("什么是高血压？", "什么是高血压"),
+    ("  什么是  高血压?? ", "什么是 高血压"),
+    ("ＨｂＡ１ｃ　６．５％正常吗？", "hba1c 6.5%正常吗"),
+    ("血压140/90算高吗", "血压140/90算高吗"),
+])
+def test_normalize_question_only_folds_form(question, normalized):
+    from utils.semantic_cache import normalize_question
+
+    assert normalize_question(question) == normalized
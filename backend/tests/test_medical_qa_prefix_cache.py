@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+医疗问答提示词前缀KV缓存测试
+复用前缀缓存时贪心解码的输出与完整预填充一致
+"""
+
+import pytest
+import torch
+
+QUESTIONS = ['什么是高血压？', '糖尿病的早期症状有哪些？', 'What is hypertension?']
+
+@pytest.fixture
+def qa_service_options():
+    return {'model': True}
+
+def _greedy(service, questions):
+    inputs = service._build_generation_inputs(questions)
+    with torch.no_grad():
+        outputs = service.model.generate(**inputs, max_new_tokens=16, do_sample=False,
+                                         pad_token_id=service.tokenizer.eos_token_id)
+    return outputs[:, inputs['input_ids'].shape[1]:].tolist()
+
+def test_prefix_boundary_is_verified(qa_service):
+    from services.medical_qa_service import PREFIX_PROBE_QUESTIONS
+
+    qa_service._build_prefix_cache()
+    prefix = qa_service._prefix_ids[0].tolist()
+    for question in PREFIX_PROBE_QUESTIONS + tuple(QUESTIONS):
+        assert qa_service._prompt_ids(question)[:len(prefix)] == prefix
+
+@pytest.mark.parametrize('questions', [QUESTIONS[:1], QUESTIONS])
+def test_greedy_output_matches_full_prefill(qa_service, questions):
+    expected = _greedy(qa_service, questions)
+
+    qa_service._build_prefix_cache()
+    assert qa_service._prefix_kv is not None
+    assert 'past_key_values' in qa_service._build_generation_inputs(questions)
+    assert _greedy(qa_service, questions) == expected
+    # 前缀KV在生成后保持不变，可被后续请求继续复用
+    assert _greedy(qa_service, questions) == expected
+
+def test_falls_back_to_full_prefill_when_boundary_differs(qa_service, monkeypatch):
+    qa_service._build_prefix_cache()
+    prefix_length = qa_service._prefix_ids.shape[1]
+    prompt_ids = qa_service._prompt_ids
+
+    # 模拟问题首字与前缀末尾被BPE合并，完整提示词不再以前缀token开头
+    def merged_prompt_ids(question):
+        ids = prompt_ids(question)
+        return ids[:prefix_length - 1] + [ids[prefix_length - 1] + 1] + ids[prefix_length:]
+
+    monkeypatch.setattr(qa_service, '_prompt_ids', merged_prompt_ids)
+    inputs = qa_service._build_generation_inputs(QUESTIONS)
+    assert 'past_key_values' not in inputs
+    assert inputs['input_ids'].shape[0] == len(QUESTIONS)
+
+def test_prefix_reuse_disabled_when_no_boundary_verifies(qa_service, monkeypatch):
+    monkeypatch.setattr(qa_service, '_verified_prefix_ids', lambda: None)
+    qa_service._build_prefix_cache()
+    assert qa_service._prefix_kv is None
+    assert 'past_key_values' not in qa_service._build_generation_inputs(QUESTIONS)
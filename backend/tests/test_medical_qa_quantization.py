@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+医疗问答int8量化产物测试
+产物只保存state_dict并以weights_only读取，指纹一致时不加载源权重，源权重变化后重新生成
+"""
+
+import os
+import shutil
+
+import pytest
+import torch
+
+@pytest.fixture
+def model_dir(tiny_qwen_dir, tmp_path):
+    path = tmp_path / "Qwen-tiny"
+    shutil.copytree(tiny_qwen_dir, path)
+    return path
+
+def _artifact(model_dir):
+    return model_dir.parent / f"{model_dir.name}_int8.pt"
+
+def test_artifact_contains_only_state_dict_and_fingerprint(qa_service, model_dir):
+    qa_service._load_quantized_model(str(model_dir), {'save_artifact': True})
+
+    artifact = torch.load(_artifact(model_dir), map_location='cpu', weights_only=True)
+    assert set(artifact) == {'fingerprint', 'state_dict'}
+    assert artifact['fingerprint'] == qa_service._source_fingerprint(str(model_dir))
+
+def test_artifact_is_reused_without_loading_source_weights(qa_service, model_dir, monkeypatch):
+    from services import medical_qa_service
+
+    first = qa_service._load_quantized_model(str(model_dir), {'save_artifact': True})
+    mtime = os.stat(_artifact(model_dir)).st_mtime_ns
+
+    # 指纹一致时只按配置构建骨架并载入产物，不再读取float32源权重
+    def fail_from_pretrained(*args, **kwargs):
+        raise AssertionError('源权重不应被加载')
+
+    monkeypatch.setattr(medical_qa_service.AutoModelForCausalLM, 'from_pretrained', fail_from_pretrained)
+    second = qa_service._load_quantized_model(str(model_dir), {'save_artifact': True})
+    assert os.stat(_artifact(model_dir)).st_mtime_ns == mtime
+    assert not any(tensor.is_meta for tensor in list(second.parameters()) + list(second.buffers()))
+
+    input_ids = torch.tensor([[1, 2, 3, 4]])
+    with torch.no_grad():
+        assert torch.equal(first(input_ids).logits, second(input_ids).logits)
+
+def test_artifact_is_rebuilt_when_source_weights_change(qa_service, model_dir):
+    from transformers import AutoModelForCausalLM
+
+    qa_service._load_quantized_model(str(model_dir), {'save_artifact': True})
+    old_fingerprint = torch.load(_artifact(model_dir), weights_only=True)['fingerprint']
+
+    # 替换源权重
+    model = AutoModelForCausalLM.from_pretrained(model_dir)
+    with torch.no_grad():
+        model.lm_head.weight.mul_(2)
+    model.save_pretrained(model_dir)
+
+    reloaded = qa_service._load_quantized_model(str(model_dir), {'save_artifact': True})
+    new_fingerprint = torch.load(_artifact(model_dir), weights_only=True)['fingerprint']
+    assert new_fingerprint != old_fingerprint
+
+    expected = torch.ao.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+    input_ids = torch.tensor([[1, 2, 3, 4]])
+    with torch.no_grad():
+        assert torch.equal(reloaded(input_ids).logits, expected(input_ids).logits)
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+医疗问答流式生成测试
+客户端断开（生成器被关闭）后后台生成线程及时结束
+"""
+
+import pytest
+
+@pytest.fixture
+def qa_service_options():
+    return {'model': True}
+
+@pytest.fixture
+def qa_service(qa_service):
+    # 屏蔽结束符，保证不被打断时会生成满 max_new_tokens
+    qa_service.model.generation_config.eos_token_id = None
+    return qa_service
+
+def test_generation_stops_when_stream_closed(qa_service):
+    generation_config = dict(qa_service.generation_config, max_new_tokens=400, do_sample=False)
+    events = qa_service.stream_predict('什么是高血压？', 'u1', generation_config)
+
+    first = next(events)
+    assert first['event'] == 'token'
+    events.close()
+
+    # 关闭时已等待后台线程结束：生成统计已写入，且远未达到 max_new_tokens
+    assert 0 < qa_service.model_stats['generated_tokens'] < 400
+
+def test_stream_completes_normally(qa_service):
+    generation_config = dict(qa_service.generation_config, max_new_tokens=20, do_sample=False)
+    events = list(qa_service.stream_predict('什么是高血压？', 'u1', generation_config))
+
+    assert events[-1]['event'] == 'done'
+    assert qa_service.model_stats['generated_tokens'] == 20
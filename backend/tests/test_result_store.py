@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+结果文件存储测试
+按总容量以LRU淘汰、按存活时间淘汰、不处理非托管文件和临时文件
+"""
+
+import os
+import time
+
+from utils.result_store import ResultStore
+
+def _write(store, name, size, age=0):
+    path = store.save(name, lambda target: open(target, 'wb').write(b'x' * size))
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+def test_artifact_name_depends_on_every_component():
+    base = ResultStore.artifact_name('heatmap', 'abc', 'gradcam', 1, 'v1+opencv')
+    assert base.startswith('heatmap_gradcam_') and base.endswith('.png')
+    assert base == ResultStore.artifact_name('heatmap', 'abc', 'gradcam', 1, 'v1+opencv')
+    assert base != ResultStore.artifact_name('heatmap', 'abc', 'gradcam', 2, 'v1+opencv')
+    assert base != ResultStore.artifact_name('heatmap', 'abc', 'gradcam', 1, 'v1+torchvision')
+
+def test_evicts_least_recently_accessed_over_capacity(tmp_path):
+    store = ResultStore(tmp_path, max_bytes=250, evict_interval=3600)
+    _write(store, 'heatmap_a.png', 100, age=30)
+    _write(store, 'heatmap_b.png', 100, age=20)
+    _write(store, 'heatmap_c.png', 100, age=10)
+    # 访问a后，b成为最久未访问的文件
+    assert store.exists('heatmap_a.png')
+
+    assert store.evict() == 1
+    assert sorted(os.listdir(tmp_path)) == ['heatmap_a.png', 'heatmap_c.png']
+    assert store.get_stats()['evicted'] == 1
+
+def test_evicts_files_past_max_age(tmp_path):
+    store = ResultStore(tmp_path, max_age=60, evict_interval=3600)
+    _write(store, 'superimposed_old.png', 10, age=120)
+    _write(store, 'superimposed_new.png', 10)
+
+    assert store.evict() == 1
+    assert os.listdir(tmp_path) == ['superimposed_new.png']
+
+def test_ignores_unmanaged_and_temporary_files(tmp_path):
+    store = ResultStore(tmp_path, max_bytes=0, max_age=0, evict_interval=3600)
+    for name in ('upload.png', 'heatmap_x.1234.tmp.png', 'heatmap_x.png'):
+        (tmp_path / name).write_bytes(b'x' * 10)
+
+    assert store.evict() == 1
+    assert sorted(os.listdir(tmp_path)) == ['heatmap_x.1234.tmp.png', 'upload.png']
+
+def test_save_triggers_eviction_at_most_once_per_interval(tmp_path):
+    store = ResultStore(tmp_path, max_bytes=150, evict_interval=3600)
+    _write(store, 'heatmap_a.png', 100, age=10)  # 首次写入触发扫描
+    _write(store, 'heatmap_b.png', 100)
+
+    # 间隔内的写入不扫描，超出容量的文件留到下次淘汰
+    assert len(os.listdir(tmp_path)) == 2
+    assert store.evict() == 1
+    assert os.listdir(tmp_path) == ['heatmap_b.png']
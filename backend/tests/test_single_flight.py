@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+请求合并测试
+相同键的并发请求只执行一次；执行方失败时等待方收到同一异常，之后的请求重新执行
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.single_flight import SingleFlight
+
+def _run_concurrently(single_flight, key, fn, followers=3):
+    """先让执行方进入fn，再提交等待方，返回 (执行方Future, 等待方Future列表)"""
+    executor = ThreadPoolExecutor(max_workers=followers + 1)
+    leader = executor.submit(single_flight.do, key, fn)
+    assert fn.started.wait(5)
+    waiters = [executor.submit(single_flight.do, key, fn) for _ in range(followers)]
+    # 等待方全部阻塞在执行方的Future上之后再放行执行方
+    inflight = single_flight._inflight[key]
+    deadline = time.monotonic() + 5
+    while len(inflight._condition._waiters) != followers:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    fn.release.set()
+    executor.shutdown(wait=True)
+    return leader, waiters
+
+class BlockingCall:
+    """第一次调用阻塞到放行，用于构造并发请求"""
+
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+def test_concurrent_requests_share_one_execution():
+    single_flight = SingleFlight()
+    fn = BlockingCall(result='answer')
+
+    leader, waiters = _run_concurrently(single_flight, 'q', fn)
+
+    assert leader.result() == ('answer', False)
+    assert [waiter.result() for waiter in waiters] == [('answer', True)] * 3
+    assert fn.calls == 1
+
+def test_leader_failure_propagates_to_waiters():
+    single_flight = SingleFlight()
+    error = RuntimeError('生成失败')
+    fn = BlockingCall(error=error)
+
+    leader, waiters = _run_concurrently(single_flight, 'q', fn)
+
+    for future in [leader] + waiters:
+        with pytest.raises(RuntimeError, match='生成失败'):
+            future.result()
+    assert fn.calls == 1
+
+    # 失败后不保留进行中的记录，后续请求重新执行
+    assert single_flight._inflight == {}
+    assert single_flight.do('q', lambda: 'retry') == ('retry', False)
+
+def test_waiting_worker_executes_itself_when_leader_fails(monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    from utils.redis_manager import RedisManager
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(RedisManager, '_connect',
+                        lambda self: setattr(self, 'redis_client', fakeredis.FakeRedis(server=server)))
+    managers = [RedisManager(local_cache_size=0) for _ in range(2)]
+    # 两个实例模拟两个工作进程
+    leader_flight, waiter_flight = (SingleFlight(manager, wait_timeout=5) for manager in managers)
+    fn = BlockingCall(error=RuntimeError('生成失败'))
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(leader_flight.do, 'q', fn)
+        assert fn.started.wait(5)
+        waiter = executor.submit(waiter_flight.do, 'q', lambda: 'fallback')
+        # 等待方取锁失败后订阅结果频道等待
+        time.sleep(0.2)
+        fn.release.set()
+        with pytest.raises(RuntimeError, match='生成失败'):
+            leader.result(timeout=5)
+        assert waiter.result(timeout=10) == ('fallback', False)
+
+# 只有数值不同的问题，合并键不能相同
+NUMERIC_QUESTION_PAIRS = [
+    ("布洛芬一次吃1.5克可以吗", "布洛芬一次吃15克可以吗"),
+    ("血压140/90算高吗", "血压14090算高吗"),
+]
+
+@pytest.mark.parametrize('qa_service', [{'single_flight': True}], indirect=True)
+@pytest.mark.parametrize('first, second', NUMERIC_QUESTION_PAIRS)
+def test_medical_qa_does_not_merge_different_numbers(qa_service, first, second):
+    # 两个问题必须同时进入生成才能通过屏障，被合并时屏障会超时
+    barrier = threading.Barrier(2, timeout=5)
+
+    def generate(question, generation_config):
+        barrier.wait()
+        return f"关于{question}的回答"
+
+    qa_service._generate_answer = generate
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(qa_service._generate_answer_once, question, qa_service.generation_config)
+                   for question in (first, second)]
+        results = [future.result(timeout=10) for future in futures]
+
+    assert results == [(f"关于{first}的回答", False), (f"关于{second}的回答", False)]
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+肿瘤分类批量预测测试
+批内动态填充（pack_padded_sequence）后的结果与逐条预测一致
+"""
+
+import pytest
+
+TEXTS = [
+    '肿瘤细胞核分裂象',
+    '',
+    '良性',
+    '肿瘤细胞核分裂象多见，交界性' * 6,
+    '   ',
+    '恶性肿瘤细胞',
+    '细胞核分裂象' * 3,
+]
+
+def test_batch_predict_matches_single_predict(tumor_service):
+    batch_results = tumor_service.batch_predict(TEXTS)
+    assert len(batch_results) == len(TEXTS)
+
+    for text, batch_result in zip(TEXTS, batch_results):
+        single_result = tumor_service.predict(text)
+        if 'error' in single_result:
+            # 空文本返回与逐条预测相同的错误结果
+            assert batch_result == single_result
+            continue
+        assert batch_result['class'] == single_result['class']
+        assert batch_result['confidence'] == pytest.approx(single_result['confidence'], abs=1e-5)
+        for name, probability in single_result['probabilities'].items():
+            assert batch_result['probabilities'][name] == pytest.approx(probability, abs=1e-5)
+
+def test_batches_mix_different_lengths(tumor_service, monkeypatch):
+    lengths = []
+    original_forward = tumor_service.model.forward
+
+    def recording_forward(input_ids, attention_mask):
+        lengths.append(attention_mask.sum(dim=1).tolist())
+        return original_forward(input_ids, attention_mask)
+
+    monkeypatch.setattr(tumor_service.model, 'forward', recording_forward)
+    tumor_service.batch_predict(TEXTS)
+
+    # 批内长度不同才会走填充路径
+    assert any(len(set(batch)) > 1 for batch in lengths)
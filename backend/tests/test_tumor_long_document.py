@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+肿瘤分类长文本模式测试
+使用临时构造的小型BERT，验证窗口上限和分批前向
+"""
+
+import pytest
+
+from services.tumor_service import DocumentTooLongError
+
+@pytest.fixture
+def service(tumor_service):
+    tumor_service.long_document_config = {'window_size': 16, 'overlap': 4, 'aggregation': 'max',
+                                          'max_chars': 200, 'max_windows': 8}
+    return tumor_service
+
+def test_windows_are_forwarded_in_inference_batches(service, monkeypatch):
+    batch_sizes = []
+    original_forward = service.model.forward
+
+    def counting_forward(input_ids, attention_mask):
+        batch_sizes.append(input_ids.size(0))
+        return original_forward(input_ids, attention_mask)
+
+    monkeypatch.setattr(service.model, 'forward', counting_forward)
+    text = '肿瘤细胞核分裂象' * 8  # 64个token，切分为6个窗口
+    result = service.predict(text, long_document=True)
+
+    assert 'error' not in result
+    assert len(service._window_spans(64)) == 6
+    assert sum(batch_sizes) == 6
+    assert max(batch_sizes) <= service.batch_size
+
+def test_too_many_windows_rejected(service):
+    text = '肿瘤细胞核分裂象' * 20  # 160个token，超过8个窗口
+    with pytest.raises(DocumentTooLongError):
+        service.predict(text, long_document=True)
+
+def test_too_many_chars_rejected(service):
+    with pytest.raises(DocumentTooLongError):
+        service.predict('肿' * 201, long_document=True)
+
+def test_short_mode_ignores_long_document_limits(service):
+    result = service.predict('肿瘤细胞核分裂象' * 20)
+    assert 'error' not in result
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+胸部X光预处理测试
+opencv后端与torchvision后端（PIL解码 + torchvision变换）的模型输入在容差内一致，
+解码结果（含16位PNG和EXIF方向）逐像素一致
+"""
+
+import io
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from services.chest_xray_service import ChestXrayService
+from utils.xray_preprocessing import XrayPreprocessor
+
+# 平滑图像上两种缩放方式的差异（归一化后的单位）
+MAX_ABS_TOLERANCE = 0.03
+MEAN_ABS_TOLERANCE = 0.002
+
+def _smooth_image(height=900, width=1100, channels=1):
+    """平滑的合成图像：线性渐变叠加高斯亮斑"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    image = 60 + 100 * x / width + 80 * np.exp(-((x - width * 0.4) ** 2 + (y - height * 0.6) ** 2) / (2 * 150.0 ** 2))
+    image = np.clip(image, 0, 255).astype(np.uint8)
+    if channels == 3:
+        image = np.stack([image, np.flipud(image), np.fliplr(image)], axis=2)
+    return image
+
+def _encode(image, ext='.png'):
+    ok, encoded = cv2.imencode(ext, image)
+    assert ok
+    return encoded.tobytes()
+
+def _service(backend, grayscale_decode=True):
+    service = ChestXrayService.__new__(ChestXrayService)
+    service.preprocess_backend = backend
+    service.grayscale_decode = grayscale_decode
+    service.preprocessor = XrayPreprocessor(input_size=(512, 512))
+    service.transform = service.get_transforms(is_training=False)
+    service.config = SimpleNamespace(DEVICE='cpu')
+    return service
+
+@pytest.mark.parametrize('channels', [1, 3])
+@pytest.mark.parametrize('grayscale_decode', [True, False])
+def test_opencv_backend_matches_torchvision_within_tolerance(channels, grayscale_decode):
+    image_bytes = _encode(_smooth_image(channels=channels))
+
+    opencv_bgr, opencv_tensor = _service('opencv', grayscale_decode).preprocess(image_bytes)
+    pil_bgr, pil_tensor = _service('torchvision').preprocess(image_bytes)
+
+    assert opencv_tensor.shape == pil_tensor.shape == (1, 3, 512, 512)
+    diff = (opencv_tensor - pil_tensor).abs()
+    assert diff.max().item() < MAX_ABS_TOLERANCE
+    assert diff.mean().item() < MEAN_ABS_TOLERANCE
+    # 用于热力图叠加的原图逐像素一致
+    if opencv_bgr.ndim == 2:
+        opencv_bgr = cv2.cvtColor(opencv_bgr, cv2.COLOR_GRAY2BGR)
+    assert np.array_equal(opencv_bgr, pil_bgr)
+
+def test_to_tensor_results_do_not_alias():
+    preprocessor = XrayPreprocessor(input_size=(64, 64))
+    first = preprocessor.to_tensor(np.full((100, 100), 10, dtype=np.uint8))
+    kept = first.clone()
+    second = preprocessor.to_tensor(np.full((100, 100), 200, dtype=np.uint8))
+
+    assert torch.equal(first, kept)
+    assert not torch.equal(first, second)
+
+def test_exif_orientation_is_ignored_like_pil():
+    image = _smooth_image(64, 96, channels=3)
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = 6  # 顺时针旋转90度
+    Image.fromarray(image[:, :, ::-1]).save(buffer, format='JPEG', quality=95, exif=exif)
+
+    for grayscale_decode in (True, False):
+        decoded = XrayPreprocessor().decode(buffer.getvalue(), grayscale=grayscale_decode)
+        assert decoded.shape[:2] == (64, 96)
+
+@pytest.mark.parametrize('channels', [1, 3])
+@pytest.mark.parametrize('grayscale_decode', [True, False])
+def test_16bit_png_decodes_like_pil(channels, grayscale_decode):
+    rng = np.random.RandomState(0)
+    image = rng.randint(0, 1024, size=(64, 80) + ((3,) if channels == 3 else ())).astype(np.uint16)
+    image[:8] = rng.randint(0, 65536, size=image[:8].shape)
+    image_bytes = _encode(image)
+
+    opencv_bgr, opencv_tensor = _service('opencv', grayscale_decode).preprocess(image_bytes)
+    pil_bgr, _ = _service('torchvision').preprocess(image_bytes)
+
+    if opencv_bgr.ndim == 2:
+        opencv_bgr = cv2.cvtColor(opencv_bgr, cv2.COLOR_GRAY2BGR)
+    assert np.array_equal(opencv_bgr, pil_bgr)
+    # 灰度解码与BGR解码得到相同的模型输入
+    assert torch.equal(_service('opencv', not grayscale_decode).preprocess(image_bytes)[1], opencv_tensor)
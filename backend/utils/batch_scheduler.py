@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+微批调度器
+从队列中收集并发请求，合并为一个批次调用处理函数，并通过Future将结果分发给各调用方
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class BatchScheduler:
+    """微批调度器"""
+
+    def __init__(self,
+                 process_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 8,
+                 max_wait_ms: float = 20,
+                 max_queue_size: int = 0,
+                 name: str = "batch-scheduler"):
+        """
+        初始化调度器
+
+        Args:
+            process_batch: 批处理函数，接收请求列表，返回等长的结果列表
+            max_batch_size: 单批最大请求数
+            max_wait_ms: 收到首个请求后等待凑批的最长时间（毫秒）
+            max_queue_size: 队列最大长度，0表示不限制
+            name: 调度线程名称
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        # 与当前批次分组不同、暂缓处理的请求
+        self._pending = deque()
+        self._stats = {
+            "batches": 0,
+            "items": 0,
+            "max_batch_size_seen": 0,
+        }
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any, group_key: Optional[Hashable] = None) -> Future:
+        """
+        提交请求
+
+        Args:
+            item: 请求数据
+            group_key: 分组键，只有分组键相同的请求才会合并到同一批次
+
+        Returns:
+            请求结果的Future
+        """
+        future = Future()
+        try:
+            self._queue.put_nowait((group_key, item, future))
+        except queue.Full:
+            raise RuntimeError(f"{self.name} 队列已满，请稍后重试")
+        return future
+
+    def shutdown(self):
+        """停止调度线程"""
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度统计信息"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["avg_batch_size"] = stats["items"] / stats["batches"] if stats["batches"] else 0.0
+        stats["queue_size"] = self._queue.qsize() + len(self._pending)
+        return stats
+
+    def _run(self):
+        """调度主循环"""
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                break
+            self._process(batch)
+
+    def _collect_batch(self) -> Optional[list]:
+        """收集一个批次的请求"""
+        first = self._pending.popleft() if self._pending else self._queue.get()
+        if first is None:
+            return None
+        group_key = first[0]
+        batch = [first]
+
+        # 优先取积压中同组的请求
+        others = deque()
+        while self._pending:
+            entry = self._pending.popleft()
+            if entry[0] == group_key and len(batch) < self.max_batch_size:
+                batch.append(entry)
+            else:
+                others.append(entry)
+        self._pending = others
+
+        # 在等待窗口内继续从队列凑批
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                # 处理完当前批次后再退出
+                self._queue.put(None)
+                break
+            if entry[0] == group_key:
+                batch.append(entry)
+            else:
+                self._pending.append(entry)
+        return batch
+
+    def _process(self, batch: list):
+        """执行一个批次并分发结果"""
+        # 跳过已被调用方取消的请求
+        batch = [entry for entry in batch if entry[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        items = [item for _, item, _ in batch]
+        try:
+            results = self.process_batch(items)
+            if len(results) != len(items):
+                raise RuntimeError(f"批处理结果数量不匹配: {len(results)} != {len(items)}")
+        except Exception as e:
+            logger.error(f"{self.name} 批处理失败: {e}")
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["items"] += len(items)
+            self._stats["max_batch_size_seen"] = max(self._stats["max_batch_size_seen"], len(items))
+        logger.debug(f"{self.name} 完成批次: {len(items)} 个请求")
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+异步任务管理器
+耗时任务提交到有界线程池后台执行，立即返回任务ID；
+任务状态保存在进程内并同步到Redis，供其他工作进程查询
+"""
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED)
+
+class JobManager:
+    """异步任务管理器"""
+
+    def __init__(self, name: str = "jobs", max_workers: int = 2, max_pending: int = 32,
+                 redis_manager=None, result_ttl: int = 3600):
+        """
+        初始化任务管理器
+
+        Args:
+            name: 任务类型名称，用作线程名和Redis键 job:<name>:<job_id> 的一部分
+            max_workers: 工作线程数
+            max_pending: 排队和执行中的最大任务数，超出时拒绝提交
+            redis_manager: Redis管理器，为None或未连接时状态只保存在进程内
+            result_ttl: 任务结束后状态的保留时间（秒）
+        """
+        self.name = name
+        self.max_pending = max_pending
+        self.redis_manager = redis_manager
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._active = 0
+        self._stats = {"submitted": 0, "succeeded": 0, "failed": 0, "rejected": 0}
+
+    def submit(self, fn: Callable[[], Any], owner: Optional[str] = None,
+               on_complete: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        提交任务
+
+        Args:
+            fn: 任务函数，返回值作为任务结果
+            owner: 任务所属用户，查询时用于权限校验
+            on_complete: 任务结束后在工作线程中调用，参数为任务状态
+
+        Returns:
+            任务状态
+        """
+        with self._lock:
+            self._prune()
+            if self._active >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise RuntimeError(f"{self.name} 任务队列已满，请稍后重试")
+            self._active += 1
+            self._stats["submitted"] += 1
+            job = {
+                'job_id': uuid.uuid4().hex,
+                'owner': owner,
+                'status': JOB_QUEUED,
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None
+            }
+            self._jobs[job['job_id']] = job
+        self._publish(job)
+
+        try:
+            self._executor.submit(self._run, job['job_id'], fn, on_complete)
+        except RuntimeError:
+            with self._lock:
+                self._active -= 1
+                self._jobs.pop(job['job_id'], None)
+            raise
+        return dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """查询任务状态，本进程没有时从Redis读取"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        redis_mgr = self.redis_manager
+        if redis_mgr is not None and redis_mgr.redis_client:
+            return redis_mgr.get_cache(self._key(job_id))
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取任务统计信息"""
+        with self._lock:
+            return {
+                "active": self._active,
+                "max_pending": self.max_pending,
+                **self._stats
+            }
+
+    def shutdown(self, wait: bool = True):
+        """停止工作线程"""
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job_id: str, fn: Callable[[], Any], on_complete):
+        """在工作线程中执行任务"""
+        self._update(job_id, status=JOB_RUNNING, started_at=time.time())
+        try:
+            result = fn()
+            job = self._update(job_id, status=JOB_SUCCEEDED, result=result, finished_at=time.time())
+        except Exception as e:
+            logger.error(f"{self.name} 任务 {job_id} 失败: {e}")
+            job = self._update(job_id, status=JOB_FAILED, error=str(e), finished_at=time.time())
+        finally:
+            with self._lock:
+                self._active -= 1
+
+        with self._lock:
+            self._stats[job['status']] += 1
+        if on_complete is not None:
+            try:
+                on_complete(job)
+            except Exception as e:
+                logger.error(f"{self.name} 任务 {job_id} 完成回调失败: {e}")
+
+    def _update(self, job_id: str, **fields) -> Dict[str, Any]:
+        """更新任务状态并同步到Redis"""
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            job = dict(job)
+        self._publish(job)
+        return job
+
+    def _publish(self, job: Dict[str, Any]):
+        """将任务状态写入Redis"""
+        redis_mgr = self.redis_manager
+        if redis_mgr is None or not redis_mgr.redis_client:
+            return
+        try:
+            redis_mgr.set_cache(self._key(job['job_id']), job, timeout=self.result_ttl)
+        except Exception as e:
+            logger.warning(f"同步任务状态到Redis失败: {e}")
+
+    def _prune(self):
+        """清理已超过保留时间的结束任务（调用方需持有锁）"""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job['status'] in FINISHED_STATES and now - job['finished_at'] > self.result_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _key(self, job_id: str) -> str:
+        # 使用独立的 job: 前缀，按模型类型清理预测缓存（<name>:*）时不会删除任务状态
+        return f"job:{self.name}:{job_id}"
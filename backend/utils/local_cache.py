@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+进程内LRU缓存
+作为Redis前面的一级缓存，按条目数和总字节数限制大小，条目按TTL过期；
+保存序列化后的字节，调用方拿到的是独立的副本，修改结果不会影响缓存；
+写入和失效按键记录序号（墓碑），回填只在读取期间同一个键没有被写入或失效时生效
+"""
+
+import fnmatch
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional
+
+class LocalCache:
+    """进程内LRU缓存"""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, default_ttl: float = 30):
+        """
+        初始化缓存
+
+        Args:
+            max_entries: 最大条目数
+            max_bytes: 缓存值总大小上限（字节）
+            default_ttl: 未指定时的条目存活时间（秒）
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (过期时间, 值)
+        self._bytes = 0
+        # 每次写入或失效时递增的序号，回填前读取，用于判断读取期间对应的键是否有更新
+        self._seq = 0
+        # key -> 最近一次写入或失效的序号，数量有上限，丢弃最旧的墓碑时记录其序号
+        self._tombstones = OrderedDict()
+        self._max_tombstones = max(1024, max_entries * 4)
+        self._tombstone_floor = 0
+        # 按模式失效的记录 (序号, 模式)
+        self._pattern_tombstones = deque()
+        self._max_pattern_tombstones = 256
+        self._pattern_floor = 0
+        self._cleared_at = 0
+        self._stats = {"hits": 0, "misses": 0, "evicted": 0, "expired": 0, "invalidated": 0, "stale_fills": 0}
+
+    @property
+    def generation(self) -> int:
+        """当前序号，回填前读取后传给 set(generation=...)"""
+        return self._seq
+
+    def get(self, key: str) -> Optional[bytes]:
+        """获取缓存值，不存在或已过期返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float = None, generation: int = None) -> bool:
+        """
+        写入缓存值
+
+        Args:
+            key: 缓存键
+            value: 序列化后的值
+            ttl: 存活时间（秒），None使用默认值
+            generation: 回填时传入读取前的generation，期间该键被写入或失效则放弃回填
+
+        Returns:
+            是否写入
+        """
+        size = len(value)
+        if size > self.max_bytes:
+            return False
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            if generation is not None and self._is_stale(key, generation):
+                self._stats["stale_fills"] += 1
+                return False
+            if generation is None:
+                self._mark(key)
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evicted"] += 1
+            return True
+
+    def delete(self, key: str) -> bool:
+        """删除缓存值"""
+        with self._lock:
+            self._mark(key)
+            removed = self._remove(key)
+            if removed:
+                self._stats["invalidated"] += 1
+            return removed
+
+    def delete_pattern(self, pattern: str) -> int:
+        """按通配符模式删除，返回删除的条目数"""
+        with self._lock:
+            self._seq += 1
+            self._pattern_tombstones.append((self._seq, pattern))
+            if len(self._pattern_tombstones) > self._max_pattern_tombstones:
+                self._pattern_floor = self._pattern_tombstones.popleft()[0]
+            keys = [key for key in self._entries if fnmatch.fnmatchcase(key, pattern)]
+            for key in keys:
+                self._remove(key)
+            self._stats["invalidated"] += len(keys)
+            return len(keys)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._seq += 1
+            self._cleared_at = self._seq
+            # 清空之前的墓碑都已被 _cleared_at 覆盖
+            self._tombstones.clear()
+            self._pattern_tombstones.clear()
+            self._tombstone_floor = self._pattern_floor = 0
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "default_ttl": self.default_ttl,
+                "tombstones": len(self._tombstones),
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                **self._stats
+            }
+
+    def _mark(self, key: str):
+        """记录键的写入或失效（调用方需持有锁）"""
+        self._seq += 1
+        self._tombstones[key] = self._seq
+        self._tombstones.move_to_end(key)
+        if len(self._tombstones) > self._max_tombstones:
+            _, self._tombstone_floor = self._tombstones.popitem(last=False)
+
+    def _is_stale(self, key: str, generation: int) -> bool:
+        """序号generation之后该键是否被写入或失效；相关墓碑已被丢弃时按已失效处理（调用方需持有锁）"""
+        if generation < self._cleared_at:
+            return True
+        seq = self._tombstones.get(key)
+        if seq is not None:
+            if seq > generation:
+                return True
+        elif self._tombstone_floor > generation:
+            return True
+        if self._pattern_floor > generation:
+            return True
+        for seq, pattern in reversed(self._pattern_tombstones):
+            if seq <= generation:
+                break
+            if fnmatch.fnmatchcase(key, pattern):
+                return True
+        return False
+
+    def _remove(self, key: str) -> bool:
+        """删除条目（调用方需持有锁）"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= len(entry[1])
+        return True
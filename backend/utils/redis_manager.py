@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 Redis缓存管理器
-提供统一的缓存操作接口，支持医疗AI平台的缓存需求
+提供统一的缓存操作接口，支持医疗AI平台的缓存需求；
+可选的进程内一级缓存位于Redis之前，各进程通过Redis发布订阅同步失效
 """
 
 import redis
@@ -9,28 +10,76 @@ import json
 import logging
 import pickle
 import hashlib
+import threading
+import uuid
 from typing import Any, Optional, Dict, Union
 from datetime import timedelta
 import os
 
+from .local_cache import LocalCache
+
 logger = logging.getLogger(__name__)
 
+# 一级缓存失效消息频道
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+# SCAN每次遍历的键数提示，以及批量删除的键数
+SCAN_COUNT = 1000
+DELETE_BATCH_SIZE = 500
+# 分页列出键时单页最多执行的SCAN次数
+MAX_SCAN_CALLS_PER_PAGE = 20
+
+# 校验持有者后删除锁，避免误删其他进程重新获取的锁
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
 class RedisManager:
     """Redis缓存管理器"""
     
-    def __init__(self, redis_url: str = None, max_connections: int = 50):
+    def __init__(self, redis_url: str = None, max_connections: int = 50,
+                 local_cache_size: int = None, local_cache_ttl: float = None, local_cache_max_mb: int = None):
         """
         初始化Redis管理器
         
         Args:
             redis_url: Redis连接URL，默认为环境变量或本地连接b
             max_connections: 最大连接数
+            local_cache_size: 进程内一级缓存的最大条目数，0表示不启用，默认读取环境变量
+            local_cache_ttl: 一级缓存条目的最长存活时间（秒）
+            local_cache_max_mb: 一级缓存总大小上限（MB）
         """
         self.redis_url = redis_url or os.environ.get('REDIS_URL', 'redis://localhost:6379')
         self.max_connections = max_connections
         self.redis_client = None
         self._connect()
         
+        # 进程内一级缓存
+        if local_cache_size is None:
+            local_cache_size = int(os.environ.get('REDIS_LOCAL_CACHE_SIZE', 1024))
+        if local_cache_ttl is None:
+            local_cache_ttl = float(os.environ.get('REDIS_LOCAL_CACHE_TTL', 30))
+        if local_cache_max_mb is None:
+            local_cache_max_mb = int(os.environ.get('REDIS_LOCAL_CACHE_MAX_MB', 64))
+        self.local_cache = None
+        if local_cache_size > 0:
+            self.local_cache = LocalCache(
+                max_entries=local_cache_size,
+                max_bytes=local_cache_max_mb * 1024 * 1024,
+                default_ttl=local_cache_ttl
+            )
+        self._instance_id = uuid.uuid4().hex
+        self._closed = threading.Event()
+        self._invalidation_thread = None
+        if self.local_cache is not None and self.redis_client:
+            self._invalidation_thread = threading.Thread(
+                target=self._listen_invalidations, name="cache-invalidation", daemon=True
+            )
+            self._invalidation_thread.start()
+        
         # 缓存配置
         self.cache_config = {
             "default_timeout": 300,  # 5分钟
@@ -143,11 +192,30 @@ class RedisManager:
         Returns:
             缓存的数据，如果不存在返回None
         """
+        local = self.local_cache
+        if local is not None:
+            cached_data = local.get(key)
+            if cached_data is not None:
+                logger.debug(f"一级缓存命中: {key}")
+                return self._deserialize_data(cached_data)
+        
         if not self.redis_client:
             return None
             
         try:
-            cached_data = self.redis_client.get(key)
+            if local is None:
+                cached_data = self.redis_client.get(key)
+            else:
+                generation = local.generation
+                # 同时读取剩余存活时间，回填的条目不会比Redis中的键活得更久
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.get(key)
+                pipe.pttl(key)
+                cached_data, pttl = pipe.execute()
+                # 没有过期时间（-1）或已过期（<=0）的键不回填
+                if cached_data and pttl is not None and pttl > 0:
+                    # 读取期间该键被写入或失效时放弃回填，避免写入旧值
+                    local.set(key, cached_data, ttl=min(pttl / 1000, local.default_ttl), generation=generation)
             if cached_data:
                 logger.debug(f"缓存命中: {key}")
                 return self._deserialize_data(cached_data)
@@ -171,19 +239,29 @@ class RedisManager:
         Returns:
             是否设置成功
         """
+        # 确定过期时间
+        if timeout is None:
+            timeout = self.cache_config.get(f"{cache_type}_timeout", self.cache_config["default_timeout"])
+        
         if not self.redis_client:
-            return False
+            # Redis不可用时只写入一级缓存
+            if self.local_cache is None:
+                return False
+            return self.local_cache.set(key, self._serialize_data(data), ttl=timeout)
             
         try:
-            # 确定过期时间
-            if timeout is None:
-                timeout = self.cache_config.get(f"{cache_type}_timeout", self.cache_config["default_timeout"])
-            
             # 序列化数据
             serialized_data = self._serialize_data(data)
             
-            # 设置缓存
-            result = self.redis_client.setex(key, timeout, serialized_data)
+            # 设置缓存，同时通知其他进程丢弃旧值
+            if self.local_cache is not None:
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.setex(key, timeout, serialized_data)
+                pipe.publish(INVALIDATION_CHANNEL, self._invalidation_message('key', key))
+                result = pipe.execute()[0]
+                self.local_cache.set(key, serialized_data, ttl=min(timeout, self.local_cache.default_ttl))
+            else:
+                result = self.redis_client.setex(key, timeout, serialized_data)
             
             if result:
                 logger.debug(f"缓存设置成功: {key}, 过期时间: {timeout}秒")
@@ -206,11 +284,13 @@ class RedisManager:
         Returns:
             是否删除成功
         """
+        local_removed = self.local_cache.delete(key) if self.local_cache is not None else False
         if not self.redis_client:
-            return False
+            return local_removed
             
         try:
             result = self.redis_client.delete(key)
+            self._publish_invalidation('key', key)
             if result:
                 logger.debug(f"缓存删除成功: {key}")
             return bool(result)
@@ -228,19 +308,230 @@ class RedisManager:
         Returns:
             删除的键数量
         """
+        local_removed = self.local_cache.delete_pattern(pattern) if self.local_cache is not None else 0
         if not self.redis_client:
-            return 0
+            return local_removed
             
+        deleted = 0
         try:
-            keys = self.redis_client.keys(pattern)
-            if keys:
-                deleted = self.redis_client.delete(*keys)
+            # SCAN增量遍历，每批用UNLINK在后台释放内存，避免KEYS和大批量DEL长时间阻塞Redis
+            batch = []
+            for key in self.redis_client.scan_iter(match=pattern, count=SCAN_COUNT):
+                batch.append(key)
+                if len(batch) >= DELETE_BATCH_SIZE:
+                    deleted += self._unlink(batch)
+                    batch = []
+            if batch:
+                deleted += self._unlink(batch)
+            if deleted:
                 logger.info(f"清除缓存模式 {pattern}: 删除 {deleted} 个键")
-                return deleted
-            return 0
+            return deleted
         except Exception as e:
             logger.error(f"清除缓存模式失败: {pattern}, 错误: {e}")
+            return deleted
+        finally:
+            # 先删除再通知，其他进程收到消息后不会再读到旧值
+            self._publish_invalidation('pattern', pattern)
+    
+    def _unlink(self, keys) -> int:
+        """批量删除键，Redis不支持UNLINK时退回DEL"""
+        try:
+            return self.redis_client.unlink(*keys)
+        except redis.ResponseError:
+            return self.redis_client.delete(*keys)
+    
+    def list_keys(self, pattern: str = "*", cursor: Union[int, str] = 0, count: int = 100) -> Dict[str, Any]:
+        """
+        按游标分页列出缓存键
+        
+        Args:
+            pattern: 键模式，支持通配符
+            cursor: 上一页返回的游标，0表示从头开始
+            count: 本页期望的键数，SCAN按批返回，实际数量可能略多；
+                匹配稀疏时本页可能少于count个甚至为空，但游标不为"0"时仍有后续页
+            
+        Returns:
+            {"keys": [{"key", "ttl", "type"}], "cursor": 下一页游标}，游标为"0"表示遍历结束
+        """
+        if not self.redis_client:
+            return {"keys": [], "cursor": "0"}
+        
+        cursor = int(cursor)
+        keys = []
+        # 匹配稀疏时单次SCAN可能返回空结果，继续遍历直到凑满一页、遍历结束或达到单页SCAN次数上限
+        for _ in range(MAX_SCAN_CALLS_PER_PAGE):
+            cursor, batch = self.redis_client.scan(cursor=cursor, match=pattern, count=count)
+            keys.extend(batch)
+            if cursor == 0 or len(keys) >= count:
+                break
+        
+        # 一次往返获取本页所有键的TTL和类型
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.ttl(key)
+            pipe.type(key)
+        values = pipe.execute(raise_on_error=False)
+        
+        key_info = []
+        for index, key in enumerate(keys):
+            ttl, key_type = values[2 * index], values[2 * index + 1]
+            if isinstance(ttl, Exception) or isinstance(key_type, Exception):
+                logger.warning(f"获取键信息失败: {key}")
+                continue
+            key_info.append({
+                'key': key.decode('utf-8') if isinstance(key, bytes) else key,
+                'ttl': ttl if ttl > 0 else -1,  # -1表示永不过期
+                'type': key_type.decode('utf-8') if isinstance(key_type, bytes) else key_type
+            })
+        # 游标可能超出JavaScript安全整数范围，以字符串返回
+        return {"keys": key_info, "cursor": str(cursor)}
+    
+    def _invalidation_message(self, kind: str, target: str) -> bytes:
+        """构造一级缓存失效消息"""
+        return self._serialize_data({"sender": self._instance_id, "kind": kind, "target": target})
+    
+    def _publish_invalidation(self, kind: str, target: str):
+        """通知其他进程的一级缓存失效"""
+        if self.local_cache is None or not self.redis_client:
+            return
+        try:
+            self.redis_client.publish(INVALIDATION_CHANNEL, self._invalidation_message(kind, target))
+        except Exception as e:
+            logger.warning(f"发布缓存失效消息失败: {target}, 错误: {e}")
+    
+    def _apply_invalidation(self, data: bytes):
+        """处理其他进程发布的失效消息"""
+        message = self._deserialize_data(data)
+        if not isinstance(message, dict) or message.get("sender") == self._instance_id:
+            return
+        if message.get("kind") == "pattern":
+            self.local_cache.delete_pattern(message.get("target", "*"))
+        else:
+            self.local_cache.delete(message.get("target", ""))
+    
+    def _listen_invalidations(self):
+        """后台线程：订阅失效频道，连接中断后重新订阅"""
+        while not self._closed.is_set():
+            pubsub = None
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                # 订阅建立之前的失效消息可能已经丢失，清空一级缓存
+                self.local_cache.clear()
+                while not self._closed.is_set():
+                    message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message and message.get('type') == 'message':
+                        self._apply_invalidation(message['data'])
+            except Exception as e:
+                if self._closed.is_set():
+                    break
+                logger.warning(f"缓存失效订阅中断，稍后重试: {e}")
+                self.local_cache.clear()
+                self._closed.wait(1.0)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+    
+    def acquire_lock(self, key: str, token: str, timeout: int) -> bool:
+        """
+        获取分布式锁
+        
+        Args:
+            key: 锁键
+            token: 持有者标识，释放时校验
+            timeout: 锁过期时间（秒）
+            
+        Returns:
+            是否获取成功
+        """
+        if not self.redis_client:
+            return False
+            
+        try:
+            return bool(self.redis_client.set(key, token, nx=True, ex=timeout))
+        except Exception as e:
+            logger.error(f"获取锁失败: {key}, 错误: {e}")
+            return False
+    
+    def release_lock(self, key: str, token: str) -> bool:
+        """
+        释放分布式锁（只释放自己持有的锁）
+        
+        Args:
+            key: 锁键
+            token: 持有者标识
+            
+        Returns:
+            是否释放成功
+        """
+        if not self.redis_client:
+            return False
+            
+        try:
+            return bool(self.redis_client.eval(RELEASE_LOCK_SCRIPT, 1, key, token))
+        except Exception as e:
+            logger.error(f"释放锁失败: {key}, 错误: {e}")
+            return False
+    
+    def publish(self, channel: str, data: Any) -> int:
+        """
+        发布消息
+        
+        Args:
+            channel: 频道
+            data: 消息数据
+            
+        Returns:
+            接收到消息的订阅者数量
+        """
+        if not self.redis_client:
             return 0
+            
+        try:
+            return self.redis_client.publish(channel, self._serialize_data(data))
+        except Exception as e:
+            logger.error(f"发布消息失败: {channel}, 错误: {e}")
+            return 0
+    
+    def subscribe(self, channel: str):
+        """
+        订阅频道
+        
+        Args:
+            channel: 频道
+            
+        Returns:
+            PubSub对象，使用完毕后需调用close()；Redis不可用时返回None
+        """
+        if not self.redis_client:
+            return None
+            
+        try:
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(channel)
+            return pubsub
+        except Exception as e:
+            logger.error(f"订阅频道失败: {channel}, 错误: {e}")
+            return None
+    
+    def get_message(self, pubsub, timeout: float = 1.0) -> Optional[Any]:
+        """
+        读取一条订阅消息
+        
+        Args:
+            pubsub: subscribe() 返回的PubSub对象
+            timeout: 等待时间（秒）
+            
+        Returns:
+            反序列化后的消息数据，超时返回None
+        """
+        message = pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        if message and message.get('type') == 'message':
+            return self._deserialize_data(message['data'])
+        return None
     
     def get_cache_info(self) -> Dict[str, Any]:
         """
@@ -249,8 +540,9 @@ class RedisManager:
         Returns:
             缓存统计信息
         """
+        local_stats = self.local_cache.get_stats() if self.local_cache is not None else None
         if not self.redis_client:
-            return {"error": "Redis未连接"}
+            return {"error": "Redis未连接", "local_cache": local_stats}
             
         try:
             info = self.redis_client.info()
@@ -261,11 +553,12 @@ class RedisManager:
                 "keyspace_hits": info.get("keyspace_hits", 0),
                 "keyspace_misses": info.get("keyspace_misses", 0),
                 "uptime_in_seconds": info.get("uptime_in_seconds", 0),
-                "db_size": self.redis_client.dbsize()
+                "db_size": self.redis_client.dbsize(),
+                "local_cache": local_stats
             }
         except Exception as e:
             logger.error(f"获取缓存信息失败: {e}")
-            return {"error": str(e)}
+            return {"error": str(e), "local_cache": local_stats}
     
     # 特定业务缓存方法
     
@@ -298,6 +591,33 @@ class RedisManager:
         key = self._generate_key("medical_qa", question, user_id or "anonymous")
         return self.get_cache(key)
     
+    def cache_shared_medical_qa(self, normalized_question: str, answer: str) -> bool:
+        """
+        缓存跨用户共享的医疗问答结果
+        
+        Args:
+            normalized_question: 规范化后的问题
+            answer: 答案
+            
+        Returns:
+            是否缓存成功
+        """
+        key = self._generate_key("medical_qa", "shared", normalized_question)
+        return self.set_cache(key, answer, cache_type="medical_qa")
+    
+    def get_shared_medical_qa_cache(self, normalized_question: str) -> Optional[str]:
+        """
+        获取跨用户共享的医疗问答缓存
+        
+        Args:
+            normalized_question: 规范化后的问题
+            
+        Returns:
+            缓存的答案
+        """
+        key = self._generate_key("medical_qa", "shared", normalized_question)
+        return self.get_cache(key)
+    
     def cache_prediction_result(self, model_type: str, input_data: str, result: Dict, user_id: str = None) -> bool:
         """
         缓存预测结果
@@ -388,6 +708,9 @@ class RedisManager:
     
     def close(self):
         """关闭Redis连接"""
+        self._closed.set()
+        if self._invalidation_thread is not None:
+            self._invalidation_thread.join(timeout=2)
         if self.redis_client:
             try:
                 self.redis_client.close()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+内容寻址的结果文件存储
+按(图片哈希, CAM方法, 类别, 模型版本)生成文件名，相同输入只渲染一次；
+文件修改时间记录最近访问时间，按存活时间和总容量以LRU策略淘汰
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# 受存储管理的文件前缀
+MANAGED_PREFIXES = ('heatmap_', 'superimposed_')
+
+class ResultStore:
+    """内容寻址的结果文件存储"""
+
+    def __init__(self, root_dir: str, max_bytes: int = 1024 * 1024 * 1024,
+                 max_age: float = 30 * 86400, evict_interval: float = 60):
+        """
+        初始化存储
+
+        Args:
+            root_dir: 存储目录
+            max_bytes: 文件总大小上限（字节），超出时淘汰最久未访问的文件
+            max_age: 文件最长未访问时间（秒），超过后淘汰
+            evict_interval: 两次淘汰扫描之间的最短间隔（秒）
+        """
+        self.root_dir = str(root_dir)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_interval = evict_interval
+        self._lock = threading.Lock()
+        self._last_evict = 0.0
+        self._stats = {"hits": 0, "writes": 0, "evicted": 0}
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    @staticmethod
+    def artifact_name(kind: str, image_hash: str, cam_method: str, class_index: int, model_version: str) -> str:
+        """
+        生成结果文件名
+
+        Args:
+            kind: 文件类型（heatmap / superimposed）
+            image_hash: 原图内容哈希
+            cam_method: CAM方法
+            class_index: 热力图对应的类别
+            model_version: 模型版本
+        """
+        digest = hashlib.sha1(
+            f"{image_hash}:{cam_method}:{class_index}:{model_version}".encode('utf-8')
+        ).hexdigest()
+        return f"{kind}_{cam_method}_{digest}.png"
+
+    def path(self, name: str) -> str:
+        """结果文件的完整路径"""
+        return os.path.join(self.root_dir, os.path.basename(name))
+
+    def exists(self, name: str) -> bool:
+        """文件是否存在，存在时刷新访问时间"""
+        path = self.path(name)
+        if not os.path.exists(path):
+            return False
+        self.touch(name)
+        with self._lock:
+            self._stats["hits"] += 1
+        return True
+
+    def touch(self, name: str):
+        """刷新文件的访问时间"""
+        try:
+            os.utime(self.path(name), None)
+        except OSError:
+            pass
+
+    def save(self, name: str, writer: Callable[[str], Any]) -> str:
+        """
+        写入结果文件
+
+        先写临时文件再原子替换，并发写入相同文件时不会读到半个文件
+
+        Args:
+            name: 文件名
+            writer: 接收目标路径并写入文件的函数
+
+        Returns:
+            文件完整路径
+        """
+        path = self.path(name)
+        root, ext = os.path.splitext(path)
+        tmp_path = f"{root}.{uuid.uuid4().hex}.tmp{ext}"
+        try:
+            writer(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        with self._lock:
+            self._stats["writes"] += 1
+        self.maybe_evict()
+        return path
+
+    def maybe_evict(self):
+        """距上次扫描超过间隔时执行淘汰"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_evict < self.evict_interval:
+                return
+            self._last_evict = now
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        淘汰过期文件，并按最近访问时间淘汰直到总大小不超过上限
+
+        Returns:
+            删除的文件数
+        """
+        entries = []
+        for name in os.listdir(self.root_dir):
+            if not name.startswith(MANAGED_PREFIXES) or '.tmp' in name:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.root_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        entries.sort()
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, name in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.root_dir, name))
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+
+        if removed:
+            logger.info(f"结果存储淘汰 {removed} 个文件，当前大小 {total / 1024 / 1024:.1f}MB")
+            with self._lock:
+                self._stats["evicted"] += removed
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取存储统计信息"""
+        with self._lock:
+            return {
+                "root_dir": self.root_dir,
+                "max_bytes": self.max_bytes,
+                "max_age": self.max_age,
+                **self._stats
+            }
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+语义答案缓存
+基于问题向量的相似度检索已回答的问题，相似度超过阈值时直接复用答案
+"""
+
+import logging
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def normalize_question(question: str) -> str:
+    """
+    规范化问题文本
+
+    只统一全角/半角字符与大小写、合并连续空白并去掉结尾的问号，
+    使"什么是高血压？"与"什么是高血压"得到相同结果；
+    数字和 . / % - 等符号原样保留，"1.5克"与"15克"、"140/90"与"14090"不会被合并
+    """
+    text = unicodedata.normalize('NFKC', question or '').lower()
+    text = ' '.join(text.split())
+    return text.rstrip('?').rstrip()
+
+class SemanticAnswerCache:
+    """语义答案缓存（进程内向量索引）"""
+
+    def __init__(self, similarity_threshold: float = 0.95, max_entries: int = 5000, ttl: int = 3600):
+        """
+        初始化缓存
+
+        Args:
+            similarity_threshold: 命中所需的最小余弦相似度
+            max_entries: 最大缓存条目数，超出时淘汰最早写入的条目
+            ttl: 条目有效期（秒）
+        """
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._vectors = None  # (max_entries, dim) 单位向量矩阵
+        self._questions = [None] * max_entries
+        self._answers = [None] * max_entries
+        self._expires_at = np.zeros(max_entries, dtype=np.float64)
+        self._next_slot = 0
+        self._size = 0
+        self._stats = {"hits": 0, "misses": 0}
+
+    def lookup(self, embedding: np.ndarray) -> Optional[Dict[str, Any]]:
+        """
+        检索最相似的已回答问题
+
+        Args:
+            embedding: 问题向量
+
+        Returns:
+            命中时返回 {'answer', 'question', 'similarity'}，否则返回None
+        """
+        query = self._normalize_vector(embedding)
+        with self._lock:
+            if self._vectors is None or self._size == 0 or query.shape[0] != self._vectors.shape[1]:
+                self._stats["misses"] += 1
+                return None
+
+            similarities = self._vectors[:self._size] @ query
+            # 过期条目不参与匹配
+            similarities[self._expires_at[:self._size] < time.time()] = -1.0
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.similarity_threshold:
+                self._stats["misses"] += 1
+                return None
+
+            self._stats["hits"] += 1
+            return {
+                'answer': self._answers[best],
+                'question': self._questions[best],
+                'similarity': similarity
+            }
+
+    def add(self, question: str, embedding: np.ndarray, answer: str):
+        """
+        写入已回答的问题
+
+        Args:
+            question: 规范化后的问题
+            embedding: 问题向量
+            answer: 答案
+        """
+        vector = self._normalize_vector(embedding)
+        with self._lock:
+            if self._vectors is None or vector.shape[0] != self._vectors.shape[1]:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                self._next_slot = 0
+                self._size = 0
+
+            slot = self._next_slot
+            self._vectors[slot] = vector
+            self._questions[slot] = question
+            self._answers[slot] = answer
+            self._expires_at[slot] = time.time() + self.ttl
+            self._next_slot = (slot + 1) % self.max_entries
+            self._size = min(self._size + 1, self.max_entries)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._vectors = None
+            self._questions = [None] * self.max_entries
+            self._answers = [None] * self.max_entries
+            self._expires_at[:] = 0
+            self._next_slot = 0
+            self._size = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            return {
+                "size": self._size,
+                "max_entries": self.max_entries,
+                "similarity_threshold": self.similarity_threshold,
+                **self._stats
+            }
+
+    @staticmethod
+    def _normalize_vector(embedding: np.ndarray) -> np.ndarray:
+        """转换为float32单位向量"""
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
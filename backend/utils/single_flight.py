@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+请求合并（single-flight）
+相同键的并发请求只执行一次，其余请求等待并共享结果；
+进程内通过Future合并，跨进程通过Redis锁键和结果频道合并
+"""
+
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Any, Callable, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 未取得结果的标记
+_MISSING = object()
+
+class SingleFlight:
+    """请求合并器"""
+
+    def __init__(self, redis_manager=None, namespace: str = "singleflight",
+                 lock_ttl: int = 300, wait_timeout: float = 300, result_ttl: int = 60):
+        """
+        初始化请求合并器
+
+        Args:
+            redis_manager: Redis管理器，为None或未连接时只在进程内合并
+            namespace: Redis键前缀
+            lock_ttl: 跨进程锁的过期时间（秒），防止执行方崩溃后锁不释放
+            wait_timeout: 等待其他执行方结果的最长时间（秒）
+            result_ttl: 结果键的保留时间（秒），供错过发布消息的等待方读取
+        """
+        self.redis_manager = redis_manager
+        self.namespace = namespace
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        执行或等待相同键的请求
+
+        Args:
+            key: 请求键
+            fn: 实际执行的函数
+
+        Returns:
+            (结果, 是否共享了其他请求的结果)
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not is_leader:
+            logger.debug(f"等待进程内相同请求: {key[:50]}")
+            return future.result(timeout=self.wait_timeout), True
+
+        try:
+            result, shared = self._do_across_workers(key, fn)
+            future.set_result(result)
+            return result, shared
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _do_across_workers(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """通过Redis锁在多个进程之间合并请求"""
+        redis_mgr = self.redis_manager
+        if redis_mgr is None or not redis_mgr.redis_client:
+            return fn(), False
+
+        digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+        lock_key = f"{self.namespace}:lock:{digest}"
+        result_key = f"{self.namespace}:result:{digest}"
+        channel = f"{self.namespace}:channel:{digest}"
+        token = uuid.uuid4().hex
+
+        if redis_mgr.acquire_lock(lock_key, token, self.lock_ttl):
+            try:
+                result = fn()
+                redis_mgr.set_cache(result_key, result, timeout=self.result_ttl)
+                redis_mgr.publish(channel, result)
+                return result, False
+            finally:
+                redis_mgr.release_lock(lock_key, token)
+
+        logger.debug(f"等待其他进程的相同请求: {key[:50]}")
+        result = self._wait_for_result(lock_key, result_key, channel)
+        if result is not _MISSING:
+            return result, True
+
+        # 执行方失败或等待超时，自行执行
+        logger.warning(f"等待合并请求结果失败，自行执行: {key[:50]}")
+        return fn(), False
+
+    def _wait_for_result(self, lock_key: str, result_key: str, channel: str) -> Any:
+        """订阅结果频道等待执行方发布结果"""
+        redis_mgr = self.redis_manager
+        pubsub = redis_mgr.subscribe(channel)
+        if pubsub is None:
+            return _MISSING
+        try:
+            deadline = time.monotonic() + self.wait_timeout
+            while time.monotonic() < deadline:
+                # 订阅之前结果可能已经发布，先检查结果键
+                result = redis_mgr.get_cache(result_key)
+                if result is not None:
+                    return result
+                result = redis_mgr.get_message(pubsub, timeout=1.0)
+                if result is not None:
+                    return result
+                # 锁已释放但没有结果，说明执行方失败
+                if not redis_mgr.redis_client.exists(lock_key):
+                    result = redis_mgr.get_cache(result_key)
+                    return result if result is not None else _MISSING
+            return _MISSING
+        except Exception as e:
+            logger.warning(f"等待合并请求结果异常: {e}")
+            return _MISSING
+        finally:
+            try:
+                pubsub.close()
+            except Exception:
+                pass
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+胸部X光图片预处理
+OpenCV解码一次，INTER_AREA缩放后直接归一化写入输出张量，
+解码得到的数组同时用于热力图叠加；单通道图片全程保持uint8灰度，
+只在写入模型输入时广播到3个通道。
+与torchvision后端（PIL解码 + 双线性缩放）数值接近但不逐像素一致，
+两个后端的结果缓存相互独立
+"""
+
+from typing import Tuple
+
+import cv2
+import numpy as np
+import torch
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+class XrayPreprocessor:
+    """胸部X光图片预处理器"""
+
+    def __init__(self, input_size: Tuple[int, int] = (512, 512),
+                 mean: Tuple[float, ...] = IMAGENET_MEAN, std: Tuple[float, ...] = IMAGENET_STD):
+        """
+        初始化预处理器
+
+        Args:
+            input_size: 模型输入尺寸 (height, width)
+            mean: RGB各通道均值
+            std: RGB各通道标准差
+        """
+        self.input_size = input_size
+        # 归一化合并为 pixel * scale - offset
+        self._scale = (1.0 / (255.0 * np.asarray(std, dtype=np.float32))).astype(np.float32)
+        self._offset = (np.asarray(mean, dtype=np.float32) / np.asarray(std, dtype=np.float32)).astype(np.float32)
+
+    def decode(self, image_bytes: bytes, grayscale: bool = True) -> np.ndarray:
+        """
+        从内存解码图片
+
+        Args:
+            image_bytes: 图片文件内容
+            grayscale: 是否保留单通道图片的灰度格式，为False时统一解码为BGR
+
+        Returns:
+            单通道图片返回 (H, W) 的uint8灰度数组，其余返回 (H, W, 3) 的uint8 BGR数组
+        """
+        buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+        # 按原始位深和通道解码（不按EXIF方向信息旋转），位深和通道转换与PIL的 convert('RGB') 保持一致
+        image = cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError('Invalid image file: cannot decode image')
+        if image.dtype == np.uint16:
+            if image.ndim == 2 or image.shape[2] == 1:
+                # 单通道16位（PIL的I;16模式）：大于255的值截断为255
+                image = np.minimum(image, 255).astype(np.uint8)
+            else:
+                # 多通道16位：PIL解码时取每个分量的高8位
+                image = (image >> 8).astype(np.uint8)
+        if image.ndim == 3:
+            if image.shape[2] == 1:
+                image = image[:, :, 0]
+            elif image.shape[2] == 4:
+                image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+        if not grayscale and image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        return image
+
+    def to_tensor(self, image: np.ndarray) -> torch.Tensor:
+        """
+        缩放并归一化为模型输入，灰度图在写入时广播到RGB三个通道
+
+        每次调用分配新的输出数组，归一化结果直接写入其中，不产生中间数组；
+        返回的张量归调用方所有，可以跨请求保留（如微批合并时）
+
+        Returns:
+            形状为 (1, 3, H, W) 的float32张量，通道顺序为RGB
+        """
+        height, width = self.input_size
+        resized = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        buffer = np.empty((1, 3, height, width), dtype=np.float32)
+        for channel in range(3):
+            # BGR第2-channel个通道对应RGB第channel个通道
+            source = resized if resized.ndim == 2 else resized[:, :, 2 - channel]
+            np.multiply(source, self._scale[channel], out=buffer[0, channel])
+            buffer[0, channel] -= self._offset[channel]
+        return torch.from_numpy(buffer)